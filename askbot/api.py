@@ -4,9 +4,12 @@ in the askbot.models module, but
 api must become a place to manupulate the data in the askbot application
 so that other implementations of the data storage could be possible
 """
+from django.core.cache import cache
 from django.db.models import Q
 from askbot import models
 from askbot import const
+from askbot.models.user import MODERATION_ITEMS_VERSION_KEY
+from askbot.utils.cache import get_cache_version
 
 def get_info_on_moderation_items(user):
     """returns a dictionary with 
@@ -18,6 +21,14 @@ def get_info_on_moderation_items(user):
     if not(user.is_moderator() or user.is_administrator()):
         return None
 
+    cache_key = 'askbot-moderation-items-%d-%d' % (
+                            user.id,
+                            get_cache_version(MODERATION_ITEMS_VERSION_KEY)
+                        )
+    info = cache.get(cache_key)
+    if info is not None:
+        return info
+
     messages = models.ActivityAuditStatus.objects.filter(
         activity__activity_type = const.TYPE_ACTIVITY_MARK_OFFENSIVE,
         user = user
@@ -29,10 +40,12 @@ def get_info_on_moderation_items(user):
     new_count = messages.filter(
                     status = models.ActivityAuditStatus.STATUS_NEW
                 ).count()
-    return {
+    info = {
         'seen_count': seen_count,
         'new_count': new_count
     }
+    cache.set(cache_key, info)
+    return info
 
 def get_admin(seed_user_id = None):
     """returns user objects with id == seed_user_id
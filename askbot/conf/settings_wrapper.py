@@ -19,11 +19,95 @@ for the most part, so actual values are reliably available only
 at run time
 
 askbot.deps.livesettings is a module developed for satchmo project
+
+values of all settings are copied into :class:`SettingsSnapshot`
+in the memory of the process, so that reading a setting is a dictionary
+lookup. The snapshot is reloaded when the version counter
+in the shared cache changes - it is checked once per request,
+on the first read of a setting, and, outside of the requests
+(in celery workers and management commands), when the snapshot
+is older than ``ASKBOT_SETTINGS_CHECK_INTERVAL`` seconds
+(django setting, 5 by default) - and the counter is bumped
+whenever a setting is updated. If the snapshot cannot be loaded,
+the settings are read one by one.
 """
+import logging
+import threading
+import time
+from django.conf import settings as django_settings
 from django.core.cache import cache
+from django.core.signals import request_started
+from django.db.models import loading
 from askbot.deps.livesettings import SortedDotDict, config_register
 from askbot.deps.livesettings.functions import config_get
 from askbot.deps.livesettings import signals
+from askbot.utils.cache import get_cache_version, bump_cache_version
+
+VERSION_KEY = 'askbot-livesettings-version'
+
+def get_check_interval():
+    return getattr(django_settings, 'ASKBOT_SETTINGS_CHECK_INTERVAL', 5)
+
+
+class SettingsSnapshot(object):
+    """copy of the values of all settings"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = None
+        self.version = None
+        self.is_stale = True
+        self.check_time = 0
+
+    def get_values(self, settings):
+        """returns dictionary of setting values or None,
+        when the snapshot cannot be used yet - then
+        the settings are to be read one by one
+        """
+        if time.time() - self.check_time > get_check_interval():
+            self.is_stale = True
+        if self.is_stale and loading.app_cache_ready():
+            #if the snapshot is being loaded, possibly by this same
+            #thread - reading some of the values, the old one is used
+            if self.lock.acquire(False):
+                try:
+                    self.refresh(settings)
+                finally:
+                    self.lock.release()
+        return self.values
+
+    def refresh(self, settings):
+        version = get_cache_version(VERSION_KEY)
+        if version != self.version or self.values is None:
+            try:
+                self.values = self.load_values(settings)
+            except Exception:
+                logging.exception('could not load the settings snapshot')
+                self.values = None
+            self.version = version
+        self.is_stale = False
+        self.check_time = time.time()
+
+    def load_values(self, settings):
+        values = dict()
+        for key in settings.keys():
+            values[key] = settings[key].value
+        return values
+
+    def mark_stale(self, **kwargs):
+        """makes the snapshot check the version on the next read,
+        used as request_started signal handler"""
+        self.is_stale = True
+
+    def invalidate(self, **kwargs):
+        """makes snapshots of all processes stale,
+        used as configuration_value_changed signal handler"""
+        bump_cache_version(VERSION_KEY)
+        self.values = None
+        self.is_stale = True
+
+
+SETTINGS_SNAPSHOT = SettingsSnapshot()
 
 class ConfigSettings(object):
     """A very simple Singleton wrapper for settings
@@ -47,6 +131,9 @@ class ConfigSettings(object):
         will be required in code to convert an app
         depending on django.conf.settings to askbot.deps.livesettings
         """
+        values = SETTINGS_SNAPSHOT.get_values(self.__instance)
+        if values is not None and key in values:
+            return values[key]
         return getattr(self.__instance, key).value
 
     def update(self, key, value):
@@ -76,6 +163,9 @@ class ConfigSettings(object):
             self.__group_map[key] = group_key
 
     def as_dict(self):
+        values = SETTINGS_SNAPSHOT.get_values(self.__instance)
+        if values is not None:
+            return dict(values)
         settings = cache.get('askbot-livesettings')
         if settings:
             return settings
@@ -95,5 +185,7 @@ class ConfigSettings(object):
 
 
 signals.configuration_value_changed.connect(ConfigSettings.prime_cache)
+signals.configuration_value_changed.connect(SETTINGS_SNAPSHOT.invalidate)
+request_started.connect(SETTINGS_SNAPSHOT.mark_stale)
 #settings instance to be used elsewhere in the project
 settings = ConfigSettings()
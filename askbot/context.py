@@ -1,6 +1,9 @@
 """Askbot template context processor that makes some parameters
 from the django settings, all parameters from the askbot livesettings
 and the application available for the templates
+
+values are computed only when templates use them,
+so responses that are not rendered from templates do not pay for them
 """
 from django.conf import settings
 import askbot
@@ -9,18 +12,76 @@ from askbot.conf import settings as askbot_settings
 from askbot.skins.loaders import get_skin
 from askbot.utils import url_utils
 
+#values added to the askbot livesettings
+EXTRA_SETTINGS = {
+    'LANGUAGE_CODE': lambda: settings.LANGUAGE_CODE,
+    'ASKBOT_URL': lambda: settings.ASKBOT_URL,
+    'DEBUG': lambda: settings.DEBUG,
+    'ASKBOT_VERSION': askbot.get_version,
+    'LOGIN_URL': url_utils.get_login_url,
+    'LOGOUT_URL': url_utils.get_logout_url,
+    'LOGOUT_REDIRECT_URL': url_utils.get_logout_redirect_url,
+}
+
+class TemplateSettings(object):
+    """dictionary-like access to the askbot livesettings
+    and to the ``EXTRA_SETTINGS``, values are read on access
+    """
+    def __getitem__(self, key):
+        if key in EXTRA_SETTINGS:
+            return EXTRA_SETTINGS[key]()
+        try:
+            return getattr(askbot_settings, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class LazyValue(object):
+    """proxy for the value returned by the function,
+    the function is called on the first use of the value
+    """
+    def __init__(self, function, *args):
+        self.function = function
+        self.args = args
+        self.is_evaluated = False
+        self.value = None
+
+    def get_value(self):
+        if not self.is_evaluated:
+            self.value = self.function(*self.args)
+            self.is_evaluated = True
+        return self.value
+
+    def __nonzero__(self):
+        return bool(self.get_value())
+
+    def __getitem__(self, key):
+        return self.get_value()[key]
+
+    def __unicode__(self):
+        return unicode(self.get_value())
+
+
 def application_settings(request):
     """The context processor function"""
-    my_settings = askbot_settings.as_dict()
-    my_settings['LANGUAGE_CODE'] = settings.LANGUAGE_CODE
-    my_settings['ASKBOT_URL'] = settings.ASKBOT_URL
-    my_settings['DEBUG'] = settings.DEBUG
-    my_settings['ASKBOT_VERSION'] = askbot.get_version()
-    my_settings['LOGIN_URL'] = url_utils.get_login_url()
-    my_settings['LOGOUT_URL'] = url_utils.get_logout_url()
-    my_settings['LOGOUT_REDIRECT_URL'] = url_utils.get_logout_redirect_url()
     return {
-        'settings': my_settings,
+        'settings': TemplateSettings(),
         'skin': get_skin(request),
-        'moderation_items': api.get_info_on_moderation_items(request.user)
+        'moderation_items': LazyValue(
+                                api.get_info_on_moderation_items,
+                                request.user
+                            )
     }
@@ -472,6 +472,11 @@ class AdvancedSearchForm(forms.Form):
     author = forms.IntegerField(required=False)
     page_size = forms.ChoiceField(choices=const.PAGE_SIZE_CHOICES, required=False)
     page = forms.IntegerField(required=False)
+    cursor = forms.RegexField(
+                        regex = r'^-?\d{1,20}_\d{1,20}$',
+                        max_length = 64,
+                        required = False
+                    )
 
     def clean_tags(self):
         if 'tags' in self.cleaned_data:
@@ -522,6 +527,7 @@ class AdvancedSearchForm(forms.Form):
         cleanup_dict(data, 'start_over', False)
         cleanup_dict(data, 'author', None)
         cleanup_dict(data, 'page', None)
+        cleanup_dict(data, 'cursor', '')
         cleanup_dict(data, 'page_size', None)
         return data
 
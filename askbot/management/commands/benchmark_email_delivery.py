@@ -0,0 +1,112 @@
+"""benchmark_email_delivery management command
+renders and "sends" a number of instant notification emails
+to measure throughput of the mail delivery layer offline
+
+by default messages are written to files in a temporary directory,
+``--backend=console`` prints them to the standard output,
+``--backend=locmem`` keeps them in memory, any other value
+is used as the dotted path to an email backend class
+
+python manage.py benchmark_email_delivery --count=1000 --pool-size=4
+"""
+import shutil
+import tempfile
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from django.template import Context
+from askbot.skins.loaders import get_template
+from askbot.utils import mail
+
+BACKENDS = {
+    'file': 'django.core.mail.backends.filebased.EmailBackend',
+    'console': 'django.core.mail.backends.console.EmailBackend',
+    'locmem': 'django.core.mail.backends.locmem.EmailBackend',
+}
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--count',
+            action = 'store',
+            type = 'int',
+            dest = 'count',
+            default = 1000,
+            help = 'number of messages to send'
+        ),
+        make_option('--backend',
+            action = 'store',
+            type = 'str',
+            dest = 'backend',
+            default = 'file',
+            help = 'file, console, locmem or path to the email backend'
+        ),
+        make_option('--pool-size',
+            action = 'store',
+            type = 'int',
+            dest = 'pool_size',
+            default = 1,
+            help = 'number of connections used in parallel'
+        ),
+        make_option('--render-workers',
+            action = 'store',
+            type = 'int',
+            dest = 'render_workers',
+            default = 1,
+            help = 'number of threads rendering the messages'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        count = options['count']
+        backend = BACKENDS.get(options['backend'], options['backend'])
+        template = get_template('instant_notification.html')
+
+        def render(number):
+            data = {
+                'update_author_name': 'author',
+                'receiving_user_name': 'user%d' % number,
+                'content_preview': '<p>answer text</p>' * 20,
+                'update_type': 'new_answer',
+                'post_url': 'http://example.com/question/%d/' % number,
+                'origin_post_title': 'question %d' % number,
+                'user_subscriptions_url': 'http://example.com/users/%d/' % number,
+            }
+            return mail.make_message(
+                        subject_line = 'question %d' % number,
+                        body_text = template.render(Context(data)),
+                        recipient_list = ['user%d@example.com' % number]
+                    )
+
+        start_time = time.time()
+        messages = mail.render_messages(
+                                render,
+                                range(count),
+                                worker_count = options['render_workers']
+                            )
+        render_time = time.time() - start_time
+
+        connection_kwargs = dict()
+        temp_dir = None
+        if backend == BACKENDS['file']:
+            temp_dir = tempfile.mkdtemp()
+            connection_kwargs['file_path'] = temp_dir
+        try:
+            sender = mail.MailSender(
+                            backend = backend,
+                            pool_size = options['pool_size'],
+                            **connection_kwargs
+                        )
+            start_time = time.time()
+            sent_count = sender.send(messages)
+            send_time = time.time() - start_time
+        finally:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir)
+
+        print 'rendered %d messages in %.2f sec (%.1f per second)' % (
+                        len(messages), render_time, len(messages) / max(render_time, 1e-6)
+                    )
+        print 'sent %d messages in %.2f sec (%.1f per second), %d failed' % (
+                        sent_count, send_time, sent_count / max(send_time, 1e-6),
+                        sender.failed_count
+                    )
@@ -0,0 +1,81 @@
+"""benchmark_html_sanitizer management command
+compares speed and output of the DOM based and the streaming
+modes of :func:`askbot.utils.html.sanitize_html`
+on the html of the latest revisions of questions and answers
+
+python manage.py benchmark_html_sanitizer --count=1000
+"""
+import time
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from askbot import models
+from askbot.utils import html
+from askbot.utils import markup
+
+def time_call(function, items, repeat):
+    start_time = time.time()
+    for iteration in range(repeat):
+        for item in items:
+            function(item)
+    return time.time() - start_time
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--count',
+            action = 'store',
+            type = 'int',
+            dest = 'count',
+            default = 1000,
+            help = 'number of revisions of each kind of posts to use'
+        ),
+        make_option('--repeat',
+            action = 'store',
+            type = 'int',
+            dest = 'repeat',
+            default = 1,
+            help = 'number of times to sanitize the revisions'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        count = options['count']
+        repeat = options['repeat']
+        texts = list()
+        for revision_model in (models.QuestionRevision, models.AnswerRevision):
+            revisions = revision_model.objects.order_by('-id')[:count]
+            texts.extend(revisions.values_list('text', flat = True))
+        parser_settings = markup.get_parser_settings()
+        fragments = [
+            markup.get_parser(parser_settings).convert(text) for text in texts
+        ]
+        if len(fragments) == 0:
+            print 'there are no revisions to sanitize'
+            return
+
+        fallback_count = 0
+        mismatch_count = 0
+        for fragment in fragments:
+            if html.get_streamed_tokens(fragment) is None:
+                fallback_count += 1
+            expected = html.sanitize_html_with_dom(fragment)
+            if html.sanitize_html_streaming(fragment) != expected:
+                mismatch_count += 1
+
+        dom_time = time_call(html.sanitize_html_with_dom, fragments, repeat)
+        streaming_time = time_call(html.sanitize_html_streaming, fragments, repeat)
+
+        total = len(fragments) * repeat
+        print 'sanitized %d fragments, %d characters on average' % (
+                        len(fragments),
+                        sum(map(len, fragments)) / len(fragments)
+                    )
+        print 'dom: %.2f sec (%.1f per second)' % (
+                        dom_time, total / max(dom_time, 1e-6)
+                    )
+        print 'streaming: %.2f sec (%.1f per second), %.1f times faster' % (
+                        streaming_time, total / max(streaming_time, 1e-6),
+                        dom_time / max(streaming_time, 1e-6)
+                    )
+        print '%d fragments fell back to the dom, %d outputs differ' % (
+                        fallback_count, mismatch_count
+                    )
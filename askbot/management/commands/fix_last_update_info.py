@@ -0,0 +1,54 @@
+"""fix_last_update_info management command
+fills the denormalized time and author of the latest update
+(``last_update_at`` and ``last_update_by``) of the answers and questions
+
+to run type (on the command line:)
+
+python manage.py fix_last_update_info
+
+by default only posts where the fields are empty are processed,
+``--all`` recalculates them for all posts
+"""
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from askbot import models
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all',
+            action = 'store_true',
+            dest = 'all',
+            default = False,
+            help = 'recalculate the fields for all posts'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        answers = models.Answer.objects.all()
+        questions = models.Question.objects.all()
+        if options['all'] == False:
+            answers = answers.filter(last_update_at__isnull = True)
+            questions = questions.filter(last_update_at__isnull = True)
+
+        #update() is used so that the save signals are not sent
+        answer_count = 0
+        for answer in answers.iterator():
+            when, who = answer.compute_last_update_info()
+            models.Answer.objects.filter(id = answer.id).update(
+                                    last_update_at = when,
+                                    last_update_by = who
+                                )
+            answer_count += 1
+
+        question_count = 0
+        for question in questions.iterator():
+            when, who = question.compute_thread_update_info()
+            models.Question.objects.filter(id = question.id).update(
+                                    last_update_at = when,
+                                    last_update_by = who
+                                )
+            question_count += 1
+
+        print 'updated %d answers and %d questions' % (
+                                            answer_count, question_count
+                                        )
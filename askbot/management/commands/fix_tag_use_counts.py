@@ -0,0 +1,18 @@
+"""fix_tag_use_counts management command
+recalculates use counts of the tags (``Tag.used_count``)
+
+the counts are changed incrementally when questions are
+retagged, deleted and restored, this command repairs
+the counts if they have drifted from the actual numbers
+
+to run type (on the command line:)
+
+python manage.py fix_tag_use_counts
+"""
+from django.core.management.base import NoArgsCommand
+from askbot import models
+
+class Command(NoArgsCommand):
+    def handle_noargs(self, **options):
+        fixed_count = models.Tag.objects.recount_use_counts()
+        print 'fixed use counts of %d tags' % fixed_count
@@ -0,0 +1,34 @@
+"""precompile_templates management command
+compiles templates of all skins, so that with the
+``ASKBOT_TEMPLATE_BYTECODE_CACHE`` setting the processes
+started after deployment load the compiled templates
+from the bytecode cache
+
+python manage.py precompile_templates
+"""
+import sys
+from django.core.management.base import NoArgsCommand
+from jinja2.exceptions import TemplateError
+from askbot.skins.loaders import SKINS, get_bytecode_cache
+
+class Command(NoArgsCommand):
+
+    def handle_noargs(self, **options):
+        if get_bytecode_cache() is None:
+            print >> sys.stderr, 'ASKBOT_TEMPLATE_BYTECODE_CACHE is not set, ' + \
+                                'compiled templates will not be saved'
+        error_count = 0
+        for skin_name, skin in SKINS.items():
+            template_names = skin.list_skin_templates()
+            for template_name in template_names:
+                try:
+                    skin.get_template(template_name)
+                except TemplateError, e:
+                    error_count += 1
+                    print >> sys.stderr, 'could not compile %s in skin %s: %s' \
+                                        % (template_name, skin_name, e)
+            if int(options.get('verbosity', 1)) > 0:
+                print 'compiled %d templates of skin %s' \
+                        % (len(template_names), skin_name)
+        if error_count:
+            sys.exit(1)
@@ -0,0 +1,19 @@
+"""rebuild_search_index management command
+re-creates the index of the full text search backend
+and compacts the journal of the index updates,
+can be run periodically from cron
+
+python manage.py rebuild_search_index
+"""
+from django.core.management.base import NoArgsCommand, CommandError
+from askbot import models
+from askbot.search.backends import get_backend
+
+class Command(NoArgsCommand):
+    def handle_noargs(self, **options):
+        backend = get_backend()
+        try:
+            count = backend.rebuild(models.Question.objects.all())
+        except NotImplementedError, e:
+            raise CommandError(unicode(e))
+        print 'Indexed %d questions' % count
@@ -50,6 +50,8 @@ Tag names are case sensitive, non-ascii characters are also accepted.
 * if --user-id is provided, it will be used to set the user performing the operation
 * The user must be either administrator or moderator
 * if --user-id is not given, the earliest active site administrator will be assigned
+* questions are retagged without notifications, if --record-activity is given,
+  one activity record is created for the whole operation
 
 Both --to and --from arguments accept multiple tags, but the argument must be quoted
 in that case (e.g. --from="raw material" --to="raw-material"), thus tags
@@ -81,6 +83,12 @@ ask you to confirm your action before making changes.
             default = None,
             help = 'id of the user who will be marked as a performer of this operation'
         ),
+        make_option('--record-activity',
+            action = 'store_true',
+            dest = 'record_activity',
+            default = False,
+            help = 'record one activity of the tag update for the whole operation'
+        ),
     )
 
     #@transaction.commit_manually
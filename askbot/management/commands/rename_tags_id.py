@@ -3,7 +3,8 @@ one tag to another and deletes the "from" tag
 
 both "from" and "to" tags are identified by id
 
-also, corresponding questions are retagged
+also, corresponding questions are retagged in bulk,
+without notifications, see :mod:`askbot.models.bulk_retag`
 """
 import re
 import sys
@@ -11,6 +12,7 @@ from optparse import make_option
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from askbot import const, models
+from askbot.models import bulk_retag
 from askbot.utils import console
 from askbot.management.commands.rename_tags import get_admin
 
@@ -78,6 +80,12 @@ rename_tags, but using tag id's
             default = None,
             help = 'id of the user who will be marked as a performer of this operation'
         ),
+        make_option('--record-activity',
+            action = 'store_true',
+            dest = 'record_activity',
+            default = False,
+            help = 'record one activity of the tag update for the whole operation'
+        ),
     )
 
     #@transaction.commit_manually
@@ -135,25 +143,22 @@ or repost a bug, if that does not help"""
             sys.stdout.write('Processing:')
 
         #actual processing stage, only after this point we start to
-        #modify stuff in the database, one question per transaction
-        from_tag_names = get_tag_names(from_tags)
-        to_tag_names = get_tag_names(to_tags)
-        i = 0
-        for question in questions:
-            tag_names = set(question.get_tag_names())
-            tag_names.update(to_tag_names)
-            tag_names.difference_update(from_tag_names)
-
-            admin.retag_question(
-                question = question,
-                tags = u' '.join(tag_names),
-                #silent = True #do we want to timestamp activity on question
-            )
-            i += 1
-            sys.stdout.write('%6.2f%%' % (100*float(i)/float(question_count)))
+        #modify stuff in the database, one chunk of questions per transaction
+        def show_progress(processed_count):
+            percent = 100*float(processed_count)/float(question_count)
+            sys.stdout.write('%6.2f%%' % percent)
             sys.stdout.write('\b'*7)
             sys.stdout.flush()
 
+        bulk_retag.retag_questions(
+                    question_ids = list(questions.values_list('id', flat = True)),
+                    from_tags = from_tags,
+                    to_tags = to_tags,
+                    user = admin,
+                    record_activity = options['record_activity'],
+                    progress_callback = show_progress
+                )
+
         sys.stdout.write('\n')
         #transaction.commit()
 
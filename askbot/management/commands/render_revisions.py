@@ -0,0 +1,79 @@
+"""render_revisions management command
+stores html and the html diff against the previous revision
+for the revisions of questions and answers that were saved
+without them
+
+python manage.py render_revisions
+
+with ``--all`` every revision is rendered again,
+e.g. after the markup settings were changed
+"""
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from askbot import models
+
+def render_revisions(revision_model, post_field_name, render_all, chunk_size):
+    """renders revisions of the posts, in chunks of posts,
+    returns number of the updated revisions"""
+    revisions = revision_model.objects.all()
+    if not render_all:
+        revisions = revisions.filter(html__isnull = True)
+    post_id_field = post_field_name + '_id'
+    post_ids = list(
+                revisions.values_list(post_field_name, flat = True).distinct()
+            )
+    post_ids.sort()
+    updated_count = 0
+    for start in range(0, len(post_ids), chunk_size):
+        chunk = post_ids[start:start + chunk_size]
+        post_revisions = revision_model.objects.filter(
+                                    **{post_field_name + '__in': chunk}
+                                ).order_by(post_field_name, 'revision')
+        previous_revision = None
+        for revision in post_revisions:
+            if previous_revision is not None and \
+                getattr(previous_revision, post_id_field) != \
+                getattr(revision, post_id_field):
+                previous_revision = None
+            if render_all or revision.html is None:
+                revision.render(previous_revision)
+                revision_model.objects.filter(
+                                    id = revision.id
+                                ).update(
+                                    html = revision.html,
+                                    diff = revision.diff
+                                )
+                updated_count += 1
+            previous_revision = revision
+    return updated_count
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all',
+            action = 'store_true',
+            dest = 'render_all',
+            default = False,
+            help = 'render also the revisions that have the html'
+        ),
+        make_option('--chunk-size',
+            action = 'store',
+            type = 'int',
+            dest = 'chunk_size',
+            default = 100,
+            help = 'number of posts whose revisions are loaded at once'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        for revision_model, post_field_name in (
+                    (models.QuestionRevision, 'question'),
+                    (models.AnswerRevision, 'answer')
+                ):
+            updated_count = render_revisions(
+                                    revision_model,
+                                    post_field_name,
+                                    options['render_all'],
+                                    options['chunk_size']
+                                )
+            if int(options.get('verbosity', 1)) > 0:
+                print 'rendered %d %s revisions' % (updated_count, post_field_name)
@@ -1,11 +1,28 @@
+"""send_email_alerts management command
+sends email digests of the updated questions
+to the users with the daily and weekly subscriptions
+
+users are processed in chunks (option ``--chunk-size``), and
+all data needed for the digests of the whole chunk - subscriptions,
+candidate questions, question views, comments, mentions, records
+of the previously sent emails and counts of the news per question -
+is read with a fixed number of grouped queries per chunk,
+independently of the number of users and questions in the chunk
+
+with ``--verbosity=2`` progress and time spent in each phase
+of the work are printed to the console
+"""
 import datetime
+import time
+from optparse import make_option
 from django.core.management.base import NoArgsCommand
 from django.core.urlresolvers import reverse
 from django.db import connection
-from django.db.models import Q, F
-from askbot.models import User, Question, Answer, Tag, QuestionRevision
+from django.db.models import Q
+from askbot.models import User, Question, Answer, QuestionRevision
 from askbot.models import AnswerRevision, Activity, EmailFeedSetting
-from askbot.models import Comment
+from askbot.models import Comment, QuestionView, MarkedTag
+from askbot.models import ActivityAuditStatus
 from askbot.models.question import get_tag_summary_from_questions
 from django.utils.translation import ugettext as _
 from django.utils.translation import ungettext
@@ -14,17 +31,105 @@ from askbot.conf import settings as askbot_settings
 from django.utils.datastructures import SortedDict
 from django.contrib.contenttypes.models import ContentType
 from askbot import const
+from askbot import forms
 from askbot.utils import mail
 from askbot.utils.slug import slugify
 
 DEBUG_THIS_COMMAND = False
 
-def get_all_origin_posts(mentions):
-    origin_posts = set()
-    for mention in mentions:
-        post = mention.content_object
-        origin_posts.add(post.get_origin_post())
-    return list(origin_posts)
+EMAIL_UPDATE_ACTIVITY = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
+LONG_TIME_AGO = datetime.datetime(1970, 1, 1)
+
+#maximum number of values in one sql "IN" clause
+MAX_IN_CLAUSE_SIZE = 500
+
+def split_list(items, size):
+    """yields consecutive pieces of the list of ``size`` items each"""
+    items = list(items)
+    for start in xrange(0, len(items), size):
+        yield items[start:start + size]
+
+def filter_by_ids(queryset, field_name, ids):
+    """iterates over items of the query set with the value
+    of the field in the ``ids``, runs one query per
+    ``MAX_IN_CLAUSE_SIZE`` id's
+    """
+    lookup = str(field_name + '__in')
+    for id_list in split_list(ids, MAX_IN_CLAUSE_SIZE):
+        for item in queryset.filter(**{lookup: id_list}):
+            yield item
+
+def get_origin_question_ids(post_keys):
+    """returns dictionary that maps keys (content type id, object id)
+    of questions, answers and comments to the id's
+    of the questions to which those posts belong
+    """
+    question_type_id = ContentType.objects.get_for_model(Question).id
+    answer_type_id = ContentType.objects.get_for_model(Answer).id
+    comment_type_id = ContentType.objects.get_for_model(Comment).id
+
+    comment_ids = [key[1] for key in post_keys if key[0] == comment_type_id]
+    comment_parents = dict()
+    comments = Comment.objects.values_list('id', 'content_type', 'object_id')
+    for comment_id, content_type_id, object_id in \
+            filter_by_ids(comments, 'id', comment_ids):
+        comment_parents[comment_id] = (content_type_id, object_id)
+
+    def get_parent_key(key):
+        if key[0] == comment_type_id:
+            return comment_parents.get(key[1], None)
+        return key
+
+    answer_ids = set()
+    for key in post_keys:
+        parent_key = get_parent_key(key)
+        if parent_key and parent_key[0] == answer_type_id:
+            answer_ids.add(parent_key[1])
+    answers = Answer.objects.values_list('id', 'question')
+    answer_questions = dict(filter_by_ids(answers, 'id', answer_ids))
+
+    origin_ids = dict()
+    for key in post_keys:
+        parent_key = get_parent_key(key)
+        if parent_key is None:
+            continue
+        if parent_key[0] == question_type_id:
+            origin_ids[key] = parent_key[1]
+        elif parent_key[0] == answer_type_id \
+                and parent_key[1] in answer_questions:
+            origin_ids[key] = answer_questions[parent_key[1]]
+    return origin_ids
+
+def get_followed_question_ids(user_ids):
+    """returns list of pairs (user id, question id)
+    of the questions followed by the users,
+    read directly from the table of the many-to-many relation
+    """
+    if len(user_ids) == 0:
+        return []
+    qn = connection.ops.quote_name
+    field = Question._meta.get_field('followed_by')
+    sql = 'SELECT %s, %s FROM %s WHERE %s IN (%s)' % (
+                    qn(field.m2m_reverse_name()),
+                    qn(field.m2m_column_name()),
+                    qn(field.m2m_db_table()),
+                    qn(field.m2m_reverse_name()),
+                    ', '.join(['%s'] * len(user_ids))
+                )
+    cursor = connection.cursor()
+    cursor.execute(sql, list(user_ids))
+    return cursor.fetchall()
+
+def matches_tags(tag_names, selected_tag_names, wildcards):
+    """True if any of the tag names is selected
+    or matches any of the wildcards"""
+    for tag_name in tag_names:
+        if tag_name in selected_tag_names:
+            return True
+        for wildcard in wildcards:
+            if tag_name.startswith(wildcard[:-1]):
+                return True
+    return False
 
 #todo: refactor this as class
 def extend_question_list(
@@ -75,432 +180,781 @@ def format_action_count(string, number, output):
     if number > 0:
         output.append(_(string) % {'num':number})
 
-class Command(NoArgsCommand):
-    def handle_noargs(self, **options):
-        try:
-            try:
-                self.send_email_alerts()
-            except Exception, e:
-                print e
-        finally:
-            connection.close()
 
-    def get_updated_questions_for_user(self,user):
-        """
-        retreive relevant question updates for the user
-        according to their subscriptions and recorded question
-        views
-        """
+class PhaseTimer(object):
+    """accumulates time spent in the named phases of work"""
 
-        user_feeds = EmailFeedSetting.objects.filter(
-                                                subscriber=user
-                                            ).exclude(
-                                                frequency__in=('n', 'i')
-                                            )
+    def __init__(self):
+        self.totals = SortedDict()
+        self.phase = None
+        self.started_at = None
 
-        should_proceed = False
-        for feed in user_feeds:
-            if feed.should_send_now() == True:
-                should_proceed = True
-                break
+    def start(self, phase):
+        """stops the current phase and starts the next one"""
+        self.stop()
+        self.phase = phase
+        self.started_at = time.time()
+
+    def stop(self):
+        if self.phase is None:
+            return
+        elapsed = time.time() - self.started_at
+        self.totals[self.phase] = self.totals.get(self.phase, 0) + elapsed
+        self.phase = None
 
-        #shortcircuit - if there is no ripe feed to work on for this user
-        if should_proceed == False:
-            return {}
-
-        #these are placeholders for separate query sets per question group
-        #there are four groups - one for each EmailFeedSetting.feed_type
-        #and each group has subtypes A and B
-        #that's because of the strange thing commented below
-        #see note on Q and F objects marked with todo tag
-        q_sel_A = None
-        q_sel_B = None
-
-        q_ask_A = None
-        q_ask_B = None
-
-        q_ans_A = None
-        q_ans_B = None
-
-        q_all_A = None
-        q_all_B = None
-
-        #base question query set for this user
-        #basic things - not deleted, not closed, not too old
-        #not last edited by the same user
-        base_qs = Question.objects.exclude(
-                                last_activity_by=user
-                            ).exclude(
-                                last_activity_at__lt=user.date_joined#exclude old stuff
-                            ).exclude(
-                                deleted=True
-                            ).exclude(
-                                closed=True
-                            ).order_by('-last_activity_at')
-        #todo: for some reason filter on did not work as expected ~Q(viewed__who=user) | 
-        #      Q(viewed__who=user,viewed__when__lt=F('last_activity_at'))
-        #returns way more questions than you might think it should
-        #so because of that I've created separate query sets Q_set2 and Q_set3
-        #plus two separate queries run faster!
-
-        #build two two queries based
-
-        #questions that are not seen by the user at all
-        not_seen_qs = base_qs.filter(~Q(viewed__who=user))
-        #questions that were seen, but before last modification
-        seen_before_last_mod_qs = base_qs.filter(
-                                    Q(
-                                        viewed__who=user,
-                                        viewed__when__lt=F('last_activity_at')
-                                    )
-                                )
 
-        #shorten variables for convenience
-        Q_set_A = not_seen_qs
-        Q_set_B = seen_before_last_mod_qs
+class QuestionPool(object):
+    """questions that are not deleted or closed, as tuples
+    (id, last activity time, id of the last active user, tag names),
+    the most recently active first
 
-        for feed in user_feeds:
-            if feed.feed_type == 'm_and_c':
-                #alerts on mentions and comments are processed separately
-                #because comments to questions do not trigger change of last_updated
-                #this may be changed in the future though, see
-                #http://askbot.org/en/question/96/
+    questions are read page by page, only as far as needed,
+    and are shared by the digests of all users
+    """
+    page_size = 500
+
+    def __init__(self):
+        self.items = list()
+        self.is_exhausted = False
+
+    def __iter__(self):
+        position = 0
+        while True:
+            if position == len(self.items):
+                if self.is_exhausted:
+                    return
+                self.load_page()
                 continue
+            yield self.items[position]
+            position += 1
+
+    def load_page(self):
+        questions = Question.objects.filter(
+                                    deleted = False,
+                                    closed = False
+                                ).order_by(
+                                    '-last_activity_at', '-id'
+                                ).values_list(
+                                    'id',
+                                    'last_activity_at',
+                                    'last_activity_by',
+                                    'tagnames'
+                                )
+        if self.items:
+            last_id, last_activity_at = self.items[-1][:2]
+            questions = questions.filter(
+                        Q(last_activity_at__lt = last_activity_at) | \
+                        Q(last_activity_at = last_activity_at, id__lt = last_id)
+                    )
+        page = list(questions[:self.page_size])
+        self.items.extend(page)
+        if len(page) < self.page_size:
+            self.is_exhausted = True
+
+
+class DigestBatch(object):
+    """email digests for a chunk of users
+
+    the methods must be called in order:
+    :meth:`load_feeds`, :meth:`load_candidates`, :meth:`load_responses`,
+    :meth:`build_question_lists` and :meth:`annotate_question_lists`,
+    then ``question_lists`` contains ordered dictionaries
+    of questions with the meta data per due user
+    """
+    def __init__(self, users, question_pool):
+        self.users = users
+        self.question_pool = question_pool
+        self.feeds = dict()#user id -> list of all feeds of the user
+        self.due_feeds = dict()#user id -> {feed type: cutoff time}
+        self.due_users = list()
+        self.candidate_ids = dict()#(user id, feed type) -> set of question id's
+        self.views = dict()#user id -> {question id: time of the first view}
+        self.tag_selections = dict()#user id -> {reason: set of tag names}
+        self.tag_filtered_ids = dict()#user id -> (not seen id's, seen id's)
+        self.comment_question_ids = dict()#user id -> list of question id's
+        self.mention_question_ids = dict()#user id -> set of question id's
+        self.questions = dict()#question id -> question
+        self.question_lists = dict()#user id -> question -> meta data
+
+    def get_due_user_ids(self, feed_type):
+        return [
+            user.id for user in self.due_users \
+            if feed_type in self.due_feeds[user.id]
+        ]
+
+    def load_feeds(self):
+        """loads email subscriptions of the users, adds the missing ones
+        and finds subscriptions that are due to be reported now,
+        subscriptions other than ``m_and_c`` are marked as reported
+        """
+        form = forms.EditUserEmailFeedsForm()
+        need_feed_types = set(form.get_db_model_subscription_type_names())
+        frequency = askbot_settings.DEFAULT_NOTIFICATION_DELIVERY_SCHEDULE
+
+        for user in self.users:
+            self.feeds[user.id] = list()
+        user_ids = self.feeds.keys()
+        for feed in EmailFeedSetting.objects.filter(subscriber__in = user_ids):
+            self.feeds[feed.subscriber_id].append(feed)
+
+        reported_feed_ids = list()
+        for user in self.users:
+            have_feed_types = set([feed.feed_type for feed in self.feeds[user.id]])
+            for feed_type in need_feed_types - have_feed_types:
+                feed = EmailFeedSetting(
+                                    subscriber = user,
+                                    feed_type = feed_type,
+                                    frequency = frequency
+                                )
+                feed.save()
+                self.feeds[user.id].append(feed)
+
+            due_feeds = dict()
+            for feed in self.feeds[user.id]:
+                if feed.frequency in ('n', 'i'):
+                    continue
+                if feed.should_send_now():
+                    cutoff_time = feed.get_previous_report_cutoff_time()
+                    due_feeds[feed.feed_type] = cutoff_time
+                    #alerts on mentions and comments are processed separately
+                    #because comments to questions do not trigger change of last_updated
+                    #this may be changed in the future though, see
+                    #http://askbot.org/en/question/96/
+                    if feed.feed_type != 'm_and_c':
+                        reported_feed_ids.append(feed.id)
+            if due_feeds:
+                self.due_feeds[user.id] = due_feeds
+                self.due_users.append(user)
+
+        if DEBUG_THIS_COMMAND == False:
+            now = datetime.datetime.now()
+            for id_list in split_list(reported_feed_ids, MAX_IN_CLAUSE_SIZE):
+                EmailFeedSetting.objects.filter(
+                                        id__in = id_list
+                                    ).update(
+                                        reported_at = now
+                                    )
 
-            #each group of updates represented by the corresponding
-            #query set has it's own cutoff time
-            #that cutoff time is computed for each user individually
-            #and stored as a parameter "cutoff_time"
+    def add_candidates(self, feed_type, pairs):
+        """adds pairs (user id, question id) to the candidates"""
+        for user_id, question_id in pairs:
+            question_ids = self.candidate_ids.setdefault((user_id, feed_type), set())
+            if question_id is not None:
+                question_ids.add(question_id)
+
+    def load_candidates(self):
+        """loads questions selected, asked and answered by the users,
+        the questions matching the tag filters of the users
+        and times of the question views by the users
+        """
+        followed = get_followed_question_ids(self.get_due_user_ids('q_sel'))
+        self.add_candidates('q_sel', followed)
+
+        asked = Question.objects.filter(
+                                author__in = self.get_due_user_ids('q_ask')
+                            ).values_list('author', 'id')
+        self.add_candidates('q_ask', asked)
+
+        answered = Answer.objects.filter(
+                                author__in = self.get_due_user_ids('q_ans')
+                            ).values_list('author', 'question')
+        self.add_candidates('q_ans', answered)
+
+        for user in self.due_users:
+            self.views[user.id] = dict()
+        views = QuestionView.objects.filter(
+                                who__in = self.views.keys()
+                            ).values_list('who', 'question', 'when')
+        for user_id, question_id, viewed_at in views:
+            user_views = self.views[user_id]
+            if viewed_at < user_views.get(question_id, datetime.datetime.max):
+                user_views[question_id] = viewed_at
+
+        q_all_user_ids = self.get_due_user_ids('q_all')
+        selections = MarkedTag.objects.filter(
+                                user__in = q_all_user_ids
+                            ).values_list('user', 'reason', 'tag__name')
+        for user_id, reason, tag_name in selections:
+            user_selections = self.tag_selections.setdefault(user_id, dict())
+            user_selections.setdefault(reason, set()).add(tag_name)
+
+        for user in self.due_users:
+            if user.id in q_all_user_ids:
+                self.tag_filtered_ids[user.id] = \
+                        self.select_tag_filtered_question_ids(user)
+
+    def get_tag_filter(self, user):
+        """returns function that takes list of tag names
+        and tells whether the question with these tags
+        passes the email tag filter of the user"""
+        selections = self.tag_selections.get(user.id, dict())
+        strategy = user.email_tag_filter_strategy
+        if strategy == const.EXCLUDE_IGNORED:
+            ignored_tag_names = selections.get('bad', set())
+            wildcards = user.ignored_tags.strip().split()
+            return lambda tag_names: \
+                not matches_tags(tag_names, ignored_tag_names, wildcards)
+        elif strategy == const.INCLUDE_INTERESTING:
+            interesting_tag_names = selections.get('good', set())
+            wildcards = user.interesting_tags.strip().split()
+            return lambda tag_names: \
+                matches_tags(tag_names, interesting_tag_names, wildcards)
+        else:
+            return lambda tag_names: True
 
-            #we won't send email for a given question if an email has been
-            #sent after that cutoff_time
-            if feed.should_send_now():
-                if DEBUG_THIS_COMMAND == False:
-                    feed.mark_reported_now()
-                cutoff_time = feed.get_previous_report_cutoff_time() 
-
-                if feed.feed_type == 'q_sel':
-                    q_sel_A = Q_set_A.filter(followed_by=user)
-                    q_sel_A.cutoff_time = cutoff_time #store cutoff time per query set
-                    q_sel_B = Q_set_B.filter(followed_by=user)
-                    q_sel_B.cutoff_time = cutoff_time #store cutoff time per query set
-
-                elif feed.feed_type == 'q_ask':
-                    q_ask_A = Q_set_A.filter(author=user)
-                    q_ask_A.cutoff_time = cutoff_time
-                    q_ask_B = Q_set_B.filter(author=user)
-                    q_ask_B.cutoff_time = cutoff_time
-
-                elif feed.feed_type == 'q_ans':
-                    q_ans_A = Q_set_A.filter(answers__author=user)
-                    q_ans_A = q_ans_A[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_ans_A.cutoff_time = cutoff_time
-
-                    q_ans_B = Q_set_B.filter(answers__author=user)
-                    q_ans_B = q_ans_B[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_ans_B.cutoff_time = cutoff_time
-
-                elif feed.feed_type == 'q_all':
-                    q_all_A = user.get_tag_filtered_questions(Q_set_A)
-                    q_all_B = user.get_tag_filtered_questions(Q_set_B)
-
-                    q_all_A = q_all_A[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_all_B = q_all_B[:askbot_settings.MAX_ALERTS_PER_EMAIL]
-                    q_all_A.cutoff_time = cutoff_time
-                    q_all_B.cutoff_time = cutoff_time
-
-        #build ordered list questions for the email report
+    def select_tag_filtered_question_ids(self, user):
+        """returns id's of the most recently active questions
+        passing the tag filter of the user - a list of questions
+        not seen by the user and a list of questions seen before
+        their last activity, up to ``MAX_ALERTS_PER_EMAIL`` in each
+        """
+        max_count = askbot_settings.MAX_ALERTS_PER_EMAIL
+        tag_filter = self.get_tag_filter(user)
+        views = self.views[user.id]
+        not_seen = list()
+        seen_before = list()
+        for question_id, last_activity_at, last_activity_by_id, tagnames \
+                in self.question_pool:
+            if len(not_seen) >= max_count and len(seen_before) >= max_count:
+                break
+            if last_activity_at < user.date_joined:
+                break#all the following questions are even older
+            if last_activity_by_id == user.id:
+                continue
+            if not tag_filter(tagnames.split()):
+                continue
+            viewed_at = views.get(question_id, None)
+            if viewed_at is None:
+                if len(not_seen) < max_count:
+                    not_seen.append(question_id)
+            elif viewed_at < last_activity_at:
+                if len(seen_before) < max_count:
+                    seen_before.append(question_id)
+        return not_seen, seen_before
+
+    def load_responses(self):
+        """loads id's of the questions with comments to the posts
+        of the users and of the questions where users were mentioned,
+        both made before the cutoff time of the ``m_and_c`` feed
+        """
+        user_ids = self.get_due_user_ids('m_and_c')
+        if len(user_ids) == 0:
+            return
+        cutoff_times = dict(
+            [(user_id, self.due_feeds[user_id]['m_and_c']) for user_id in user_ids]
+        )
+        latest_cutoff_time = max(cutoff_times.values())
+        question_type_id = ContentType.objects.get_for_model(Question).id
+        answer_type_id = ContentType.objects.get_for_model(Answer).id
+
+        post_authors = dict()#(content type id, post id) -> (author id, question id)
+        questions = Question.objects.filter(
+                                    author__in = user_ids
+                                ).values_list('id', 'author')
+        for question_id, author_id in questions:
+            post_authors[(question_type_id, question_id)] = (author_id, question_id)
+        answers = Answer.objects.filter(
+                                    author__in = user_ids
+                                ).values_list('id', 'author', 'question')
+        for answer_id, author_id, question_id in answers:
+            post_authors[(answer_type_id, answer_id)] = (author_id, question_id)
+
+        comments = list()
+        for content_type_id in (question_type_id, answer_type_id):
+            post_ids = [key[1] for key in post_authors if key[0] == content_type_id]
+            comment_data = Comment.objects.filter(
+                                    content_type__id = content_type_id,
+                                    added_at__lt = latest_cutoff_time
+                                ).values_list('object_id', 'user', 'added_at')
+            for post_id, commenter_id, added_at in \
+                    filter_by_ids(comment_data, 'object_id', post_ids):
+                author_id, question_id = post_authors[(content_type_id, post_id)]
+                if commenter_id == author_id:
+                    continue
+                if added_at >= cutoff_times[author_id]:
+                    continue
+                comments.append((added_at, author_id, question_id))
+
+        #most recent comments first, as in the default ordering of comments
+        comments.sort(reverse = True)
+        for user_id in user_ids:
+            self.comment_question_ids[user_id] = list()
+        for added_at, user_id, question_id in comments:
+            self.comment_question_ids[user_id].append(question_id)
+
+        mentions = ActivityAuditStatus.objects.filter(
+                                user__in = user_ids,
+                                activity__activity_type = const.TYPE_ACTIVITY_MENTION,
+                                activity__active_at__lt = latest_cutoff_time
+                            ).values_list(
+                                'user',
+                                'activity__content_type',
+                                'activity__object_id',
+                                'activity__active_at'
+                            )
+        mentions = [
+            mention for mention in mentions \
+            if mention[3] < cutoff_times[mention[0]]
+        ]
+        post_keys = set([(mention[1], mention[2]) for mention in mentions])
+        origin_ids = get_origin_question_ids(post_keys)
+        for user_id in user_ids:
+            self.mention_question_ids[user_id] = set()
+        for user_id, content_type_id, object_id, active_at in mentions:
+            question_id = origin_ids.get((content_type_id, object_id), None)
+            if question_id is not None:
+                self.mention_question_ids[user_id].add(question_id)
+
+    def load_questions(self):
+        """loads all questions that may go into the digests"""
+        question_ids = set()
+        for ids in self.candidate_ids.values():
+            question_ids.update(ids)
+        for ids in self.comment_question_ids.values():
+            question_ids.update(ids)
+        for ids in self.mention_question_ids.values():
+            question_ids.update(ids)
+        for not_seen_ids, seen_before_ids in self.tag_filtered_ids.values():
+            question_ids.update(not_seen_ids)
+            question_ids.update(seen_before_ids)
+        for question in filter_by_ids(Question.objects.all(), 'id', question_ids):
+            self.questions[question.id] = question
+
+    def get_questions(self, question_ids):
+        return [
+            self.questions[question_id] for question_id in question_ids \
+            if question_id in self.questions
+        ]
+
+    def split_by_views(self, user, question_ids):
+        """returns two lists of candidate questions: not seen by the user
+        and seen before the last activity, both ordered by the time
+        of the last activity, most recent first
+
+        questions that are deleted, closed, last modified by the user
+        or not modified since the user has joined are not candidates
+        """
+        views = self.views[user.id]
+        questions = self.get_questions(set(question_ids))
+        questions.sort(
+                key = lambda question: question.last_activity_at,
+                reverse = True
+            )
+        not_seen = list()
+        seen_before = list()
+        for question in questions:
+            if question.deleted or question.closed:
+                continue
+            if question.last_activity_by_id == user.id:
+                continue
+            if question.last_activity_at < user.date_joined:
+                continue
+            viewed_at = views.get(question.id, None)
+            if viewed_at is None:
+                not_seen.append(question)
+            elif viewed_at < question.last_activity_at:
+                seen_before.append(question)
+        return not_seen, seen_before
+
+    def build_question_list(self, user):
+        """returns ordered dictionary of questions for
+        the digest of the user, with the meta data per question"""
+        due_feeds = self.due_feeds[user.id]
+        max_count = askbot_settings.MAX_ALERTS_PER_EMAIL
         q_list = SortedDict()
 
-        #todo: refactor q_list into a separate class?
-        extend_question_list(q_sel_A, q_list)
-        extend_question_list(q_sel_B, q_list)
-
-        #build list of comment and mention responses here
-        #it is separate because posts are not marked as changed
-        #when people add comments
-        #mention responses could be collected in the loop above, but
-        #it is inconvenient, because feed_type m_and_c bundles the two
-        #also we collect metadata for these here
-        try:
-            feed = user_feeds.get(feed_type='m_and_c')
-            if feed.should_send_now():
-                cutoff_time = feed.get_previous_report_cutoff_time()
-                comments = Comment.objects.filter(
-                                            added_at__lt = cutoff_time,
-                                        ).exclude(
-                                            user = user
-                                        )
-                q_commented = list() 
-                for c in comments:
-                    post = c.content_object
-                    if post.author != user:
-                        continue
-
-                    #skip is post was seen by the user after
-                    #the comment posting time
-                    q_commented.append(post.get_origin_post())
+        if 'q_sel' in due_feeds:
+            question_ids = self.candidate_ids.get((user.id, 'q_sel'), ())
+            for questions in self.split_by_views(user, question_ids):
+                extend_question_list(
+                                questions,
+                                q_list,
+                                cutoff_time = due_feeds['q_sel']
+                            )
 
+        #list of comment and mention responses is built separately
+        #because posts are not marked as changed when people add comments
+        if 'm_and_c' in due_feeds:
+            cutoff_time = due_feeds['m_and_c']
+            q_commented = self.get_questions(self.comment_question_ids[user.id])
+            extend_question_list(
+                            q_commented,
+                            q_list,
+                            cutoff_time = cutoff_time,
+                            add_comment = True
+                        )
+            question_ids = self.mention_question_ids[user.id]
+            for questions in self.split_by_views(user, question_ids):
                 extend_question_list(
-                                q_commented,
+                                questions,
                                 q_list,
                                 cutoff_time = cutoff_time,
-                                add_comment = True
+                                add_mention = True
                             )
 
-                mentions = Activity.objects.get_mentions(
-                                                    mentioned_at__lt = cutoff_time,
-                                                    mentioned_whom = user
-                                                )
-
-                #print 'have %d mentions' % len(mentions)
-                #MM = Activity.objects.filter(activity_type = const.TYPE_ACTIVITY_MENTION)
-                #print 'have %d total mentions' % len(MM)
-                #for m in MM:
-                #    print m
-
-                mention_posts = get_all_origin_posts(mentions)
-                q_mentions_id = [q.id for q in mention_posts]
-
-                q_mentions_A = Q_set_A.filter(id__in = q_mentions_id)
-                q_mentions_A.cutoff_time = cutoff_time
-                extend_question_list(q_mentions_A, q_list, add_mention=True)
-
-                q_mentions_B = Q_set_B.filter(id__in = q_mentions_id)
-                q_mentions_B.cutoff_time = cutoff_time
-                extend_question_list(q_mentions_B, q_list, add_mention=True)
-        except EmailFeedSetting.DoesNotExist:
-            pass
+        q_all = list()
+        if 'q_all' in due_feeds:
+            for question_ids in self.tag_filtered_ids[user.id]:
+                q_all.append(self.get_questions(question_ids))
 
         if user.email_tag_filter_strategy == const.INCLUDE_INTERESTING:
-            extend_question_list(q_all_A, q_list)
-            extend_question_list(q_all_B, q_list)
-
-        extend_question_list(q_ask_A, q_list, limit=True)
-        extend_question_list(q_ask_B, q_list, limit=True)
+            for questions in q_all:
+                extend_question_list(
+                                questions,
+                                q_list,
+                                cutoff_time = due_feeds['q_all']
+                            )
 
-        extend_question_list(q_ans_A, q_list, limit=True)
-        extend_question_list(q_ans_B, q_list, limit=True)
+        for feed_type in ('q_ask', 'q_ans'):
+            if feed_type not in due_feeds:
+                continue
+            question_ids = self.candidate_ids.get((user.id, feed_type), ())
+            for questions in self.split_by_views(user, question_ids):
+                if feed_type == 'q_ans':
+                    questions = questions[:max_count]
+                extend_question_list(
+                                questions,
+                                q_list,
+                                cutoff_time = due_feeds[feed_type],
+                                limit = True
+                            )
 
         if user.email_tag_filter_strategy == const.EXCLUDE_IGNORED:
-            extend_question_list(q_all_A, q_list, limit=True)
-            extend_question_list(q_all_B, q_list, limit=True)
-
-        ctype = ContentType.objects.get_for_model(Question)
-        EMAIL_UPDATE_ACTIVITY = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
-
-        #up to this point we still don't know if emails about
-        #collected questions were sent recently
-        #the next loop examines activity record and decides
-        #for each question, whether it needs to be included or not
-        #into the report
+            for questions in q_all:
+                extend_question_list(
+                                questions,
+                                q_list,
+                                cutoff_time = due_feeds['q_all'],
+                                limit = True
+                            )
+        return q_list
 
-        for q, meta_data in q_list.items():
-            #this loop edits meta_data for each question
-            #so that user will receive counts on new edits new answers, etc
-            #and marks questions that need to be skipped
-            #because an email about them was sent recently enough
+    def build_question_lists(self):
+        self.load_questions()
+        for user in self.due_users:
+            self.question_lists[user.id] = self.build_question_list(user)
 
-            #also it keeps a record of latest email activity per question per user
-            try:
-                #todo: is it possible to use content_object here, instead of
-                #content type and object_id pair?
-                update_info = Activity.objects.get(
-                                            user=user,
-                                            content_type=ctype,
-                                            object_id=q.id,
-                                            activity_type=EMAIL_UPDATE_ACTIVITY
-                                        )
-                emailed_at = update_info.active_at
-            except Activity.DoesNotExist:
-                update_info = Activity(
-                                        user=user, 
-                                        content_object=q, 
-                                        activity_type=EMAIL_UPDATE_ACTIVITY
-                                    )
-                emailed_at = datetime.datetime(1970, 1, 1)#long time ago
-            except Activity.MultipleObjectsReturned:
-                raise Exception(
-                                'server error - multiple question email activities '
-                                'found per user-question pair'
+    def load_email_activities(self):
+        """returns dictionary (user id, question id) -> activity
+        recording the latest email about the question sent to the user
+        """
+        pairs = set()
+        for user_id, q_list in self.question_lists.items():
+            for question in q_list:
+                pairs.add((user_id, question.id))
+        question_ids = set([pair[1] for pair in pairs])
+        question_type = ContentType.objects.get_for_model(Question)
+        activities = Activity.objects.filter(
+                                    user__in = self.question_lists.keys(),
+                                    content_type = question_type,
+                                    activity_type = EMAIL_UPDATE_ACTIVITY
                                 )
-
-            cutoff_time = meta_data['cutoff_time']#cutoff time for the question
-
-            #skip question if we need to wait longer because
-            #the delay before the next email has not yet elapsed
-            #or if last email was sent after the most recent modification
-            if emailed_at > cutoff_time or emailed_at > q.last_activity_at:
-                meta_data['skip'] = True
+        email_activities = dict()
+        for activity in filter_by_ids(activities, 'object_id', question_ids):
+            key = (activity.user_id, activity.object_id)
+            if key not in pairs:
                 continue
+            if key in email_activities:
+                raise Exception(
+                        'server error - multiple question email activities '
+                        'found per user-question pair'
+                    )
+            email_activities[key] = activity
+        return email_activities
+
+    def load_news(self, question_ids, since):
+        """returns dictionary with the lists of tuples (author id, time)
+        of question revisions, new answers and answer revisions
+        made after the time ``since``, per question id
+
+        question revisions are listed latest first
+        """
+        news = {
+            'q_rev': dict(),
+            'new_ans': dict(),
+            'ans_rev': dict(),
+        }
+        question_revisions = QuestionRevision.objects.filter(
+                                        revised_at__gt = since
+                                    ).order_by(
+                                        '-revision'
+                                    ).values_list(
+                                        'question', 'author', 'revised_at'
+                                    )
+        answers = Answer.objects.filter(
+                                        deleted = False,
+                                        added_at__gt = since
+                                    ).values_list(
+                                        'question', 'author', 'added_at'
+                                    )
+        answer_revisions = AnswerRevision.objects.filter(
+                                        answer__deleted = False,
+                                        revised_at__gt = since
+                                    ).values_list(
+                                        'answer__question', 'author', 'revised_at'
+                                    )
+        sources = (
+            ('q_rev', question_revisions, 'question'),
+            ('new_ans', answers, 'question'),
+            ('ans_rev', answer_revisions, 'answer__question'),
+        )
+        for news_type, queryset, field_name in sources:
+            items = news[news_type]
+            for question_id, author_id, timestamp in \
+                    filter_by_ids(queryset, field_name, question_ids):
+                items.setdefault(question_id, list()).append((author_id, timestamp))
+        return news
+
+    def annotate_question_lists(self):
+        """adds counts of the news to the meta data of the questions,
+        marks questions to skip - emailed recently or without news,
+        and records that an email about the rest is being sent
+        """
+        email_activities = self.load_email_activities()
+
+        #questions with updates since the last email - (user, question,
+        #meta data, email activity, time of the last email)
+        updates = list()
+        for user in self.due_users:
+            for question, meta_data in self.question_lists[user.id].items():
+                update_info = email_activities.get((user.id, question.id), None)
+                if update_info is None:
+                    update_info = Activity(
+                                        user = user,
+                                        content_object = question,
+                                        activity_type = EMAIL_UPDATE_ACTIVITY
+                                    )
+                    emailed_at = LONG_TIME_AGO
+                else:
+                    emailed_at = update_info.active_at
+
+                #skip question if we need to wait longer because
+                #the delay before the next email has not yet elapsed
+                #or if last email was sent after the most recent modification
+                cutoff_time = meta_data['cutoff_time']
+                if emailed_at > cutoff_time or emailed_at > question.last_activity_at:
+                    meta_data['skip'] = True
+                else:
+                    updates.append((user, question, meta_data, update_info, emailed_at))
+
+        if len(updates) == 0:
+            return
 
-            #collect info on all sorts of news that happened after
-            #the most recent emailing to the user about this question
-            q_rev = QuestionRevision.objects.filter(
-                                                question=q,
-                                                revised_at__gt=emailed_at
-                                            )
+        question_ids = set([update[1].id for update in updates])
+        since = min([update[4] for update in updates])
+        news = self.load_news(question_ids, since)
 
-            q_rev = q_rev.exclude(author=user)
+        for user, question, meta_data, update_info, emailed_at in updates:
+            counts = dict()
+            for news_type, items in news.items():
+                counts[news_type] = [
+                    item for item in items.get(question.id, ()) \
+                    if item[0] != user.id and item[1] > emailed_at
+                ]
 
-            #now update all sorts of metadata per question
+            q_rev = counts['q_rev']
             meta_data['q_rev'] = len(q_rev)
-            if len(q_rev) > 0 and q.added_at == q_rev[0].revised_at:
+            if len(q_rev) > 0 and question.added_at == q_rev[0][1]:
                 meta_data['q_rev'] = 0
                 meta_data['new_q'] = True
             else:
                 meta_data['new_q'] = False
-                
-            new_ans = Answer.objects.filter(
-                                            question=q,
-                                            added_at__gt=emailed_at,
-                                            deleted=False,
-                                        )
-
-            new_ans = new_ans.exclude(author=user)
-            meta_data['new_ans'] = len(new_ans)
-            ans_rev = AnswerRevision.objects.filter(
-                                            answer__question = q,
-                                            answer__deleted = False,
-                                            revised_at__gt = emailed_at
-                                        )
-            ans_rev = ans_rev.exclude(author=user)
-            meta_data['ans_rev'] = len(ans_rev)
+            meta_data['new_ans'] = len(counts['new_ans'])
+            meta_data['ans_rev'] = len(counts['ans_rev'])
 
             comments = meta_data.get('comments', 0)
             mentions = meta_data.get('mentions', 0)
 
-            #print meta_data
             #finally skip question if there are no news indeed
-            if len(q_rev) + len(new_ans) + len(ans_rev) + comments + mentions == 0:
+            news_count = len(q_rev) + meta_data['new_ans'] + meta_data['ans_rev']
+            if news_count + comments + mentions == 0:
                 meta_data['skip'] = True
-                #print 'skipping'
             else:
                 meta_data['skip'] = False
-                #print 'not skipping'
-                update_info.active_at = datetime.datetime.now() 
+                update_info.active_at = datetime.datetime.now()
                 if DEBUG_THIS_COMMAND == False:
                     update_info.save() #save question email update activity 
-        #q_list is actually an ordered dictionary
-        #print 'user %s gets %d' % (user.username, len(q_list.keys()))
-        #todo: sort question list by update time
-        return q_list 
 
-    def send_email_alerts(self):
-        #does not change the database, only sends the email
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size',
+            action = 'store',
+            type = 'int',
+            dest = 'chunk_size',
+            default = 100,
+            help = 'number of users whose digests are prepared together'
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        try:
+            try:
+                self.send_email_alerts(chunk_size = options['chunk_size'])
+            except Exception, e:
+                print e
+        finally:
+            connection.close()
+
+    def report(self, message):
+        if self.verbosity > 1:
+            print message
+
+    def send_email_alerts(self, chunk_size = 100):
+        """prepares and sends digests to all users, chunk by chunk"""
+        timer = PhaseTimer()
+        question_pool = QuestionPool()
+        sender = mail.MailSender()
+        user_ids = list(User.objects.order_by('id').values_list('id', flat = True))
+        processed_count = 0
+        email_count = 0
+        for chunk_ids in split_list(user_ids, chunk_size):
+            timer.start('subscriptions')
+            users = list(User.objects.filter(id__in = chunk_ids).order_by('id'))
+            batch = DigestBatch(users, question_pool)
+            batch.load_feeds()
+            if batch.due_users:
+                timer.start('candidate questions')
+                batch.load_candidates()
+                timer.start('comments and mentions')
+                batch.load_responses()
+                timer.start('question lists')
+                batch.build_question_lists()
+                timer.start('news since the last emails')
+                batch.annotate_question_lists()
+                timer.start('rendering')
+                render = lambda user: self.make_digest(
+                                            user,
+                                            batch.question_lists[user.id],
+                                            batch.feeds[user.id]
+                                        )
+                messages = mail.render_messages(render, batch.due_users)
+                timer.start('sending')
+                email_count += sender.send(messages)
+            timer.stop()
+            processed_count += len(chunk_ids)
+            self.report(
+                'processed %d of %d users, sent %d emails' \
+                % (processed_count, len(user_ids), email_count)
+            )
+
+        for phase, elapsed in timer.totals.items():
+            self.report('%s: %.2f sec' % (phase, elapsed))
+
+    def make_digest(self, user, q_list, feeds):
+        """returns email message about the questions in the ``q_list``
+        that are not marked to be skipped, or ``None``
+        if there are no such questions
+        """
         #todo: move this to template
-        for user in User.objects.all():
-            user.add_missing_askbot_subscriptions()
-            #todo: q_list is a dictionary, not a list
-            q_list = self.get_updated_questions_for_user(user)
-            if len(q_list.keys()) == 0:
+        num_q = 0
+        for question, meta_data in q_list.items():
+            if meta_data['skip']:
+                del q_list[question]
+            else:
+                num_q += 1
+        if num_q == 0:
+            return None
+
+        url_prefix = askbot_settings.APP_URL
+
+        tag_summary = get_tag_summary_from_questions(q_list.keys())
+        question_count = len(q_list.keys())
+
+        subject_line = ungettext(
+            '%(question_count)d updated question about %(topics)s',
+            '%(question_count)d updated questions about %(topics)s',
+            question_count
+        ) % {
+            'question_count': question_count,
+            'topics': tag_summary
+        }
+
+        #todo: send this to special log
+        #print 'have %d updated questions for %s' % (num_q, user.username)
+        text = ungettext('%(name)s, this is an update message header for %(num)d question', 
+                    '%(name)s, this is an update message header for %(num)d questions',num_q) \
+                        % {'num':num_q, 'name':user.username}
+
+        text += '<ul>'
+        items_added = 0
+        items_unreported = 0
+        for q, meta_data in q_list.items():
+            act_list = []
+            if meta_data['skip']:
                 continue
-            num_q = 0
-            for question, meta_data in q_list.items():
-                if meta_data['skip']:
-                    del q_list[question]
-                else:
-                    num_q += 1
-            if num_q > 0:
-                url_prefix = askbot_settings.APP_URL
-
-                tag_summary = get_tag_summary_from_questions(q_list.keys())
-                question_count = len(q_list.keys())
-
-                subject_line = ungettext(
-                    '%(question_count)d updated question about %(topics)s',
-                    '%(question_count)d updated questions about %(topics)s',
-                    question_count
-                ) % {
-                    'question_count': question_count,
-                    'topics': tag_summary
-                }
-
-                #todo: send this to special log
-                #print 'have %d updated questions for %s' % (num_q, user.username)
-                text = ungettext('%(name)s, this is an update message header for %(num)d question', 
-                            '%(name)s, this is an update message header for %(num)d questions',num_q) \
-                                % {'num':num_q, 'name':user.username}
-
-                text += '<ul>'
-                items_added = 0
-                items_unreported = 0
-                for q, meta_data in q_list.items():
-                    act_list = []
-                    if meta_data['skip']:
-                        continue
-                    if items_added >= askbot_settings.MAX_ALERTS_PER_EMAIL:
-                        items_unreported = num_q - items_added #may be inaccurate actually, but it's ok
-                        
-                    else:
-                        items_added += 1
-                        if meta_data['new_q']:
-                            act_list.append(_('new question'))
-                        format_action_count('%(num)d rev', meta_data['q_rev'],act_list)
-                        format_action_count('%(num)d ans', meta_data['new_ans'],act_list)
-                        format_action_count('%(num)d ans rev',meta_data['ans_rev'],act_list)
-                        act_token = ', '.join(act_list)
-                        text += '<li><a href="%s?sort=latest">%s</a> <font color="#777777">(%s)</font></li>' \
-                                    % (url_prefix + q.get_absolute_url(), q.title, act_token)
-                text += '</ul>'
-                text += '<p></p>'
-                #if len(q_list.keys()) >= askbot_settings.MAX_ALERTS_PER_EMAIL:
-                #    text += _('There may be more questions updated since '
-                #                'you have logged in last time as this list is '
-                #                'abridged for your convinience. Please visit '
-                #                'the askbot and see what\'s new!<br>'
-                #              )
-
-                text += _(
-                            'Please visit the askbot and see what\'s new! '
-                            'Could you spread the word about it - '
-                            'can somebody you know help answering those questions or '
-                            'benefit from posting one?'
-                        )
+            if items_added >= askbot_settings.MAX_ALERTS_PER_EMAIL:
+                items_unreported = num_q - items_added #may be inaccurate actually, but it's ok
+                
+            else:
+                items_added += 1
+                if meta_data['new_q']:
+                    act_list.append(_('new question'))
+                format_action_count('%(num)d rev', meta_data['q_rev'],act_list)
+                format_action_count('%(num)d ans', meta_data['new_ans'],act_list)
+                format_action_count('%(num)d ans rev',meta_data['ans_rev'],act_list)
+                act_token = ', '.join(act_list)
+                text += '<li><a href="%s?sort=latest">%s</a> <font color="#777777">(%s)</font></li>' \
+                            % (url_prefix + q.get_absolute_url(), q.title, act_token)
+        text += '</ul>'
+        text += '<p></p>'
+        #if len(q_list.keys()) >= askbot_settings.MAX_ALERTS_PER_EMAIL:
+        #    text += _('There may be more questions updated since '
+        #                'you have logged in last time as this list is '
+        #                'abridged for your convinience. Please visit '
+        #                'the askbot and see what\'s new!<br>'
+        #              )
+
+        text += _(
+                    'Please visit the askbot and see what\'s new! '
+                    'Could you spread the word about it - '
+                    'can somebody you know help answering those questions or '
+                    'benefit from posting one?'
+                )
 
-                feeds = EmailFeedSetting.objects.filter(subscriber = user)
-                feed_freq = [feed.frequency for feed in feeds]
-                text += '<p></p>'
-                if 'd' in feed_freq:
-                    text += _('Your most frequent subscription setting is \'daily\' '
-                               'on selected questions. If you are receiving more than one '
-                               'email per day'
-                               'please tell about this issue to the askbot administrator.'
-                               )
-                elif 'w' in feed_freq:
-                    text += _('Your most frequent subscription setting is \'weekly\' '
-                               'if you are receiving this email more than once a week '
-                               'please report this issue to the askbot administrator.'
-                               )
-                text += ' '
-                text += _(
-                            'There is a chance that you may be receiving links seen '
-                            'before - due to a technicality that will eventually go away. '
-                        )
+        feed_freq = [feed.frequency for feed in feeds]
+        text += '<p></p>'
+        if 'd' in feed_freq:
+            text += _('Your most frequent subscription setting is \'daily\' '
+                       'on selected questions. If you are receiving more than one '
+                       'email per day'
+                       'please tell about this issue to the askbot administrator.'
+                       )
+        elif 'w' in feed_freq:
+            text += _('Your most frequent subscription setting is \'weekly\' '
+                       'if you are receiving this email more than once a week '
+                       'please report this issue to the askbot administrator.'
+                       )
+        text += ' '
+        text += _(
+                    'There is a chance that you may be receiving links seen '
+                    'before - due to a technicality that will eventually go away. '
+                )
 
-                link = url_prefix + reverse(
-                                        'user_subscriptions', 
-                                        kwargs = {
-                                            'id': user.id,
-                                            'slug': slugify(user.username)
-                                        }
-                                    )
+        link = url_prefix + reverse(
+                                'user_subscriptions', 
+                                kwargs = {
+                                    'id': user.id,
+                                    'slug': slugify(user.username)
+                                }
+                            )
 
-                text += _(
-                    'go to %(email_settings_link)s to change '
-                    'frequency of email updates or '
-                    '%(admin_email)s administrator'
-                ) % {
-                    'email_settings_link': link,
-                    'admin_email': django_settings.ADMINS[0][1]
-                }
-                if DEBUG_THIS_COMMAND == True:
-                    recipient_email = django_settings.ADMINS[0][1]
-                else:
-                    recipient_email = user.email
+        text += _(
+            'go to %(email_settings_link)s to change '
+            'frequency of email updates or '
+            '%(admin_email)s administrator'
+        ) % {
+            'email_settings_link': link,
+            'admin_email': django_settings.ADMINS[0][1]
+        }
+        if DEBUG_THIS_COMMAND == True:
+            recipient_email = django_settings.ADMINS[0][1]
+        else:
+            recipient_email = user.email
 
-                mail.send_mail(
-                    subject_line = subject_line,
-                    body_text = text,
-                    recipient_list = [recipient_email]
-                )
+        return mail.make_message(
+            subject_line = subject_line,
+            body_text = text,
+            recipient_list = [recipient_email]
+        )
@@ -41,7 +41,8 @@ class Command(NoArgsCommand):
                                     ).order_by('-added_at')
         #for all users, excluding blocked
         #for each user, select a tag filtered subset
-        #format the email reminder and send it
+        #format the email reminder and send them all together
+        messages = list()
         for user in models.User.objects.exclude(status = 'b'):
             user_questions = questions.exclude(author = user)
             user_questions = user.get_tag_filtered_questions(user_questions)
@@ -99,8 +100,12 @@ class Command(NoArgsCommand):
                 print "User: %s<br>\nSubject:%s<br>\nText: %s<br>\n" % \
                     (user.email, subject_line, body_text)
             else:
-                mail.send_mail(
-                    subject_line = subject_line,
-                    body_text = body_text,
-                    recipient_list = (user.email,)
+                messages.append(
+                    mail.make_message(
+                        subject_line = subject_line,
+                        body_text = body_text,
+                        recipient_list = (user.email,)
+                    )
                 )
+
+        mail.send_messages(messages)
@@ -2,14 +2,22 @@ from django.utils.translation import ugettext as _
 from askbot.user_messages import create_message, get_and_delete_messages
 from askbot.conf import settings as askbot_settings
 from askbot import const
+from askbot.utils import functions
+from askbot.search import state_storage
 
 class AnonymousMessageManager(object):
     def __init__(self, request):
         self.request = request
+        self.request_messages = list()
     def create(self, message=''):
         create_message(self.request, message)  
+    def create_for_request(self, message=''):
+        """message shown only in the response
+        to the current request, the session is not used"""
+        self.request_messages.append(message)
     def get_and_delete(self):
-        messages = get_and_delete_messages(self.request)
+        messages = self.request_messages + get_and_delete_messages(self.request)
+        self.request_messages = list()
         return messages
 
 def dummy_deepcopy(*arg):
@@ -28,9 +36,20 @@ class ConnectToSessionMessagesMiddleware(object):
             request.user.get_and_delete_messages = \
                             request.user.message_set.get_and_delete
 
-            #also set the first greeting one time per session only
-            if 'greeting_set' not in request.session:
-                request.session['greeting_set'] = True
-                msg = _(const.GREETING_FOR_ANONYMOUS_USER) \
-                            % askbot_settings.GREETING_URL
-                request.user.message_set.create(message=msg)
+            #also set the first greeting one time per session only,
+            #robots do not get it, so that no session is created for them
+            if functions.not_a_robot_request(request):
+                self.set_greeting(request)
+
+    def set_greeting(self, request):
+        msg = _(const.GREETING_FOR_ANONYMOUS_USER) \
+                    % askbot_settings.GREETING_URL
+        if state_storage.uses_cookie():
+            #the flag is kept in the cookie with the search state
+            #and the message is not stored, so the session is not created
+            if not state_storage.load_value(request, 'greeting_set'):
+                state_storage.store_value(request, 'greeting_set', True, True)
+                request.user.message_set.create_for_request(message=msg)
+        elif 'greeting_set' not in request.session:
+            request.session['greeting_set'] = True
+            request.user.message_set.create(message=msg)
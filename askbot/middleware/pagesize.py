@@ -34,8 +34,9 @@ class QuestionsPageSizeMiddleware(object):
                 user = request.user
                 user.questions_per_page = page_size
                 user.save()
-        # put page_size into session
-        request.session["page_size"] = page_size
+        # put page_size into session, if it is not there yet
+        if page_size != request.session.get("page_size", QUESTIONS_PAGE_SIZE):
+            request.session["page_size"] = page_size
 
     def process_exception(self, request, exception):
         #todo: move this to separate middleware
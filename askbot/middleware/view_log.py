@@ -10,18 +10,18 @@ from django.views.static import serve
 from django.views.i18n import javascript_catalog
 from askbot.models import signals
 from askbot.views.readers import questions as questions_view
-from askbot.views.commands import vote, get_tag_list
+from askbot.views.commands import vote, get_tag_list, get_tags_by_prefix
 from askbot.views.writers import delete_comment, post_comments, retag_question
 from askbot.views.readers import revisions
 from askbot.views.meta import media
-from askbot.search.state_manager import ViewLog
+from askbot.search import state_storage
 
 #todo: the list is getting bigger and bigger - maybe there is a better way to
 #trigger reset of sarch state?
 IGNORED_VIEWS = (
     serve, vote, media, delete_comment, post_comments,
     retag_question, revisions, javascript_catalog,
-    get_tag_list
+    get_tag_list, get_tags_by_prefix
 )
 
 
@@ -59,10 +59,11 @@ class ViewLogMiddleware(object):
         logging.debug('user %s, view %s' % (request.user.username, view_str))
         logging.debug('next url is %s' % request.REQUEST.get('next','nothing'))
 
-        if 'view_log' in request.session:
-            view_log = request.session['view_log']
-        else:
-            view_log = ViewLog()
-
+        view_log = state_storage.load_view_log(request)
         view_log.set_current(view_str)
-        request.session['view_log'] = view_log
+        state_storage.save_view_log(request, view_log)
+
+    def process_response(self, request, response):
+        #the search state is kept in a cookie, if so configured
+        state_storage.save_cookie(request, response)
+        return response
@@ -26,15 +26,23 @@ from askbot.models.answer import Answer, AnonymousAnswer, AnswerRevision
 from askbot.models.tag import Tag, MarkedTag
 from askbot.models.meta import Vote, Comment
 from askbot.models.user import EmailFeedSetting, ActivityAuditStatus, Activity
+from askbot.models.user import invalidate_moderation_items
 from askbot.models import signals
 from askbot.models.badges import award_badges_signal, get_badge, init_badges
+from askbot.models import view_counter
+from askbot.models import last_seen_tracker
+from askbot.models import subscriber_index
+from askbot.models import tag_filter
+from askbot.models import tag_index
+from askbot.models import tag_lookup
 #from user import AuthKeyUserAssociation
 from askbot.models.repute import BadgeData, Award, Repute
 from askbot import auth
 from askbot.utils.decorators import auto_now_timestamp
 from askbot.utils.slug import slugify
-from askbot.utils.diff import textDiff as htmldiff
 from askbot.utils import mail
+from askbot.search import result_cache
+from askbot.search import backends as search_backends
 from askbot import startup_procedures
 
 startup_procedures.run()
@@ -723,7 +731,7 @@ def user_assert_can_flag_offensive(self, post = None):
 
     double_flagging_error_message = _('cannot flag message as offensive twice')
 
-    if self.get_flags_for_post(post).count() > 0:
+    if post.is_flagged_by(self):
         raise askbot_exceptions.DuplicateCommand(double_flagging_error_message)
 
     blocked_error_message = _('blocked users cannot flag posts')
@@ -965,6 +973,8 @@ def user_mark_tags(
             marked_ts.update(reason=reason)
             cleaned_tagnames = tagnames
 
+    subscriber_index.update_user(self.id)
+    tag_filter.invalidate_user(self)
     return cleaned_tagnames, cleaned_wildcards
 
 @auto_now_timestamp
@@ -1076,19 +1086,24 @@ def user_delete_question(
                 ):
     self.assert_can_delete_question(question = question)
 
+    was_deleted = question.deleted
     question.deleted = True
     question.deleted_by = self 
     question.deleted_at = timestamp
     question.save()
 
-    for tag in list(question.tags.all()):
-        if tag.used_count == 1:
-            tag.deleted = True
-            tag.deleted_by = self 
-            tag.deleted_at = timestamp
-        else:
-            tag.used_count = tag.used_count - 1 
-        tag.save()
+    if not was_deleted:
+        tags = list(question.tags.all())
+        Tag.objects.change_use_counts(tags, -1)
+        #tags that are no longer used are marked deleted
+        Tag.objects.filter(
+                    id__in = [tag.id for tag in tags],
+                    used_count = 0
+                ).update(
+                    deleted = True,
+                    deleted_by = self,
+                    deleted_at = timestamp
+                )
 
     signals.delete_question_or_answer.send(
         sender = question.__class__,
@@ -1156,6 +1171,7 @@ def user_restore_post(
     #here timestamp is not used, I guess added for consistency
     self.assert_can_restore_post(post)
     if isinstance(post, Question) or isinstance(post, Answer):
+        was_deleted = post.deleted
         post.deleted = False
         post.deleted_by = None 
         post.deleted_at = None 
@@ -1166,12 +1182,20 @@ def user_restore_post(
             #todo: make sure that these tags actually exist
             #some may have since been deleted for good 
             #or merged into others
-            for tag in list(post.tags.all()):
-                if tag.used_count == 1 and tag.deleted:
-                    tag.deleted = False
-                    tag.deleted_by = None
-                    tag.deleted_at = None 
-                    tag.save()
+            if was_deleted:
+                tags = list(post.tags.all())
+                Tag.objects.change_use_counts(tags, 1)
+                #the tags are used again
+                Tag.objects.filter(
+                            id__in = [tag.id for tag in tags],
+                            deleted = True
+                        ).update(
+                            deleted = False,
+                            deleted_by = None,
+                            deleted_at = None
+                        )
+            tag_index.update_question(post)
+            tag_lookup.invalidate()
     else:
         raise NotImplementedError()
 
@@ -1346,7 +1370,7 @@ def user_post_answer(
     return answer
 
 def user_visit_question(self, question = None, timestamp = None):
-    """create a QuestionView record
+    """create or update a QuestionView record
     on behalf of the user represented by the self object
     and mark it as taking place at timestamp time
 
@@ -1358,18 +1382,8 @@ def user_visit_question(self, question = None, timestamp = None):
     if timestamp is None:
         timestamp = datetime.datetime.now()
 
-    try:
-        question_view = QuestionView.objects.get(
-                                        who = self,
-                                        question = question
-                                    )
-    except QuestionView.DoesNotExist:
-        question_view = QuestionView(
-                                who = self, 
-                                question = question
-                            )
-    question_view.when = timestamp
-    question_view.save()
+    #the record is saved later in bulk with other visits
+    view_counter.record_visit(self, question, timestamp)
 
     #filter memo objects on response activities directed to the qurrent user
     #that refer to the children of the currently
@@ -1394,11 +1408,13 @@ def user_visit_question(self, question = None, timestamp = None):
     #finally, mark admin memo objects if applicable
     #the admin response counts are not denormalized b/c they are easy to obtain
     if self.is_moderator() or self.is_administrator():
-        audit_records.filter(
+        seen_flag_count = audit_records.filter(
                 activity__activity_type = const.TYPE_ACTIVITY_MARK_OFFENSIVE
         ).update(
             status=ActivityAuditStatus.STATUS_SEEN
         )
+        if seen_flag_count > 0:
+            invalidate_moderation_items()
 
 
 def user_is_username_taken(cls,username):
@@ -1981,6 +1997,8 @@ def user_update_wildcard_tag_selections(
     self.interesting_tags = ' '.join(interesting)
     self.ignored_tags = ' '.join(ignored)
     self.save()
+    subscriber_index.update_user(self.id)
+    tag_filter.invalidate_user(self)
     return new_tags
 
 
@@ -2166,14 +2184,20 @@ def format_instant_notification_email(
         assert('comment' not in update_type)
         revisions = post.revisions.all()[:2]
         assert(len(revisions) == 2)
-        content_preview = htmldiff(
-                            revisions[1].as_html(),
-                            revisions[0].as_html(),
-                            ins_start = '<b><u style="background-color:#cfc">',
-                            ins_end = '</u></b>',
-                            del_start = '<del style="color:#600;background-color:#fcc">',
-                            del_end = '</del>'
-                        )
+        content_preview = revisions[0].get_diff(
+                                    previous_revision = revisions[1]
+                                )
+        #stored diff is marked up with plain <ins> and <del>
+        content_preview = content_preview.replace(
+                                    '<ins>',
+                                    '<b><u style="background-color:#cfc">'
+                                ).replace(
+                                    '</ins>',
+                                    '</u></b>'
+                                ).replace(
+                                    '<del>',
+                                    '<del style="color:#600;background-color:#fcc">'
+                                )
         #todo: remove hardcoded style
     else:
         from askbot.templatetags.extra_filters_jinja import absolutize_urls_func
@@ -2231,9 +2255,7 @@ def send_instant_notifications_about_activity_in_post(
     update_type_map = const.RESPONSE_ACTIVITY_TYPE_MAP_FOR_TEMPLATES
     update_type = update_type_map[update_activity.activity_type]
 
-    origin_post = post.get_origin_post()
-    for user in recipients:
-
+    def render_notification(user):
         subject_line, body_text = format_instant_notification_email(
                         to_user = user,
                         from_user = update_activity.user,
@@ -2241,15 +2263,16 @@ def send_instant_notifications_about_activity_in_post(
                         update_type = update_type,
                         template = template,
                     )
-        #todo: this could be packaged as an "action" - a bundle
-        #of executive function with the activity log recording
-        mail.send_mail(
-            subject_line = subject_line,
-            body_text = body_text,
-            recipient_list = [user.email],
-            related_object = origin_post,
-            activity_type = const.TYPE_ACTIVITY_EMAIL_UPDATE_SENT
-        )
+        return mail.make_message(
+                        subject_line = subject_line,
+                        body_text = body_text,
+                        recipient_list = [user.email]
+                    )
+
+    #todo: this could be packaged as an "action" - a bundle
+    #of executive function with the activity log recording
+    messages = mail.render_messages(render_notification, recipients)
+    mail.send_messages(messages)
 
 
 #todo: move to utils
@@ -2367,19 +2390,10 @@ def record_answer_accepted(instance, created, **kwargs):
 def record_user_visit(user, timestamp, **kwargs):
     """
     when user visits any pages, we update the last_seen and
-    consecutive_days_visit_count
+    consecutive_days_visit_count, the writes are coalesced
+    by the :mod:`~askbot.models.last_seen_tracker`
     """
-    prev_last_seen = user.last_seen
-    user.last_seen = timestamp
-    if (user.last_seen - prev_last_seen).days == 1:
-        user.consecutive_days_visit_count += 1
-        award_badges_signal.send(None,
-            event = 'site_visit',
-            actor = user,
-            context_object = user,
-            timestamp = timestamp
-        )
-    user.save()
+    last_seen_tracker.record_visit(user, timestamp)
 
 
 def record_vote(instance, created, **kwargs):
@@ -2454,6 +2468,7 @@ def record_flag_offensive(instance, mark_by, **kwargs):
                     models.Q(is_superuser=True) | models.Q(status='m')
                 )
     activity.add_recipients(recipients)
+    invalidate_moderation_items()
 
 def record_update_tags(question, tags, user, timestamp, **kwargs):
     """
@@ -2504,6 +2519,27 @@ def record_user_full_updated(instance, **kwargs):
                 )
     activity.save()
 
+def invalidate_question_page_cache(
+                                sender,
+                                instance = None,
+                                post = None,
+                                question = None,
+                                **kwargs
+                            ):
+    """makes cached fragments of the question page stale
+    works with the ``post_updated``, ``tags_updated``
+    and ``delete_question_or_answer`` signals and with
+    saving and deleting of votes and comments
+    """
+    post = question or post or instance
+    if isinstance(post, Vote):
+        post = post.content_object
+    try:
+        question = post.get_origin_post()
+    except AttributeError:#the post itself is gone
+        return
+    question.invalidate_page_cache()
+
 def complete_pending_tag_subscriptions(sender, request, *args, **kwargs):
     """save pending tag subscriptions saved in the session"""
     if 'subscribe_for_tags' in request.session:
@@ -2591,6 +2627,46 @@ signals.post_updated.connect(
                        )
 signals.site_visited.connect(record_user_visit)
 
+#cached pages of the question list become stale with any update
+signals.post_updated.connect(result_cache.invalidate)
+signals.tags_updated.connect(result_cache.invalidate)
+signals.delete_question_or_answer.connect(result_cache.invalidate)
+
+#cached fragments of the question page
+signals.post_updated.connect(invalidate_question_page_cache)
+signals.tags_updated.connect(invalidate_question_page_cache)
+signals.delete_question_or_answer.connect(invalidate_question_page_cache)
+django_signals.post_save.connect(invalidate_question_page_cache, sender=Vote)
+django_signals.post_delete.connect(invalidate_question_page_cache, sender=Vote)
+django_signals.post_delete.connect(invalidate_question_page_cache, sender=Comment)
+
+#the full text search index follows the questions, answers and tags
+signals.post_updated.connect(search_backends.update_index, sender=Question)
+signals.post_updated.connect(search_backends.update_index, sender=Answer)
+signals.tags_updated.connect(search_backends.update_index)
+signals.delete_question_or_answer.connect(search_backends.update_index)
+
+#index of the tag selections of the instant notification subscribers
+django_signals.post_save.connect(subscriber_index.update_subscriber, sender=EmailFeedSetting)
+django_signals.post_delete.connect(subscriber_index.update_subscriber, sender=EmailFeedSetting)
+django_signals.post_delete.connect(subscriber_index.delete_tag, sender=Tag)
+
+#index of the question tags for the related tags and similar questions
+signals.tags_updated.connect(tag_index.update_question)
+signals.delete_question_or_answer.connect(tag_index.remove_question)
+
+#tag selections of the users resolved to the tag id's
+django_signals.post_save.connect(tag_filter.invalidate, sender=Tag)
+django_signals.post_delete.connect(tag_filter.invalidate, sender=Tag)
+django_signals.post_save.connect(tag_filter.invalidate_tag_mark, sender=MarkedTag)
+django_signals.post_delete.connect(tag_filter.invalidate_tag_mark, sender=MarkedTag)
+
+#tag names and use counts for the autocompletion
+django_signals.post_save.connect(tag_lookup.invalidate, sender=Tag)
+django_signals.post_delete.connect(tag_lookup.invalidate, sender=Tag)
+signals.tags_updated.connect(tag_lookup.invalidate)
+signals.delete_question_or_answer.connect(tag_lookup.invalidate, sender=Question)
+
 #set up a possibility for the users to follow others
 try:
     import followit
@@ -13,7 +13,6 @@ from askbot.models import content
 from askbot import const
 from askbot.utils.slug import slugify
 from askbot.utils import markup
-from askbot.utils.html import sanitize_html
 
 class AnswerManager(models.Manager):
     def create_new(
@@ -32,6 +31,8 @@ class AnswerManager(models.Manager):
             added_at = added_at,
             wiki = wiki,
             text = text,
+            last_update_at = added_at,
+            last_update_by = author,
             #.html field is denormalized by the save() call
         )
         if answer.wiki:
@@ -51,6 +52,7 @@ class AnswerManager(models.Manager):
         #update question data
         question.last_activity_at = added_at
         question.last_activity_by = author
+        question.set_last_update_info(added_at, author)
         question.answer_count +=1
         question.save()
 
@@ -143,6 +145,7 @@ class Answer(content.Content, DeletableContent):
 
         self.last_edited_at = edited_at
         self.last_edited_by = edited_by
+        self.set_last_update_info(edited_at, edited_by)
         #self.html is denormalized in save()
         self.text = text
         #todo: bug wiki has no effect here
@@ -159,6 +162,7 @@ class Answer(content.Content, DeletableContent):
 
         self.question.last_activity_at = edited_at
         self.question.last_activity_by = edited_by
+        self.question.set_last_update_info(edited_at, edited_by)
         self.question.save()
 
     def repost_as_question(self, new_title = None):
@@ -311,8 +315,16 @@ class AnswerRevision(ContentRevision):
         return self.answer.question.title
 
     def as_html(self):
-        markdowner = markup.get_parser()
-        return sanitize_html(markdowner.convert(self.text))
+        return markup.markdown_to_html(self.text)
+
+    def get_previous_revision(self):
+        revisions = AnswerRevision.objects.filter(
+                                answer = self.answer_id,
+                                revision__lt = self.revision
+                            ).order_by('-revision')[:1]
+        if len(revisions) == 0:
+            return None
+        return revisions[0]
 
     class Meta(ContentRevision.Meta):
         db_table = u'answer_revision'
@@ -324,6 +336,8 @@ class AnswerRevision(ContentRevision):
             self.revision = AnswerRevision.objects.filter(
                 answer=self.answer).values_list('revision',
                                                 flat=True)[0] + 1
+        if self.html is None:
+            self.render()
         super(AnswerRevision, self).save(**kwargs)
 
 class AnonymousAnswer(AnonymousContent):
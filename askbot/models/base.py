@@ -8,7 +8,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.sitemaps import ping_google
 #todo: maybe merge askbot.utils.markup and forum.utils.html
 from askbot.utils import markup
-from askbot.utils.html import sanitize_html
+from askbot.utils.diff import textDiff as htmldiff
 from django.utils import html
 import logging
 
@@ -38,7 +38,7 @@ def parse_post_text(post):
         text = html.urlize(text)
 
     if post._use_markdown:
-        text = sanitize_html(markup.get_parser().convert(text))
+        text = markup.markdown_to_html(text)
 
     #todo, add markdown parser call conditional on
     #post.use_markdown flag
@@ -227,6 +227,10 @@ class ContentRevision(models.Model):
     revised_at = models.DateTimeField()
     summary    = models.CharField(max_length=300, blank=True)
     text       = models.TextField()
+    #output of as_html() and html diff against the previous revision,
+    #stored when the revision is saved, diff of the first revision is null
+    html       = models.TextField(null=True, blank=True)
+    diff       = models.TextField(null=True, blank=True)
 
     class Meta:
         abstract = True
@@ -238,6 +242,42 @@ class ContentRevision(models.Model):
         """
         raise NotImplementedError()
 
+    def get_previous_revision(self):
+        """should return the preceding revision of the same post
+        or None
+        """
+        raise NotImplementedError()
+
+    def render(self, previous_revision = None):
+        """fills ``html`` and ``diff`` fields, does not save them
+        previous revision is looked up, unless given
+        """
+        self.html = self.as_html()
+        if previous_revision is None and self.revision > 1:
+            previous_revision = self.get_previous_revision()
+        if previous_revision is None:
+            self.diff = None
+        else:
+            previous_html = previous_revision.html
+            if previous_html is None:
+                previous_html = previous_revision.as_html()
+            self.diff = htmldiff(previous_html, self.html)
+
+    def get_diff(self, previous_revision = None):
+        """returns html diff against the previous revision,
+        revisions saved before the html was stored
+        are rendered and updated on the first call
+        """
+        if self.html is None:
+            self.render(previous_revision)
+            self.__class__.objects.filter(
+                                    id = self.id
+                                ).update(
+                                    html = self.html,
+                                    diff = self.diff
+                                )
+        return self.diff
+
 
 class AnonymousContent(models.Model):
     """
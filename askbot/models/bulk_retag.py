@@ -0,0 +1,216 @@
+"""Retagging of many questions at once - renaming and merging of tags,
+used by the ``rename_tags`` and ``rename_tags_id`` management commands
+
+Retagging with ``User.retag_question`` saves each question, recounts
+its tags, creates a revision and sends the ``tags_updated`` signal,
+whose handlers record activity, award badges and update the caches.
+When a tag used in many questions is renamed, that takes hours and
+creates an activity record for each question.
+
+Here the questions are processed in chunks, each in a transaction:
+
+* links of the questions to the tags in the ``question_tags``
+  table are deleted and inserted with one statement per chunk
+* denormalized ``Question.tagnames`` and the new revisions
+  are written with batched statements
+* no signals are sent, the caches and the search index
+  are updated directly, optionally a single activity record
+  is created for the whole operation
+* use counts of the affected tags are recalculated once at the end
+"""
+import datetime
+from django.db import connection, transaction
+from askbot import const
+from askbot.models.question import Question, QuestionRevision
+from askbot.models.tag import Tag
+from askbot.models.user import Activity
+from askbot.models import tag_filter
+from askbot.models import tag_index
+from askbot.models import tag_lookup
+from askbot.search import result_cache
+from askbot.search import backends as search_backends
+
+CHUNK_SIZE = 500
+
+INSERT_TAG_LINK_QUERY = """
+    INSERT INTO question_tags (question_id, tag_id) VALUES (%s, %s)
+"""
+UPDATE_TAGNAMES_QUERY = """
+    UPDATE question SET tagnames = %s WHERE id = %s
+"""
+INSERT_REVISION_QUERY = """
+    INSERT INTO question_revision
+    (question_id, revision, title, tagnames, is_anonymous,
+    author_id, revised_at, summary, text)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+def get_new_tagnames(tagnames, from_tag_names, to_tag_names):
+    """returns tag string with the ``from_tag_names`` replaced
+    by the ``to_tag_names``, order of the other tags is kept
+    """
+    tag_names = [
+        tag_name for tag_name in tagnames.split(' ')
+        if tag_name and tag_name not in from_tag_names
+    ]
+    for tag_name in to_tag_names:
+        if tag_name not in tag_names:
+            tag_names.append(tag_name)
+    return u' '.join(tag_names)
+
+def get_latest_revisions(question_ids):
+    """returns dictionary question id -> tuple
+    (revision number, title, text, is_anonymous) of the latest revision
+    """
+    latest_numbers = dict()
+    numbers = QuestionRevision.objects.filter(
+                                    question__in = question_ids
+                                ).values_list('question', 'revision')
+    for question_id, number in numbers:
+        if number > latest_numbers.get(question_id, 0):
+            latest_numbers[question_id] = number
+
+    revisions = QuestionRevision.objects.filter(
+                        question__in = question_ids,
+                        revision__in = set(latest_numbers.values())
+                    ).values_list(
+                        'question', 'revision', 'title', 'text', 'is_anonymous'
+                    )
+    latest_revisions = dict()
+    for question_id, number, title, text, is_anonymous in revisions:
+        if number == latest_numbers[question_id]:
+            latest_revisions[question_id] = (number, title, text, is_anonymous)
+    return latest_revisions
+
+@transaction.commit_on_success
+def retag_chunk(question_ids, from_tags, to_tags, user, timestamp):
+    """retags the questions, see :func:`retag_questions`"""
+    from_tag_names = set([tag.name for tag in from_tags])
+    to_tag_names = [tag.name for tag in to_tags]
+    to_tag_ids = [tag.id for tag in to_tags]
+    tag_links = Question.tags.through.objects.filter(question__in = question_ids)
+    cursor = connection.cursor()
+
+    tag_links.filter(tag__in = [tag.id for tag in from_tags]).delete()
+    linked = set(
+        tag_links.filter(tag__in = to_tag_ids).values_list('question', 'tag')
+    )
+    new_links = list()
+    for question_id in question_ids:
+        for tag_id in to_tag_ids:
+            if (question_id, tag_id) not in linked:
+                new_links.append((question_id, tag_id))
+    if new_links:
+        cursor.executemany(INSERT_TAG_LINK_QUERY, new_links)
+
+    new_tagnames = dict()
+    questions = Question.objects.filter(
+                                id__in = question_ids
+                            ).values_list('id', 'tagnames')
+    for question_id, tagnames in questions:
+        new_tagnames[question_id] = get_new_tagnames(
+                                                tagnames,
+                                                from_tag_names,
+                                                to_tag_names
+                                            )
+    if new_tagnames:
+        cursor.executemany(
+            UPDATE_TAGNAMES_QUERY,
+            [(tagnames, question_id)
+                for question_id, tagnames in new_tagnames.items()]
+        )
+
+    #revisions are rendered to html when the diff is first requested
+    revisions = list()
+    latest_revisions = get_latest_revisions(question_ids)
+    for question_id, revision in latest_revisions.items():
+        number, title, text, is_anonymous = revision
+        revisions.append((
+            question_id,
+            number + 1,
+            title,
+            new_tagnames[question_id],
+            is_anonymous,
+            user.id,
+            timestamp,
+            const.POST_STATUS['retagged'],
+            text
+        ))
+    if revisions:
+        cursor.executemany(INSERT_REVISION_QUERY, revisions)
+
+def update_tags(from_tags, to_tags):
+    """recounts the tags, deletes the replaced tags
+    that are no longer used and undeletes the used target tags
+    """
+    Tag.objects.update_use_counts(list(from_tags) + list(to_tags))
+
+    from_tag_ids = [tag.id for tag in from_tags]
+    linked_tag_ids = set(
+        Question.tags.through.objects.filter(
+                                    tag__in = from_tag_ids
+                                ).values_list('tag', flat = True)
+    )
+    unused_tags = Tag.objects.filter(id__in = from_tag_ids, used_count = 0)
+    for tag in unused_tags:
+        if tag.id not in linked_tag_ids:
+            tag.delete()
+
+    Tag.objects.filter(
+                id__in = [tag.id for tag in to_tags],
+                used_count__gt = 0
+            ).update(
+                deleted = False,
+                deleted_by = None,
+                deleted_at = None
+            )
+
+def retag_questions(
+                question_ids = None,
+                from_tags = None,
+                to_tags = None,
+                user = None,
+                timestamp = None,
+                record_activity = False,
+                chunk_size = CHUNK_SIZE,
+                progress_callback = None
+            ):
+    """replaces ``from_tags`` with ``to_tags`` in the questions,
+    a new revision of each question is authored by the ``user``
+
+    ``record_activity`` - if ``True``, a single activity record
+    of the tag update is created for the whole operation
+
+    ``progress_callback`` is called after each chunk
+    with the number of the processed questions
+    """
+    if timestamp is None:
+        timestamp = datetime.datetime.now()
+    question_ids = sorted(question_ids)
+    backend = search_backends.get_backend()
+
+    processed_count = 0
+    for start in range(0, len(question_ids), chunk_size):
+        chunk = question_ids[start:start + chunk_size]
+        retag_chunk(chunk, from_tags, to_tags, user, timestamp)
+        for question in Question.objects.filter(id__in = chunk):
+            question.invalidate_page_cache()
+            backend.update_question(question)
+        processed_count += len(chunk)
+        if progress_callback:
+            progress_callback(processed_count)
+
+    update_tags(from_tags, to_tags)
+    tag_index.invalidate()
+    tag_lookup.invalidate()
+    tag_filter.invalidate()
+    result_cache.invalidate()
+
+    if record_activity and to_tags:
+        activity = Activity(
+                        user = user,
+                        active_at = timestamp,
+                        content_object = to_tags[0],
+                        activity_type = const.TYPE_ACTIVITY_UPDATE_TAGS
+                    )
+        activity.save()
@@ -8,7 +8,8 @@ from django.utils.datastructures import SortedDict
 from askbot import const
 from askbot.models.meta import Comment, Vote
 from askbot.models.user import EmailFeedSetting
-from askbot.models.tag import Tag, MarkedTag, tags_match_some_wildcard
+from askbot.models.tag import Tag
+from askbot.models import subscriber_index
 from askbot.conf import settings as askbot_settings
 
 class Content(models.Model):
@@ -35,6 +36,11 @@ class Content(models.Model):
     last_edited_at = models.DateTimeField(null=True, blank=True)
     last_edited_by = models.ForeignKey(User, null=True, blank=True, related_name='last_edited_%(class)ss')
 
+    #denormalized time and author of the latest addition, edit or comment,
+    #for questions - of the whole thread, including the answers
+    last_update_at = models.DateTimeField(null=True, blank=True)
+    last_update_by = models.ForeignKey(User, null=True, blank=True, related_name='last_updated_%(class)ss')
+
     html = models.TextField(null=True)#html rendition of the latest revision
     text = models.TextField(null=True)#denormalized copy of latest revision
     comments = generic.GenericRelation(Comment)
@@ -72,6 +78,22 @@ class Content(models.Model):
             ).order_by('id')
             return comments
 
+    def set_flagged_by(self, user, is_flagged):
+        """remembers whether the user has flagged the post
+        as offensive, so that :meth:`is_flagged_by`
+        does not need to query the database
+        """
+        if not hasattr(self, '_flagged_by'):
+            self._flagged_by = dict()
+        self._flagged_by[user.id] = is_flagged
+
+    def is_flagged_by(self, user):
+        """True if the user has flagged the post as offensive"""
+        flagged_by = getattr(self, '_flagged_by', dict())
+        if user.id in flagged_by:
+            return flagged_by[user.id]
+        return user.get_flags_for_post(self).count() > 0
+
     #todo: maybe remove this wnen post models are unified
     def get_text(self):
         return self.text
@@ -96,8 +118,14 @@ class Content(models.Model):
                         )
         comment.parse_and_save(author = user)
         self.comment_count = self.comment_count + 1
+        self.set_last_update_info(added_at, user)
         self.save()
 
+        origin_post = self.get_origin_post()
+        if origin_post != self:
+            origin_post.set_last_update_info(added_at, user)
+            origin_post.save_last_update_info()
+
         #tried to add this to bump updated question
         #in most active list, but it did not work
         #becase delayed email updates would be triggered
@@ -121,71 +149,55 @@ class Content(models.Model):
                                     tag_mark_reason = None,
                                     subscription_records = None
                                 ):
-        """returns a list of users who either follow or "do not ignore"
+        """returns a set of users who either follow or "do not ignore"
         the given set of tags, depending on the tag_mark_reason
 
         ``subscription_records`` - query set of ``~askbot.models.EmailFeedSetting``
-        this argument is used to reduce number of database queries
+        objects, by default - instant notifications about the whole forum
+
+        tag selections of the users are looked up in the
+        :mod:`~askbot.models.subscriber_index`, which covers subscribers
+        to the instant notifications about the whole forum, so
+        the ``subscription_records`` may only narrow that set
         """
+        if subscription_records is None:
+            subscription_records = EmailFeedSetting.objects.filter(
+                                                    feed_type = 'q_all',
+                                                    frequency = 'i'
+                                                )
+        tag_names = self.get_tag_names()
+        use_wildcards = askbot_settings.USE_WILDCARD_TAGS
         if tag_mark_reason == 'good':
-            email_tag_filter_strategy = const.INCLUDE_INTERESTING
-            user_set_getter = User.objects.filter
+            #part 1 - find users who follow the tags directly or via wildcards
+            follower_ids = subscriber_index.get_tag_followers(
+                                                    tag_names,
+                                                    use_wildcards
+                                                )
+            if len(follower_ids) == 0:
+                return set()
+            return set(
+                User.objects.filter(
+                    id__in = follower_ids,
+                    notification_subscriptions__in = subscription_records,
+                    email_tag_filter_strategy = const.INCLUDE_INTERESTING
+                )
+            )
         elif tag_mark_reason == 'bad':
-            email_tag_filter_strategy = const.EXCLUDE_IGNORED
-            user_set_getter = User.objects.exclude
+            #part 2 - find subscribers who do not ignore any of the tags
+            ignorer_ids = subscriber_index.get_tag_ignorers(
+                                                    tag_names,
+                                                    use_wildcards
+                                                )
+            subscribers = User.objects.filter(
+                notification_subscriptions__in = subscription_records,
+                email_tag_filter_strategy = const.EXCLUDE_IGNORED
+            )
+            if ignorer_ids:
+                subscribers = subscribers.exclude(id__in = ignorer_ids)
+            return set(subscribers)
         else:
             raise ValueError('Uknown value of tag mark reason %s' % tag_mark_reason)
 
-        #part 1 - find users who follow or not ignore the set of tags
-        tag_names = self.get_tag_names()
-        tag_selections = MarkedTag.objects.filter(
-                                            tag__name__in = tag_names,
-                                            reason = tag_mark_reason
-                                        )
-        subscribers = set(
-            user_set_getter(
-                tag_selections__in = tag_selections
-            ).filter(
-                notification_subscriptions__in = subscription_records
-            ).filter(
-                email_tag_filter_strategy = email_tag_filter_strategy
-            )
-        )
-
-        #part 2 - find users who follow or not ignore tags via wildcard selections
-        #inside there is a potentially time consuming loop
-        if askbot_settings.USE_WILDCARD_TAGS:
-            #todo: fix this 
-            #this branch will not scale well
-            #because we have to loop through the list of users
-            #in python
-            if tag_mark_reason == 'good':
-                empty_wildcard_filter = {'interesting_tags__exact': ''}
-                wildcard_tags_attribute = 'interesting_tags'
-                update_subscribers = lambda the_set, item: the_set.add(item)
-            elif tag_mark_reason == 'bad':
-                empty_wildcard_filter = {'ignored_tags__exact': ''}
-                wildcard_tags_attribute = 'ignored_tags'
-                update_subscribers = lambda the_set, item: the_set.discard(item)
-
-            potential_wildcard_subscribers = User.objects.filter(
-                notification_subscriptions__in = subscription_records
-            ).filter(
-                email_tag_filter_strategy = email_tag_filter_strategy
-            ).exclude(
-                **empty_wildcard_filter #need this to limit size of the loop
-            )
-            for potential_subscriber in potential_wildcard_subscribers:
-                wildcard_tags = getattr(
-                                    potential_subscriber,
-                                    wildcard_tags_attribute
-                                ).split(' ')
-
-                if tags_match_some_wildcard(tag_names, wildcard_tags):
-                    update_subscribers(subscribers, potential_subscriber)
-
-        return subscribers
-
     def get_global_instant_notification_subscribers(self):
         """returns a set of subscribers to post according to tag filters
         both - subscribers who ignore tags or who follow only
@@ -193,8 +205,6 @@ class Content(models.Model):
 
         this method in turn calls several more specialized
         subscriber retrieval functions
-        todo: retrieval of wildcard tag followers ignorers
-              won't scale at all
         """
         subscriber_set = set()
 
@@ -383,7 +393,35 @@ class Content(models.Model):
                         % user.email_tag_filter_strategy
                     )
 
+    def set_last_update_info(self, when, who):
+        """records time and author of the update of the post,
+        unless a later update is already recorded
+        the post is not saved here
+        """
+        if self.last_update_at is None or when >= self.last_update_at:
+            self.last_update_at = when
+            self.last_update_by = who
+
+    def save_last_update_info(self):
+        """saves only the last update fields, without the
+        side effects of the ``save()``"""
+        self.__class__.objects.filter(id = self.id).update(
+                                    last_update_at = self.last_update_at,
+                                    last_update_by = self.last_update_by
+                                )
+
     def post_get_last_update_info(self):#todo: rename this subroutine
+        """returns time and author of the latest update of the post,
+        posts saved before the ``last_update_at`` field
+        was filled are looked up the slow way
+        """
+        if self.last_update_at is not None:
+            return self.last_update_at, self.last_update_by
+        return self.compute_last_update_info()
+
+    def compute_last_update_info(self):
+        """looks up the latest update of the post
+        among the edits and comments"""
         when = self.added_at
         who = self.author
         if self.last_edited_at and self.last_edited_at > when:
@@ -0,0 +1,121 @@
+"""Tracker of the time when users were last seen on the site
+
+Saving the user on every request of a logged in user only to change
+``last_seen`` by a few seconds is the most frequent write to the user table.
+
+Here ``last_seen`` is written only when the stored value
+is older than ``ASKBOT_LAST_SEEN_UPDATE_INTERVAL`` seconds (django setting,
+300 by default), and those updates are collected in the memory of the
+process and saved in bulk once in the same interval,
+with the time rounded to the minute.
+
+The first visit on a new calendar day is saved immediately,
+because it updates ``consecutive_days_visit_count`` and may earn a badge.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from askbot.models.badges import award_badges_signal
+
+def get_update_interval():
+    return getattr(django_settings, 'ASKBOT_LAST_SEEN_UPDATE_INTERVAL', 300)
+
+
+class LastSeenTracker(object):
+    """buffer of the ``last_seen`` timestamps of the users"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_seen = dict()#user id -> time of the last visit
+        self.last_flush_time = time.time()
+
+    def record_visit(self, user, timestamp):
+        if timestamp.date() > user.last_seen.date():
+            self.record_first_visit_of_day(user, timestamp)
+            return
+
+        interval = datetime.timedelta(0, get_update_interval())
+        if timestamp - user.last_seen < interval:
+            return
+
+        self.lock.acquire()
+        try:
+            self.last_seen[user.id] = timestamp
+        finally:
+            self.lock.release()
+        user.last_seen = timestamp
+        self.maybe_flush()
+
+    def record_first_visit_of_day(self, user, timestamp):
+        """updates last_seen and the counter of the consecutive
+        days of visits right away and sends the ``site_visit`` event
+        """
+        today = datetime.datetime.combine(timestamp.date(), datetime.time())
+        yesterday = today - datetime.timedelta(1)
+        #condition on last_seen prevents counting the day twice
+        #when requests of the same user are processed in parallel
+        users = User.objects.filter(id = user.id, last_seen__lt = today)
+        if user.last_seen >= yesterday:
+            updated_count = users.update(
+                        last_seen = timestamp,
+                        consecutive_days_visit_count = \
+                                F('consecutive_days_visit_count') + 1
+                    )
+            if updated_count == 1:
+                user.consecutive_days_visit_count += 1
+                award_badges_signal.send(None,
+                    event = 'site_visit',
+                    actor = user,
+                    context_object = user,
+                    timestamp = timestamp
+                )
+        else:
+            users.update(last_seen = timestamp)
+        user.last_seen = timestamp
+
+    def maybe_flush(self):
+        if time.time() - self.last_flush_time >= get_update_interval():
+            self.flush()
+
+    def flush(self):
+        """saves accumulated timestamps to the database"""
+        self.lock.acquire()
+        try:
+            last_seen = self.last_seen
+            self.last_seen = dict()
+            self.last_flush_time = time.time()
+        finally:
+            self.lock.release()
+
+        #users seen within the same minute are updated by one query
+        users_by_minute = dict()
+        for user_id, timestamp in last_seen.items():
+            minute = timestamp.replace(second = 0, microsecond = 0)
+            users_by_minute.setdefault(minute, list()).append(user_id)
+        for minute, user_ids in users_by_minute.items():
+            User.objects.filter(
+                        id__in = user_ids,
+                        last_seen__lt = minute
+                    ).update(last_seen = minute)
+
+
+LAST_SEEN_TRACKER = LastSeenTracker()
+
+def record_visit(user, timestamp):
+    LAST_SEEN_TRACKER.record_visit(user, timestamp)
+
+def flush():
+    LAST_SEEN_TRACKER.flush()
+
+def flush_at_exit():
+    try:
+        flush()
+    except Exception, e:
+        logging.critical('could not save last seen times of users: %s' % e)
+
+atexit.register(flush_at_exit)
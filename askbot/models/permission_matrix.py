@@ -0,0 +1,285 @@
+"""Matrix of the functions available to the user in the user interface
+(edit, delete, close, flag as offensive, etc.) for a set of posts
+
+The ``User.assert_can_*`` methods raise ``PermissionDenied``
+with the explanation of the reason and read the settings and
+the user status on each call, which is appropriate before
+the action, but slow when the question page decides whether to show
+the links for each of its posts and comments.
+
+Here the same rules are evaluated once per post in a single pass,
+without exceptions and with the user status read once.
+The rules must be kept in sync with the assertions
+in :mod:`askbot.models`, the tests compare the results.
+"""
+import datetime
+from django.contrib.contenttypes.models import ContentType
+from askbot.conf import settings as askbot_settings
+from askbot.models.question import Question
+from askbot.models.answer import Answer
+from askbot.models.meta import Comment
+
+QUESTION_CAPABILITIES = (
+    'edit_post', 'retag_question', 'close_question', 'reopen_question',
+    'flag_offensive', 'see_offensive_flags', 'delete_post', 'post_comment'
+)
+ANSWER_CAPABILITIES = (
+    'edit_post', 'flag_offensive', 'see_offensive_flags',
+    'delete_post', 'post_comment'
+)
+COMMENT_CAPABILITIES = ('edit_comment', 'delete_comment')
+
+
+def get_post_key(post):
+    content_type = ContentType.objects.get_for_model(post)
+    return (content_type.id, post.id)
+
+def get_owner_id(post):
+    if isinstance(post, Comment):
+        return post.user_id
+    return post.author_id
+
+
+class PermissionMatrix(object):
+    """functions available to the ``user`` for the ``posts``
+    - questions, answers and comments
+
+    use :meth:`can` to look up the results, posts that
+    were not given to the constructor are evaluated on demand
+
+    comments of a post must be given either all or none,
+    because the last comment of the post is found among them
+    """
+    def __init__(self, user = None, posts = None):
+        self.user = user
+        self.granted = dict()#post key -> set of the allowed functions
+        self.question_authors = dict()#question id -> author id
+        self.last_comment_times = dict()#parent post key -> time
+        self.flag_count_today = None
+
+        self.show_all = askbot_settings.ALWAYS_SHOW_ALL_UI_FUNCTIONS
+        if user.is_authenticated():
+            self.is_blocked = user.is_blocked()
+            self.is_suspended = user.is_suspended()
+            self.is_admin_or_moderator = \
+                user.is_administrator() or user.is_moderator()
+
+        posts = posts or list()
+        for post in posts:
+            if isinstance(post, Question):
+                self.question_authors[post.id] = post.author_id
+            elif isinstance(post, Comment):
+                parent_key = (post.content_type_id, post.object_id)
+                last_time = self.last_comment_times.get(parent_key, None)
+                if last_time is None or post.added_at > last_time:
+                    self.last_comment_times[parent_key] = post.added_at
+        for post in posts:
+            self.add_post(post)
+
+    def can(self, capability, post):
+        """True if the function is available for the post"""
+        post_key = get_post_key(post)
+        if post_key not in self.granted:
+            self.add_post(post)
+        return capability in self.granted[post_key]
+
+    def add_post(self, post):
+        if isinstance(post, Question):
+            capabilities = QUESTION_CAPABILITIES
+        elif isinstance(post, Answer):
+            capabilities = ANSWER_CAPABILITIES
+        else:
+            capabilities = COMMENT_CAPABILITIES
+
+        granted = set()
+        for capability in capabilities:
+            if capability == 'see_offensive_flags':
+                #this one does not depend on ALWAYS_SHOW_ALL_UI_FUNCTIONS
+                is_allowed = self.can_see_offensive_flags(post)
+            elif self.show_all:
+                is_allowed = True
+            elif self.user.is_anonymous():
+                is_allowed = False
+            else:
+                is_allowed = getattr(self, 'can_' + capability)(post)
+            if is_allowed:
+                granted.add(capability)
+        self.granted[get_post_key(post)] = granted
+
+    def check(
+                self,
+                post = None,
+                admin_or_moderator_required = False,
+                owner_can = False,
+                suspended_owner_cannot = False,
+                owner_min_rep_setting = None,
+                blocked_cannot = False,
+                suspended_cannot = False,
+                min_rep_setting = None
+            ):
+        """boolean version of the ``askbot.models._assert_user_can``"""
+        if blocked_cannot and self.is_blocked:
+            return False
+        elif owner_can and self.user.id == get_owner_id(post):
+            if owner_min_rep_setting:
+                if self.user.reputation < owner_min_rep_setting:
+                    return self.is_admin_or_moderator
+            if suspended_owner_cannot and self.is_suspended:
+                return False
+            return True
+        elif suspended_cannot and self.is_suspended:
+            return False
+        elif self.is_admin_or_moderator:
+            return True
+        elif min_rep_setting is not None \
+            and self.user.reputation < min_rep_setting:
+            return False
+        return not admin_or_moderator_required
+
+    def can_see_deleted_post(self, post):
+        return self.check(
+                    post = post,
+                    admin_or_moderator_required = True,
+                    owner_can = True
+                )
+
+    def can_edit_post(self, post):
+        if post.deleted:
+            return self.can_see_deleted_post(post)
+        if post.wiki:
+            min_rep_setting = askbot_settings.MIN_REP_TO_EDIT_WIKI
+        else:
+            min_rep_setting = askbot_settings.MIN_REP_TO_EDIT_OTHERS_POSTS
+        return self.check(
+                    post = post,
+                    owner_can = True,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = min_rep_setting
+                )
+
+    def can_retag_question(self, question):
+        if question.deleted and not self.can_see_deleted_post(question):
+            return False
+        return self.check(
+                    post = question,
+                    owner_can = True,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_RETAG_OTHERS_QUESTIONS
+                )
+
+    def can_close_question(self, question):
+        return self.check(
+                    post = question,
+                    owner_can = True,
+                    suspended_owner_cannot = True,
+                    owner_min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_CLOSE_OWN_QUESTIONS,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_CLOSE_OTHERS_QUESTIONS
+                )
+
+    def can_reopen_question(self, question):
+        return self.check(
+                    post = question,
+                    admin_or_moderator_required = True,
+                    owner_can = True,
+                    suspended_owner_cannot = True,
+                    owner_min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_REOPEN_OWN_QUESTIONS
+                )
+
+    def can_flag_offensive(self, post):
+        if post.is_flagged_by(self.user):
+            #the link is shown to cancel the flag
+            return True
+        is_allowed = self.check(
+                    post = post,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = askbot_settings.MIN_REP_TO_FLAG_OFFENSIVE
+                )
+        if is_allowed and not self.is_admin_or_moderator:
+            if self.flag_count_today is None:
+                self.flag_count_today = self.user.get_flag_count_posted_today()
+            max_flags = askbot_settings.MAX_FLAGS_PER_USER_PER_DAY
+            return self.flag_count_today < max_flags
+        return is_allowed
+
+    def can_see_offensive_flags(self, post):
+        """same as the template filter ``can_see_offensive_flags``"""
+        if self.user.is_anonymous():
+            return False
+        if self.user.id == get_owner_id(post):
+            return True
+        min_rep = askbot_settings.MIN_REP_TO_VIEW_OFFENSIVE_FLAGS
+        if self.user.reputation >= min_rep:
+            return True
+        return self.user.is_administrator() or self.user.is_moderator()
+
+    def can_delete_post(self, post):
+        is_allowed = self.check(
+                    post = post,
+                    owner_can = True,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_DELETE_OTHERS_POSTS
+                )
+        if is_allowed and isinstance(post, Question) \
+            and self.user.id == post.author_id \
+            and not self.is_admin_or_moderator:
+            #owner cannot delete question with upvoted answers of other people
+            return post.answers.exclude(
+                                    author = self.user
+                                ).exclude(
+                                    score__lte = 0
+                                ).count() == 0
+        return is_allowed
+
+    def can_post_comment(self, post):
+        is_allowed = self.check(
+                    post = post,
+                    owner_can = True,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = askbot_settings.MIN_REP_TO_LEAVE_COMMENTS
+                )
+        if is_allowed or self.is_blocked or self.is_suspended:
+            return is_allowed
+        #with low reputation user can comment answers to own questions
+        if isinstance(post, Answer):
+            question_author_id = self.question_authors.get(post.question_id)
+            if question_author_id is None:
+                question_author_id = post.question.author_id
+            return self.user.id == question_author_id
+        return False
+
+    def can_edit_comment(self, comment):
+        if self.is_admin_or_moderator:
+            return True
+        if self.user.id != comment.user_id:
+            return False
+        if askbot_settings.USE_TIME_LIMIT_TO_EDIT_COMMENT:
+            now = datetime.datetime.now()
+            delta_seconds = 60 * askbot_settings.MINUTES_TO_EDIT_COMMENT
+            if now - comment.added_at > datetime.timedelta(0, delta_seconds):
+                parent_key = (comment.content_type_id, comment.object_id)
+                if parent_key in self.last_comment_times:
+                    return comment.added_at >= self.last_comment_times[parent_key]
+                return comment.is_last()
+        return True
+
+    def can_delete_comment(self, comment):
+        return self.check(
+                    post = comment,
+                    owner_can = True,
+                    blocked_cannot = True,
+                    suspended_cannot = True,
+                    min_rep_setting = \
+                        askbot_settings.MIN_REP_TO_DELETE_OTHERS_COMMENTS
+                )
@@ -20,13 +20,14 @@ from askbot.models.base import BaseQuerySetManager
 from askbot.models.base import parse_post_text
 from askbot.models.base import parse_and_save_post
 from askbot.models import content
+from askbot.models import tag_filter
+from askbot.models import tag_index
 from askbot.models import signals
 from askbot import const
 from askbot.utils.lists import LazyList
 from askbot.utils.slug import slugify
 from askbot.utils import markup
-from askbot.utils.html import sanitize_html
-from askbot.utils import mysql
+from askbot.utils.cache import get_cache_version, bump_cache_version
 
 #todo: too bad keys are duplicated see const sort methods
 QUESTION_ORDER_BY_MAP = {
@@ -41,6 +42,29 @@ QUESTION_ORDER_BY_MAP = {
     'relevance-desc': None#this is a special case for postges only
 }
 
+def get_question_ordering(sort_method):
+    """returns tuple of arguments for the ``order_by()``
+    call that sorts questions by the given sort method
+
+    question id is added as a tie breaker, so that the order
+    is strict, which is necessary for the keyset pagination
+    """
+    order_by = QUESTION_ORDER_BY_MAP[sort_method]
+    if order_by.startswith('-'):
+        return (order_by, '-id')
+    else:
+        return (order_by, 'id')
+
+def get_tag_count_sql(tag_ids):
+    """returns sql of the subquery counting tags of the question
+    that are among the ``tag_ids``, which are passed as parameters
+    """
+    if len(tag_ids) == 0:
+        return '0'
+    return 'SELECT COUNT(1) FROM question_tags ' \
+        + 'WHERE question_tags.question_id = question.id ' \
+        + 'AND question_tags.tag_id IN (%s)' % ','.join(['%s'] * len(tag_ids))
+
 def get_tag_summary_from_questions(questions):
     """returns a humanized string containing up to 
     five most frequently used
@@ -97,6 +121,8 @@ class QuestionQuerySet(models.query.QuerySet):
             added_at = added_at,
             last_activity_at = added_at,
             last_activity_by = author,
+            last_update_at = added_at,
+            last_update_by = author,
             wiki = wiki,
             is_anonymous = is_anonymous,
             tagnames = tagnames,
@@ -129,34 +155,8 @@ class QuestionQuerySet(models.query.QuerySet):
         """returns a query set of questions, 
         matching the full text query
         """
-        if getattr(settings, 'USE_SPHINX_SEARCH', False):
-            matching_questions = Question.sphinx_search.query(search_query)
-            question_ids = [q.id for q in matching_questions] 
-            return Question.objects.filter(deleted = False, id__in = question_ids)
-        if settings.DATABASE_ENGINE == 'mysql' and mysql.supports_full_text_search():
-            return self.filter( 
-                        models.Q(title__search = search_query) \
-                       | models.Q(text__search = search_query) \
-                       | models.Q(tagnames__search = search_query) \
-                       | models.Q(answers__text__search = search_query)
-                    )
-        elif 'postgresql_psycopg2' in askbot.get_database_engine_name():
-            rank_clause = "ts_rank(question.text_search_vector, to_tsquery(%s))";
-            search_query = '&'.join(search_query.split())
-            extra_params = (search_query,)
-            extra_kwargs = {
-                'select': {'relevance': rank_clause},
-                'where': ['text_search_vector @@ to_tsquery(%s)'],
-                'params': extra_params,
-                'select_params': extra_params,
-            }
-            return self.extra(**extra_kwargs)
-        else:
-            #fallback to dumb title match search
-            return self.extra(
-                        where=['title like %s'], 
-                        params=['%' + search_query + '%']
-                    )
+        from askbot.search.backends import get_backend
+        return get_backend().get_questions(self, search_query)
 
     def run_advanced_search(
                         self,
@@ -191,7 +191,7 @@ class QuestionQuerySet(models.query.QuerySet):
         if search_query:
             if search_state.stripped_query:
                 qs = qs.get_by_text_query(search_state.stripped_query)
-                #a patch for postgres search sort method
+                #relevance is annotated by the search backend
                 if askbot.conf.should_show_sort_by_relevance():
                     if sort_method == 'relevance-desc':
                         qs = qs.extra(order_by = ['-relevance',])
@@ -252,88 +252,72 @@ class QuestionQuerySet(models.query.QuerySet):
 
         #get users tag filters
         ignored_tag_names = None
+        filter_interesting_tag_ids = None
+        filter_ignored_tag_ids = None
         if request_user and request_user.is_authenticated():
-            uid_str = str(request_user.id)
-            #mark questions tagged with interesting tags
-            #a kind of fancy annotation, would be nice to avoid it
-            interesting_tags = Tag.objects.filter(
-                                    user_selections__user=request_user,
-                                    user_selections__reason='good'
-                                )
-            ignored_tags = Tag.objects.filter(
-                                    user_selections__user=request_user,
-                                    user_selections__reason='bad'
-                                )
+            #tag selections with the wildcards resolved to tag id's
+            user_tag_filter = tag_filter.get_tag_filter(request_user)
+            interesting = user_tag_filter['good']
+            ignored = user_tag_filter['bad']
 
-            meta_data['interesting_tag_names'] = [tag.name for tag in interesting_tags]
+            meta_data['interesting_tag_names'] = list(interesting['tag_names'])
 
-            ignored_tag_names = [tag.name for tag in ignored_tags]
+            ignored_tag_names = list(ignored['tag_names'])
             meta_data['ignored_tag_names'] = ignored_tag_names
 
-            if interesting_tags or request_user.has_interesting_wildcard_tags():
-                #expensive query
+            has_interesting_wildcards = request_user.has_interesting_wildcard_tags()
+            if interesting['tag_ids'] or has_interesting_wildcards:
+                interesting_tag_ids = tag_filter.get_tag_ids(
+                                                interesting,
+                                                has_interesting_wildcards
+                                            )
                 if request_user.display_tag_filter_strategy == \
                         const.INCLUDE_INTERESTING:
                     #filter by interesting tags only
-                    interesting_tag_filter = models.Q(tags__in = interesting_tags)
-                    if request_user.has_interesting_wildcard_tags():
-                        interesting_wildcards = request_user.interesting_tags.split() 
-                        extra_interesting_tags = Tag.objects.get_by_wildcards(
-                                                            interesting_wildcards
-                                                        )
-                        interesting_tag_filter |= models.Q(tags__in = extra_interesting_tags)
-
-                    qs = qs.filter(interesting_tag_filter)
+                    filter_interesting_tag_ids = interesting_tag_ids
+                    if interesting_tag_ids:
+                        qs = qs.filter(tags__id__in = interesting_tag_ids)
+                    else:
+                        qs = qs.none()
                 else:
                     #simply annotate interesting questions
                     qs = qs.extra(
                         select = SortedDict([
                             (
-                                'interesting_score', 
-                                'SELECT COUNT(1) FROM askbot_markedtag, question_tags '
-                                 + 'WHERE askbot_markedtag.user_id = %s '
-                                 + 'AND askbot_markedtag.tag_id = question_tags.tag_id '
-                                 + 'AND askbot_markedtag.reason = \'good\' '
-                                 + 'AND question_tags.question_id = question.id'
+                                'interesting_score',
+                                get_tag_count_sql(interesting_tag_ids)
                             ),
-                                ]),
-                        select_params = (uid_str,),
-                     )
-            # get the list of interesting and ignored tags (interesting_tag_names, ignored_tag_names) = (None, None)
+                        ]),
+                        select_params = interesting_tag_ids
+                    )
 
-            if ignored_tags or request_user.has_ignored_wildcard_tags():
+            has_ignored_wildcards = request_user.has_ignored_wildcard_tags()
+            if ignored['tag_ids'] or has_ignored_wildcards:
+                ignored_tag_ids = tag_filter.get_tag_ids(
+                                                ignored,
+                                                has_ignored_wildcards
+                                            )
                 if request_user.display_tag_filter_strategy == const.EXCLUDE_IGNORED:
                     #exclude ignored tags if the user wants to
-                    qs = qs.exclude(tags__in=ignored_tags)
-                    if request_user.has_ignored_wildcard_tags():
-                        ignored_wildcards = request_user.ignored_tags.split() 
-                        extra_ignored_tags = Tag.objects.get_by_wildcards(
-                                                            ignored_wildcards
-                                                        )
-                        qs = qs.exclude(tags__in = extra_ignored_tags)
+                    filter_ignored_tag_ids = ignored_tag_ids
+                    if ignored_tag_ids:
+                        qs = qs.exclude(tags__id__in = ignored_tag_ids)
                 else:
                     #annotate questions tagged with ignored tags
-                    #expensive query
                     qs = qs.extra(
                         select = SortedDict([
                             (
-                                'ignored_score', 
-                                'SELECT COUNT(1) '
-                                  + 'FROM askbot_markedtag, question_tags '
-                                  + 'WHERE askbot_markedtag.user_id = %s '
-                                  + 'AND askbot_markedtag.tag_id = question_tags.tag_id '
-                                  + 'AND askbot_markedtag.reason = \'bad\' '
-                                  + 'AND question_tags.question_id = question.id'
-                            )
-                                ]),
-                        select_params = (uid_str, )
-                     )
+                                'ignored_score',
+                                get_tag_count_sql(ignored_tag_ids)
+                            ),
+                        ]),
+                        select_params = ignored_tag_ids
+                    )
 
         if sort_method != 'relevance-desc':
             #relevance sort is set in the extra statement
             #only for postgresql
-            orderby = QUESTION_ORDER_BY_MAP[sort_method]
-            qs = qs.order_by(orderby)
+            qs = qs.order_by(*get_question_ordering(sort_method))
 
         qs = qs.distinct()
         qs = qs.select_related(
@@ -350,7 +334,9 @@ class QuestionQuerySet(models.query.QuerySet):
         related_tags = Tag.objects.get_related_to_search(
                                         questions = qs,
                                         search_state = search_state,
-                                        ignored_tag_names = ignored_tag_names
+                                        ignored_tag_names = ignored_tag_names,
+                                        interesting_tag_ids = filter_interesting_tag_ids,
+                                        ignored_tag_ids = filter_ignored_tag_ids
                                     )
         if askbot_settings.USE_WILDCARD_TAGS == True \
             and request_user.is_authenticated() == True:
@@ -360,6 +346,26 @@ class QuestionQuerySet(models.query.QuerySet):
             meta_data['ignored_tag_names'].extend(tagnames.split())
         return qs, meta_data, related_tags
 
+    def get_after_question(self, sort_method, sort_value, question_id):
+        """returns questions that follow the question with
+        a given value of the sort key and id, when the questions
+        are ordered by the ``sort_method``
+
+        this is the keyset (seek) alternative to slicing with an OFFSET
+        """
+        order_by = QUESTION_ORDER_BY_MAP[sort_method]
+        if order_by.startswith('-'):
+            field = order_by[1:]
+            lookup = 'lt'
+        else:
+            field = order_by
+            lookup = 'gt'
+        after_filter = models.Q(**{field + '__' + lookup: sort_value})
+        after_filter |= models.Q(
+                            **{field: sort_value, 'id__' + lookup: question_id}
+                        )
+        return self.filter(after_filter)
+
     #todo: this function is similar to get_response_receivers
     #profile this function against the other one
     #todo: maybe this must be a query set method, not manager method
@@ -496,6 +502,25 @@ class Question(content.Content, DeletableContent):
         """
         #print datetime.datetime.now()
 
+        def get_data_from_index():
+            similar_ids = tag_index.get_similar_questions(self.id, 10)
+            #index of the process may be stale and list deleted questions
+            questions = self.__class__.objects.filter(
+                                deleted = False
+                            ).in_bulk(
+                                [question_id for question_id, count in similar_ids]
+                            )
+            similar_questions = list()
+            for question_id, shared_tag_count in similar_ids:
+                if question_id in questions:
+                    question = questions[question_id]
+                    question.similarity = shared_tag_count
+                    similar_questions.append(question)
+            return similar_questions
+
+        if tag_index.is_enabled():
+            return LazyList(get_data_from_index)
+
         def get_data():
 
             tags_list = self.tags.all()
@@ -546,7 +571,8 @@ class Question(content.Content, DeletableContent):
 
         When an added tag does not exist - it is created
 
-        Tag use counts are recalculated
+        Tag use counts are changed by one, use counts
+        of the deleted questions are not changed
 
         A signal tags updated is sent
         """
@@ -559,22 +585,45 @@ class Question(content.Content, DeletableContent):
         removed_tagnames = previous_tagnames - updated_tagnames
         added_tagnames = updated_tagnames - previous_tagnames
 
+        #deleted questions are not counted in the tag use counts
+        if self.deleted:
+            count_delta = 0
+        else:
+            count_delta = 1
+
         modified_tags = list()
         #remove tags from the question's tags many2many relation
         if removed_tagnames:
             removed_tags = [tag for tag in previous_tags if tag.name in removed_tagnames]
             self.tags.remove(*removed_tags)
-
-            #if any of the removed tags reached use count == 1 that means they must be deleted
-            for tag in removed_tags:
-                if tag.used_count == 1:
-                    #we won't modify used count b/c it's done below anyway
-                    removed_tags.remove(tag)
+            Tag.objects.change_use_counts(removed_tags, -count_delta)
+
+            #if any of the removed tags reached use count == 0 they must be deleted
+            unused_tag_ids = set()
+            if count_delta:
+                removed_tag_ids = [tag.id for tag in removed_tags]
+                unused_tags = Tag.objects.filter(
+                                    id__in = removed_tag_ids,
+                                    used_count = 0
+                                )
+                #use counts may be out of date, the tags
+                #still linked to some questions are kept
+                linked_tag_ids = set(
+                    self.__class__.tags.through.objects.filter(
+                                            tag__in = removed_tag_ids
+                                        ).values_list('tag', flat = True)
+                )
+                for tag in unused_tags:
+                    if tag.id in linked_tag_ids:
+                        continue
+                    unused_tag_ids.add(tag.id)
                     #todo - do we need to use fields deleted_by and deleted_at?
                     tag.delete()#auto-delete tags whose use count dwindled
 
-            #remember modified tags, we'll need to update use counts on them
-            modified_tags = removed_tags
+            #remember modified tags
+            modified_tags = [
+                tag for tag in removed_tags if tag.id not in unused_tag_ids
+            ]
 
         #add new tags to the relation
         if added_tagnames:
@@ -586,29 +635,28 @@ class Question(content.Content, DeletableContent):
                                     deleted_by = None,
                                     deleted_at = None
                                 )
+            #tags are read before their use counts are changed,
+            #badges expect the counts as they were before the update
+            added_tags = list(reused_tags)
+            Tag.objects.change_use_counts(added_tags, count_delta)
+
             #if there are brand new tags, create them and finalize the added tag list
             if reused_count < len(added_tagnames):
-                added_tags = list(reused_tags)
-
-                reused_tagnames = set([tag.name for tag in reused_tags])
+                reused_tagnames = set([tag.name for tag in added_tags])
                 new_tagnames = added_tagnames - reused_tagnames
                 for name in new_tagnames:
                     new_tag = Tag.objects.create(
                                             name = name,
                                             created_by = user,
-                                            used_count = 1
+                                            used_count = count_delta
                                         )
                     added_tags.append(new_tag)
-            else:
-                added_tags = reused_tags
 
             #finally add tags to the relation and extend the modified list
             self.tags.add(*added_tags)
             modified_tags.extend(added_tags)
 
-        #if there are any modified tags, update their use counts
-        if modified_tags:
-            Tag.objects.update_use_counts(modified_tags)
+        if removed_tagnames or added_tagnames:
             signals.tags_updated.send(None,
                                 question = self,
                                 tags = modified_tags,
@@ -708,6 +756,7 @@ class Question(content.Content, DeletableContent):
             #self.last_activity_at = retagged_at
             self.last_edited_by = retagged_by
             #self.last_activity_by = retagged_by
+            self.set_last_update_info(retagged_at, retagged_by)
         self.save()
 
         # Update the Question's tag associations
@@ -728,6 +777,19 @@ class Question(content.Content, DeletableContent):
     def get_origin_post(self):
         return self
 
+    def get_page_cache_version(self):
+        """returns version of the cached fragments
+        of the question page, see :meth:`invalidate_page_cache`
+        """
+        return get_cache_version('askbot-question-page-%d' % self.id)
+
+    def invalidate_page_cache(self):
+        """makes cached fragments of the question page stale,
+        must be called when anything displayed in the fragments
+        changes - posts, comments, votes, etc.
+        """
+        bump_cache_version('askbot-question-page-%d' % self.id)
+
     def apply_edit(self, edited_at=None, edited_by=None, title=None,\
                     text=None, comment=None, tags=None, wiki=False, \
                     edit_anonymously = False):
@@ -753,6 +815,7 @@ class Question(content.Content, DeletableContent):
         self.last_activity_at = edited_at
         self.last_edited_by = edited_by
         self.last_activity_by = edited_by
+        self.set_last_update_info(edited_at, edited_by)
         self.tagnames = tags
         self.text = text
         self.is_anonymous = edit_anonymously
@@ -858,12 +921,21 @@ class Question(content.Content, DeletableContent):
         return reverse('question_revisions', args=[self.id])
 
     def get_last_update_info(self):
-        when, who = self.post_get_last_update_info()
+        """returns time and author of the latest update
+        in the question thread"""
+        if self.last_update_at is not None:
+            return self.last_update_at, self.last_update_by
+        return self.compute_thread_update_info()
+
+    def compute_thread_update_info(self):
+        """looks up the latest update among the question,
+        its answers and all the comments"""
+        when, who = self.compute_last_update_info()
 
         answers = self.answers.all()
         if len(answers) > 0:
             for a in answers:
-                a_when, a_who = a.post_get_last_update_info()
+                a_when, a_who = a.compute_last_update_info()
                 if a_when > when:
                     when = a_when
                     who = a_who
@@ -871,12 +943,17 @@ class Question(content.Content, DeletableContent):
         return when, who
 
     def get_update_summary(self,last_reported_at=None,recipient_email=''):
+        if self.last_update_at is not None \
+            and last_reported_at is not None \
+            and self.last_update_at <= last_reported_at:
+            #nothing happened in the thread since the last report
+            return None
         edited = False
         if self.last_edited_at and self.last_edited_at > last_reported_at:
             if self.last_edited_by.email != recipient_email:
                 edited = True
         comments = []
-        for comment in self.comments.all():
+        for comment in self.comments.select_related('user'):
             if comment.added_at > last_reported_at and comment.user.email != recipient_email:
                 comments.append(comment)
         new_answers = []
@@ -885,14 +962,20 @@ class Question(content.Content, DeletableContent):
         commented_answers = []
         import sets
         commented_answers = sets.Set([])
-        for answer in self.answers.all():
+        answers = self.answers.select_related('author', 'last_edited_by')
+        if last_reported_at is not None:
+            answers = answers.filter(
+                        models.Q(last_update_at__isnull = True) | \
+                        models.Q(last_update_at__gt = last_reported_at)
+                    )
+        for answer in answers:
             if (answer.added_at > last_reported_at and answer.author.email != recipient_email):
                 new_answers.append(answer)
             if (answer.last_edited_at
                 and answer.last_edited_at > last_reported_at
                 and answer.last_edited_by.email != recipient_email):
                 modified_answers.append(answer)
-            for comment in answer.comments.all():
+            for comment in answer.comments.select_related('user'):
                 if comment.added_at > last_reported_at and comment.user.email != recipient_email:
                     commented_answers.add(answer)
                     answer_comments.append(comment)
@@ -984,20 +1067,30 @@ class QuestionRevision(ContentRevision):
         return reverse('question_revisions', args=[self.question.id])
 
     def as_html(self):
-        markdowner = markup.get_parser()
         return QUESTION_REVISION_TEMPLATE % {
             'title': self.title,
-            'html': sanitize_html(markdowner.convert(self.text)),
+            'html': markup.markdown_to_html(self.text),
             'tags': ' '.join(['<a class="post-tag">%s</a>' % tag
                               for tag in self.tagnames.split(' ')]),
         }
 
+    def get_previous_revision(self):
+        revisions = QuestionRevision.objects.filter(
+                                question = self.question_id,
+                                revision__lt = self.revision
+                            ).order_by('-revision')[:1]
+        if len(revisions) == 0:
+            return None
+        return revisions[0]
+
     def save(self, **kwargs):
         """Looks up the next available revision number."""
         if not self.revision:
             self.revision = QuestionRevision.objects.filter(
                 question=self.question).values_list('revision',
                                                     flat=True)[0] + 1
+        if self.html is None:
+            self.render()
         super(QuestionRevision, self).save(**kwargs)
 
     def __unicode__(self):
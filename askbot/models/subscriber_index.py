@@ -0,0 +1,265 @@
+"""Index of the tag selections of the users subscribed
+to the instant email notifications about the whole forum
+
+For every new post the recipients of the notifications are those
+who follow some of the post tags or do not ignore any of them.
+Instead of querying tag marks and scanning wildcard selections of all
+users on every post, the index keeps in memory of the process:
+
+* tag name -> id's of the users who marked the tag as interesting
+* tag name -> id's of the users who marked the tag as ignored
+* prefix trees of the interesting and of the ignored wildcard tags
+
+so the candidates are found with set lookups.
+
+The index covers only users with an instant ``q_all`` subscription.
+Changes of the tag selections and of the email subscriptions of a user
+are recorded in the shared cache with :func:`update_user`, deletions
+of the tags with :func:`delete_tag`, and every process applies the
+changes recorded since its last look to its copy of the index.
+The index is rebuilt from the database only if the changes
+are not available any more, or after :func:`invalidate`.
+"""
+import threading
+from django.contrib.auth.models import User
+from askbot.models.tag import MarkedTag
+from askbot.utils.cache import get_cache_version, bump_cache_version
+from askbot.utils.cache import record_change, get_changes
+
+VERSION_KEY = 'askbot-subscriber-index-version'
+
+
+class WildcardTrie(object):
+    """prefix tree of wildcard tags, with id's of users
+    who selected the wildcard at the node of its prefix
+    """
+    def __init__(self):
+        self.root = dict()#character -> child node, None -> set of user id's
+
+    def add(self, wildcard, user_id):
+        node = self.root
+        for character in wildcard[:-1]:#drop the asterisk
+            node = node.setdefault(character, dict())
+        node.setdefault(None, set()).add(user_id)
+
+    def remove(self, wildcard, user_id):
+        node = self.root
+        for character in wildcard[:-1]:
+            node = node.get(character, None)
+            if node is None:
+                return
+        node.get(None, set()).discard(user_id)
+
+    def find_users(self, tag_name):
+        """returns id's of users whose wildcards match the tag name"""
+        user_ids = set()
+        node = self.root
+        user_ids.update(node.get(None, ()))
+        for character in tag_name:
+            node = node.get(character, None)
+            if node is None:
+                break
+            user_ids.update(node.get(None, ()))
+        return user_ids
+
+
+class TagSelections(object):
+    """tag selections of one user"""
+    def __init__(self):
+        self.followed_tags = set()
+        self.ignored_tags = set()
+        self.interesting_wildcards = list()
+        self.ignored_wildcards = list()
+
+
+class SubscriberIndex(object):
+    """tag selections of the instant subscribers,
+    see the module docstring
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.clear()
+
+    def clear(self):
+        self.selections = dict()#user id -> TagSelections
+        self.followers = dict()
+        self.ignorers = dict()
+        self.follower_wildcards = WildcardTrie()
+        self.ignorer_wildcards = WildcardTrie()
+
+    def refresh(self):
+        """brings the index up to date"""
+        self.lock.acquire()
+        try:
+            #version is read first, so that changes made
+            #during the update are applied next time
+            version = get_cache_version(VERSION_KEY)
+            if version == self.version:
+                return
+            changes = get_changes(VERSION_KEY, self.version, version)
+            if changes is None:
+                self.build()
+            else:
+                self.apply_changes(changes)
+            self.version = version
+        finally:
+            self.lock.release()
+
+    def build(self):
+        self.clear()
+        for user_id, selections in self.load_selections().items():
+            self.add_user(user_id, selections)
+
+    def apply_changes(self, changes):
+        """applies changes, recorded by :func:`update_user`
+        and :func:`delete_tag`, users are reloaded from the database
+        after the deleted tags are removed
+        """
+        user_ids = set()
+        for change_type, value in changes:
+            if change_type == 'user':
+                user_ids.add(value)
+            elif change_type == 'tag':
+                self.remove_tag(value)
+        if not user_ids:
+            return
+        for user_id in user_ids:
+            self.remove_user(user_id)
+        for user_id, selections in self.load_selections(user_ids).items():
+            self.add_user(user_id, selections)
+
+    def load_selections(self, user_ids = None):
+        """returns dictionary user id -> :class:`TagSelections`
+        of the instant subscribers, of all or of the given users
+        """
+        subscriptions = {
+            'notification_subscriptions__feed_type': 'q_all',
+            'notification_subscriptions__frequency': 'i',
+        }
+        selections = dict()
+        tag_marks = MarkedTag.objects.filter(
+                                    user__notification_subscriptions__feed_type = 'q_all',
+                                    user__notification_subscriptions__frequency = 'i'
+                                )
+        if user_ids is not None:
+            tag_marks = tag_marks.filter(user__in = user_ids)
+        tag_marks = tag_marks.values_list('user', 'reason', 'tag__name')
+        for user_id, reason, tag_name in tag_marks:
+            user_selections = selections.setdefault(user_id, TagSelections())
+            if reason == 'good':
+                user_selections.followed_tags.add(tag_name)
+            elif reason == 'bad':
+                user_selections.ignored_tags.add(tag_name)
+
+        wildcard_selections = User.objects.filter(**subscriptions)
+        if user_ids is not None:
+            wildcard_selections = wildcard_selections.filter(id__in = user_ids)
+        wildcard_selections = wildcard_selections.exclude(
+                                    interesting_tags = '',
+                                    ignored_tags = ''
+                                ).values_list(
+                                    'id', 'interesting_tags', 'ignored_tags'
+                                )
+        for user_id, interesting_tags, ignored_tags in wildcard_selections:
+            user_selections = selections.setdefault(user_id, TagSelections())
+            user_selections.interesting_wildcards = interesting_tags.split()
+            user_selections.ignored_wildcards = ignored_tags.split()
+        return selections
+
+    def add_user(self, user_id, selections):
+        self.selections[user_id] = selections
+        for tag_name in selections.followed_tags:
+            self.followers.setdefault(tag_name, set()).add(user_id)
+        for tag_name in selections.ignored_tags:
+            self.ignorers.setdefault(tag_name, set()).add(user_id)
+        for wildcard in selections.interesting_wildcards:
+            self.follower_wildcards.add(wildcard, user_id)
+        for wildcard in selections.ignored_wildcards:
+            self.ignorer_wildcards.add(wildcard, user_id)
+
+    def remove_user(self, user_id):
+        selections = self.selections.pop(user_id, None)
+        if selections is None:
+            return
+        for tag_name in selections.followed_tags:
+            remove_from_tag_map(self.followers, tag_name, user_id)
+        for tag_name in selections.ignored_tags:
+            remove_from_tag_map(self.ignorers, tag_name, user_id)
+        for wildcard in selections.interesting_wildcards:
+            self.follower_wildcards.remove(wildcard, user_id)
+        for wildcard in selections.ignored_wildcards:
+            self.ignorer_wildcards.remove(wildcard, user_id)
+
+    def remove_tag(self, tag_name):
+        """removes marks of the deleted tag"""
+        for user_id in self.followers.pop(tag_name, ()):
+            self.selections[user_id].followed_tags.discard(tag_name)
+        for user_id in self.ignorers.pop(tag_name, ()):
+            self.selections[user_id].ignored_tags.discard(tag_name)
+
+    def find_users(self, tag_names, tag_map, wildcard_trie, use_wildcards):
+        user_ids = set()
+        for tag_name in tag_names:
+            user_ids.update(tag_map.get(tag_name, ()))
+            if use_wildcards:
+                user_ids.update(wildcard_trie.find_users(tag_name))
+        return user_ids
+
+    def get_tag_followers(self, tag_names, use_wildcards = False):
+        """returns id's of the subscribers who marked
+        any of the tags as interesting"""
+        self.refresh()
+        return self.find_users(
+                        tag_names,
+                        self.followers,
+                        self.follower_wildcards,
+                        use_wildcards
+                    )
+
+    def get_tag_ignorers(self, tag_names, use_wildcards = False):
+        """returns id's of the subscribers who marked
+        any of the tags as ignored"""
+        self.refresh()
+        return self.find_users(
+                        tag_names,
+                        self.ignorers,
+                        self.ignorer_wildcards,
+                        use_wildcards
+                    )
+
+
+SUBSCRIBER_INDEX = SubscriberIndex()
+
+def get_tag_followers(tag_names, use_wildcards = False):
+    return SUBSCRIBER_INDEX.get_tag_followers(tag_names, use_wildcards)
+
+def get_tag_ignorers(tag_names, use_wildcards = False):
+    return SUBSCRIBER_INDEX.get_tag_ignorers(tag_names, use_wildcards)
+
+def remove_from_tag_map(tag_map, tag_name, user_id):
+    user_ids = tag_map.get(tag_name, None)
+    if user_ids is not None:
+        user_ids.discard(user_id)
+        if not user_ids:
+            del tag_map[tag_name]
+
+def update_user(user_id):
+    """records change of the tag selections
+    or of the email subscriptions of the user"""
+    record_change(VERSION_KEY, ('user', user_id))
+
+def update_subscriber(instance, **kwargs):
+    """records change of the subscriptions of the user,
+    ``post_save`` and ``post_delete`` handler of the ``EmailFeedSetting``"""
+    update_user(instance.subscriber_id)
+
+def delete_tag(instance, **kwargs):
+    """records deletion of the tag, ``post_delete`` handler of the ``Tag``,
+    the marks of the tag are deleted together with it"""
+    record_change(VERSION_KEY, ('tag', instance.name))
+
+def invalidate(**kwargs):
+    """makes the index to be rebuilt in all processes,
+    can be used as a signal handler"""
+    bump_cache_version(VERSION_KEY)
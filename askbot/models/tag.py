@@ -1,3 +1,4 @@
+import heapq
 import re
 from django.db import models
 from django.db import connection, transaction
@@ -5,8 +6,15 @@ from django.contrib.auth.models import User
 from django.utils.translation import ugettext as _
 from askbot.models.base import DeletableContent
 from askbot.models.base import BaseQuerySetManager
+from askbot.models import tag_index
 from askbot import const
 
+def is_tag_only_search(search_state):
+    """True if the questions are selected only by the tags"""
+    return not search_state.query \
+        and not search_state.author \
+        and search_state.scope in (None, const.DEFAULT_POST_SCOPE)
+
 def tags_match_some_wildcard(tag_names, wildcard_tags):
     """Same as 
     :meth:`~askbot.models.tag.TagQuerySet.tags_match_some_wildcard`
@@ -39,6 +47,12 @@ class TagQuerySet(models.query.QuerySet):
         ) 
         WHERE id IN (%s);
     """
+    COUNT_USES_QUERY = """
+        SELECT tag_id, COUNT(*) FROM question_tags
+        INNER JOIN question ON question_id=question.id
+        WHERE NOT question.deleted
+        GROUP BY tag_id;
+    """
 
     def get_valid_tags(self, page_size):
         tags = self.all().filter(deleted=False).exclude(used_count=0).order_by("-id")[:page_size]
@@ -54,6 +68,45 @@ class TagQuerySet(models.query.QuerySet):
 
         transaction.commit_unless_managed() 
 
+    def change_use_counts(self, tags, delta):
+        """Adds ``delta`` to the use counts of the given Tags
+        with a single atomic update, without recounting the questions.
+
+        The values in the python objects are not changed.
+        """
+        if not tags or delta == 0:
+            return
+        tags = self.filter(id__in = [tag.id for tag in tags])
+        if delta < 0:
+            #use counts are never negative
+            tags = tags.filter(used_count__gte = -delta)
+        tags.update(used_count = models.F('used_count') + delta)
+
+    def recount_use_counts(self, chunk_size = 500):
+        """Recalculates use counts of all tags with one grouped query
+        and fixes the ones that are wrong.
+
+        Returns number of the fixed tags.
+        """
+        cursor = connection.cursor()
+        cursor.execute(self.COUNT_USES_QUERY)
+        actual_counts = dict(cursor.fetchall())
+
+        #tag id's grouped by the actual use count
+        wrong_counts = dict()
+        for tag_id, used_count in self.values_list('id', 'used_count'):
+            actual_count = actual_counts.get(tag_id, 0)
+            if actual_count != used_count:
+                wrong_counts.setdefault(actual_count, list()).append(tag_id)
+
+        fixed_count = 0
+        for actual_count, tag_ids in wrong_counts.items():
+            for start in range(0, len(tag_ids), chunk_size):
+                chunk = tag_ids[start:start + chunk_size]
+                self.filter(id__in = chunk).update(used_count = actual_count)
+            fixed_count += len(tag_ids)
+        return fixed_count
+
     def tags_match_some_wildcard(self, wildcard_tags = None):
         """True if any one of the tags in the query set
         matches a wildcard
@@ -86,12 +139,28 @@ class TagQuerySet(models.query.QuerySet):
                             self,
                             questions = None,
                             search_state = None,
-                            ignored_tag_names = None
+                            ignored_tag_names = None,
+                            interesting_tag_ids = None,
+                            ignored_tag_ids = None
                         ):
         """must return at least tag names, along with use counts
         handle several cases to optimize the query performance
+
+        ``interesting_tag_ids`` and ``ignored_tag_ids`` are given
+        when the questions are filtered by the tag selections of the user
         """
 
+        if tag_index.is_enabled() and is_tag_only_search(search_state):
+            #questions are selected by tags only, related tags
+            #are counted from the index of the question tags
+            tag_counts = tag_index.get_related_tags(
+                                    search_state.tags or (),
+                                    any_of = interesting_tag_ids,
+                                    none_of = ignored_tag_ids
+                                )
+            if tag_counts is not None:
+                return self.get_by_counts(tag_counts, ignored_tag_names)
+
         if questions.count() > search_state.page_size * 3:
             """if we have too many questions or 
             search query is the most common - just return a list
@@ -124,6 +193,28 @@ class TagQuerySet(models.query.QuerySet):
 
         return tags
 
+    def get_by_counts(self, tag_counts, ignored_tag_names = None, limit = 50):
+        """returns list of up to ``limit`` tags with the largest
+        counts in the dictionary tag id -> count,
+        the count is set as ``local_used_count`` of the tags
+        """
+        ignored_count = len(ignored_tag_names or ())
+        top_counts = heapq.nlargest(
+                            limit + ignored_count,
+                            tag_counts.iteritems(),
+                            key = lambda item: item[1]
+                        )
+        tags = self.filter(
+                    id__in = [tag_id for tag_id, count in top_counts]
+                ).exclude(deleted = True)
+        if ignored_tag_names:
+            tags = tags.exclude(name__in = ignored_tag_names)
+        tags = list(tags)
+        for tag in tags:
+            tag.local_used_count = tag_counts[tag.id]
+        tags.sort(key = lambda tag: (-tag.local_used_count, tag.name))
+        return tags[:limit]
+
 
 class TagManager(BaseQuerySetManager):
     """chainable custom filter query set manager
@@ -0,0 +1,104 @@
+"""Tag selections of the users resolved to the id's of the tags,
+for filtering of the question list
+
+Interesting and ignored tags of the user are stored as
+``MarkedTag`` records and as wildcards in ``User.interesting_tags``
+and ``User.ignored_tags``. Here both are resolved - wildcards
+expanded to the matching tags - into lists of tag id's,
+so that the question list is filtered by a single
+``question_tags.tag_id IN (...)`` condition instead of joins
+with the ``MarkedTag`` table and chains of ``LIKE`` conditions.
+
+The resolved selections are kept in the shared cache under a key
+that includes two version counters:
+
+* version of the user selections, bumped by :func:`invalidate_user`
+  when the user marks or unmarks tags
+* version of the tag set, bumped by :func:`invalidate`
+  when tags are added, renamed or deleted,
+  because wildcards may then match other tags
+"""
+from django.core.cache import cache
+from askbot.models.tag import Tag, MarkedTag
+from askbot.utils.cache import get_cache_version, bump_cache_version
+
+VERSION_KEY = 'askbot-tag-filter-version'
+
+def get_user_version_key(user_id):
+    return 'askbot-tag-filter-version-%d' % user_id
+
+def get_cache_key(user_id):
+    return 'askbot-tag-filter-%d-%d-%d' % (
+                    user_id,
+                    get_cache_version(VERSION_KEY),
+                    get_cache_version(get_user_version_key(user_id))
+                )
+
+def build_tag_filter(user):
+    """reads the tag selections of the user from the database"""
+    tag_filter = dict()
+    wildcards = {
+        'good': user.interesting_tags.split(),
+        'bad': user.ignored_tags.split()
+    }
+    for reason in ('good', 'bad'):
+        wildcard_tag_ids = list()
+        if wildcards[reason]:
+            wildcard_tag_ids = Tag.objects.get_by_wildcards(
+                                    list(wildcards[reason])
+                                ).values_list('id', flat = True)
+        tag_filter[reason] = {
+            'tag_ids': set(),
+            'tag_names': list(),
+            'wildcard_tag_ids': sorted(wildcard_tag_ids)
+        }
+
+    tag_marks = MarkedTag.objects.filter(
+                                user = user
+                            ).values_list('reason', 'tag__id', 'tag__name')
+    for reason, tag_id, tag_name in tag_marks:
+        if reason in tag_filter:
+            tag_filter[reason]['tag_ids'].add(tag_id)
+            tag_filter[reason]['tag_names'].append(tag_name)
+
+    for selection in tag_filter.values():
+        selection['tag_ids'] = sorted(selection['tag_ids'])
+    return tag_filter
+
+def get_tag_filter(user):
+    """returns dictionary with keys 'good' (interesting tags)
+    and 'bad' (ignored tags), the values are dictionaries with keys:
+
+    * 'tag_ids' - sorted list of id's of the selected tags
+    * 'tag_names' - names of the selected tags
+    * 'wildcard_tag_ids' - sorted list of id's of the tags
+      matching the wildcard selections
+    """
+    cache_key = get_cache_key(user.id)
+    tag_filter = cache.get(cache_key)
+    if tag_filter is None:
+        tag_filter = build_tag_filter(user)
+        cache.set(cache_key, tag_filter)
+    return tag_filter
+
+def get_tag_ids(selection, use_wildcards):
+    """returns id's of the tags in the selection
+    returned by the :func:`get_tag_filter`"""
+    if use_wildcards and selection['wildcard_tag_ids']:
+        return sorted(
+            set(selection['tag_ids']).union(selection['wildcard_tag_ids'])
+        )
+    return selection['tag_ids']
+
+def invalidate_user(user):
+    """makes the resolved tag selections of the user stale"""
+    bump_cache_version(get_user_version_key(user.id))
+
+def invalidate_tag_mark(instance, **kwargs):
+    """signal handler for the changes of the ``MarkedTag`` records"""
+    bump_cache_version(get_user_version_key(instance.user_id))
+
+def invalidate(**kwargs):
+    """makes the resolved tag selections of all users stale,
+    can be used as a signal handler"""
+    bump_cache_version(VERSION_KEY)
@@ -0,0 +1,261 @@
+"""In-memory index of the tags of the questions
+for the related tags of the question list and the similar questions
+
+The index keeps in the memory of the process, for the questions
+that are not deleted:
+
+* question id -> set of tag id's
+* tag id -> set of question id's (posting lists)
+* tag id -> tag id -> number of questions with both tags (co-occurrence)
+
+so that tags co-occurring with the selected ones and questions
+sharing most tags with the given one are counted without queries.
+
+Changes of the question tags are recorded in the shared cache
+with :func:`update_question`, and every process reloads tags of the
+questions changed since its last look, see
+:func:`askbot.utils.cache.get_changes`. The whole index is rebuilt
+only if the changes are not available any more, or after
+:func:`invalidate`, but not more often than once in
+``ASKBOT_TAG_INDEX_REBUILD_INTERVAL`` seconds (django setting, 60 by default).
+
+The index is used unless django setting ``ASKBOT_USE_TAG_INDEX``
+is ``False``, then the queries are used as before.
+"""
+import heapq
+import math
+import threading
+import time
+from django.conf import settings as django_settings
+from askbot.utils.cache import get_cache_version, bump_cache_version
+from askbot.utils.cache import record_change, get_changes
+
+VERSION_KEY = 'askbot-tag-index-version'
+
+def is_enabled():
+    return getattr(django_settings, 'ASKBOT_USE_TAG_INDEX', True)
+
+def get_rebuild_interval():
+    return getattr(django_settings, 'ASKBOT_TAG_INDEX_REBUILD_INTERVAL', 60)
+
+
+class TagIndex(object):
+    """tags of the questions, see the module docstring"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.build_time = 0
+        self.question_tags = dict()
+        self.postings = dict()
+        self.cooccurrence = dict()
+        self.tag_names = dict()#tag id -> name
+        self.tag_ids = dict()#tag name -> id
+
+    def refresh(self):
+        """brings the index up to date,
+        must be called with the lock acquired"""
+        version = get_cache_version(VERSION_KEY)
+        if version == self.version:
+            return
+        changes = get_changes(VERSION_KEY, self.version, version)
+        if changes is not None:
+            self.reload_questions(set(changes))
+        else:
+            if self.version is not None:
+                if time.time() - self.build_time < get_rebuild_interval():
+                    return
+            self.build()
+        self.version = version
+
+    def build(self):
+        from askbot.models.question import Question
+        from askbot.models.tag import Tag
+        self.question_tags = dict()
+        self.postings = dict()
+        self.cooccurrence = dict()
+        self.tag_names = dict()
+        self.tag_ids = dict()
+        for tag_id, tag_name in Tag.objects.values_list('id', 'name'):
+            self.add_tag_name(tag_id, tag_name)
+
+        question_tags = dict()
+        rows = Question.tags.through.objects.filter(
+                                        question__deleted = False
+                                    ).values_list('question', 'tag')
+        for question_id, tag_id in rows:
+            question_tags.setdefault(question_id, set()).add(tag_id)
+        for question_id, tag_ids in question_tags.items():
+            self.add_question(question_id, tag_ids)
+        self.build_time = time.time()
+
+    def reload_questions(self, question_ids):
+        """re-reads tags of the questions, the deleted
+        questions are removed from the index"""
+        from askbot.models.question import Question
+        from askbot.models.tag import Tag
+        question_tags = dict()
+        rows = Question.tags.through.objects.filter(
+                                        question__in = question_ids,
+                                        question__deleted = False
+                                    ).values_list('question', 'tag')
+        for question_id, tag_id in rows:
+            question_tags.setdefault(question_id, set()).add(tag_id)
+
+        new_tag_ids = set()
+        for tag_ids in question_tags.values():
+            new_tag_ids.update(tag_ids)
+        new_tag_ids.difference_update(self.tag_names)
+        if new_tag_ids:
+            tags = Tag.objects.filter(id__in = new_tag_ids)
+            for tag_id, tag_name in tags.values_list('id', 'name'):
+                self.add_tag_name(tag_id, tag_name)
+
+        for question_id in question_ids:
+            self.remove_question(question_id)
+        for question_id, tag_ids in question_tags.items():
+            self.add_question(question_id, tag_ids)
+
+    def add_tag_name(self, tag_id, tag_name):
+        self.tag_names[tag_id] = tag_name
+        self.tag_ids[tag_name] = tag_id
+
+    def add_question(self, question_id, tag_ids):
+        self.question_tags[question_id] = frozenset(tag_ids)
+        for tag_id in tag_ids:
+            self.postings.setdefault(tag_id, set()).add(question_id)
+            counts = self.cooccurrence.setdefault(tag_id, dict())
+            for other_tag_id in tag_ids:
+                if other_tag_id != tag_id:
+                    counts[other_tag_id] = counts.get(other_tag_id, 0) + 1
+
+    def remove_question(self, question_id):
+        tag_ids = self.question_tags.pop(question_id, ())
+        for tag_id in tag_ids:
+            self.postings[tag_id].discard(question_id)
+            counts = self.cooccurrence[tag_id]
+            for other_tag_id in tag_ids:
+                if other_tag_id != tag_id:
+                    counts[other_tag_id] -= 1
+                    if counts[other_tag_id] == 0:
+                        del counts[other_tag_id]
+
+    def get_question_ids(self, tag_ids = None, any_of = None, none_of = None):
+        """returns set of id's of the questions tagged with
+        all of the ``tag_ids``, at least one of ``any_of``
+        and none of ``none_of``, ``None`` means no condition
+        must be called with the lock acquired
+        """
+        if tag_ids:
+            postings = [self.postings.get(tag_id, set()) for tag_id in tag_ids]
+            postings.sort(key = len)
+            question_ids = set(postings[0])
+            for posting in postings[1:]:
+                question_ids &= posting
+        else:
+            question_ids = set(self.question_tags)
+        if any_of is not None:
+            selected_ids = set()
+            for tag_id in any_of:
+                selected_ids.update(self.postings.get(tag_id, ()))
+            question_ids &= selected_ids
+        if none_of:
+            for tag_id in none_of:
+                question_ids -= self.postings.get(tag_id, set())
+        return question_ids
+
+    def get_related_tags(self, tag_names, any_of = None, none_of = None):
+        """returns dictionary tag id -> number of questions
+        selected like in :meth:`get_question_ids`, with tags
+        given by names, that are tagged with the tag
+
+        returns ``None`` if some of the tags are not in the index
+        """
+        self.lock.acquire()
+        try:
+            self.refresh()
+            tag_ids = list()
+            for tag_name in tag_names:
+                if tag_name not in self.tag_ids:
+                    return None
+                tag_ids.append(self.tag_ids[tag_name])
+
+            if any_of is None and not none_of:
+                if len(tag_ids) == 0:
+                    #use counts of the tags
+                    return dict(
+                        [(tag_id, len(posting))
+                            for tag_id, posting in self.postings.items()
+                            if len(posting) > 0]
+                    )
+                if len(tag_ids) == 1:
+                    tag_id = tag_ids[0]
+                    counts = dict(self.cooccurrence.get(tag_id, dict()))
+                    counts[tag_id] = len(self.postings.get(tag_id, ()))
+                    return counts
+
+            counts = dict()
+            question_ids = self.get_question_ids(tag_ids, any_of, none_of)
+            for question_id in question_ids:
+                for tag_id in self.question_tags[question_id]:
+                    counts[tag_id] = counts.get(tag_id, 0) + 1
+            return counts
+        finally:
+            self.lock.release()
+
+    def get_similar_questions(self, question_id, limit = 10):
+        """returns list of tuples (question id, number of shared tags)
+        of the questions sharing most tags with the given one,
+        among questions with the same number of shared tags
+        those sharing less common tags and newer ones go first
+        """
+        self.lock.acquire()
+        try:
+            self.refresh()
+            tag_ids = self.question_tags.get(question_id, ())
+            question_count = max(len(self.question_tags), 1)
+            scores = dict()
+            for tag_id in tag_ids:
+                posting = self.postings.get(tag_id, ())
+                #inverse document frequency of the tag
+                weight = math.log(float(question_count + 1) / (len(posting) + 1))
+                for other_id in posting:
+                    shared_count, total_weight = scores.get(other_id, (0, 0))
+                    scores[other_id] = (shared_count + 1, total_weight + weight)
+        finally:
+            self.lock.release()
+
+        scores.pop(question_id, None)
+        ranked = heapq.nlargest(
+                    limit,
+                    scores.iteritems(),
+                    key = lambda item: (item[1][0], item[1][1], item[0])
+                )
+        return [(other_id, score[0]) for other_id, score in ranked]
+
+
+TAG_INDEX = TagIndex()
+
+def get_related_tags(tag_names, any_of = None, none_of = None):
+    return TAG_INDEX.get_related_tags(tag_names, any_of, none_of)
+
+def get_similar_questions(question_id, limit = 10):
+    return TAG_INDEX.get_similar_questions(question_id, limit)
+
+def update_question(question = None, **kwargs):
+    """records change of the question tags, or of the deleted
+    status of the question, the indexes of all processes reload
+    tags of the question on the next read,
+    can be used as a handler of the ``tags_updated`` signal"""
+    record_change(VERSION_KEY, question.id)
+
+def remove_question(instance = None, **kwargs):
+    """handler of the ``delete_question_or_answer`` signal"""
+    if instance.__class__.__name__ == 'Question':
+        update_question(instance)
+
+def invalidate(**kwargs):
+    """makes the index stale in all processes, in this process
+    it is rebuilt on the next read, can be used as a signal handler"""
+    bump_cache_version(VERSION_KEY)
+    TAG_INDEX.build_time = 0
@@ -0,0 +1,148 @@
+"""In-memory index of the tag names for the autocompletion
+of the tags and for the wildcard tag selections
+
+Names of the tags that are not deleted are kept in the memory
+of the process in two sorted arrays - by the name and by the name
+in the lower case, so that the tags starting with a prefix
+are found with a binary search instead of a ``LIKE`` query,
+and the most used of them are selected by the use counts
+stored along with the names.
+
+The full list of the names, which the autocompleter downloads
+when the page is loaded, is also served from here, together
+with the version of the index, which is used as the ETag.
+
+The index is rebuilt when the version counter in the shared cache
+is bumped with :func:`invalidate` - on changes of the tags
+and of the question tags, but not more often than once in
+``ASKBOT_TAG_LOOKUP_REBUILD_INTERVAL`` seconds (django setting,
+60 by default), so the use counts may be slightly out of date.
+"""
+import bisect
+import heapq
+import threading
+import time
+from django.conf import settings as django_settings
+from askbot.utils.cache import get_cache_version, bump_cache_version
+
+VERSION_KEY = 'askbot-tag-lookup-version'
+
+#sorts after any other character in the bmp
+MAX_CHAR = u'\uffff'
+
+def get_rebuild_interval():
+    return getattr(django_settings, 'ASKBOT_TAG_LOOKUP_REBUILD_INTERVAL', 60)
+
+
+class TagLookup(object):
+    """tag names, see the module docstring"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.build_time = 0
+        self.names = list()#sorted tag names
+        self.counts = list()#use counts of the tags in self.names
+        self.folded_names = list()#sorted names in the lower case
+        self.folded_positions = list()#positions of them in self.names
+        self.text = None#names joined with newlines
+
+    def refresh(self):
+        """rebuilds the index if it is out of date,
+        must be called with the lock acquired"""
+        version = get_cache_version(VERSION_KEY)
+        if version == self.version:
+            return
+        if self.version is not None:
+            if time.time() - self.build_time < get_rebuild_interval():
+                return
+        self.build()
+        self.version = version
+
+    def build(self):
+        from askbot.models.tag import Tag
+        tags = list(
+            Tag.objects.filter(deleted = False).values_list('name', 'used_count')
+        )
+        tags.sort()
+        self.names = [name for name, used_count in tags]
+        self.counts = [used_count for name, used_count in tags]
+        folded = [(name.lower(), position)
+                    for position, name in enumerate(self.names)]
+        folded.sort()
+        self.folded_names = [name for name, position in folded]
+        self.folded_positions = [position for name, position in folded]
+        self.text = None
+        self.build_time = time.time()
+
+    def get_positions(self, prefix, case_sensitive):
+        """returns positions in the ``self.names``
+        of the names starting with the prefix,
+        must be called with the lock acquired
+        """
+        if case_sensitive:
+            start = bisect.bisect_left(self.names, prefix)
+            end = bisect.bisect_left(self.names, prefix + MAX_CHAR, start)
+            return xrange(start, end)
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.folded_names, prefix)
+        end = bisect.bisect_left(self.folded_names, prefix + MAX_CHAR, start)
+        return self.folded_positions[start:end]
+
+    def get_tag_names(self, prefix, limit = 10, case_sensitive = False):
+        """returns names of at most ``limit`` most used tags
+        starting with the ``prefix``, the more used tags go first,
+        tags with the same use count are sorted by name
+        """
+        self.lock.acquire()
+        try:
+            self.refresh()
+            positions = self.get_positions(prefix, case_sensitive)
+            counts = self.counts
+            top_positions = heapq.nsmallest(
+                                limit,
+                                positions,
+                                key = lambda position: (-counts[position], position)
+                            )
+            return [self.names[position] for position in top_positions]
+        finally:
+            self.lock.release()
+
+    def count_tags(self, prefix, case_sensitive = False):
+        """returns number of the tags starting with the ``prefix``"""
+        self.lock.acquire()
+        try:
+            self.refresh()
+            return len(self.get_positions(prefix, case_sensitive))
+        finally:
+            self.lock.release()
+
+    def get_tag_list(self):
+        """returns tuple (version, text), where text
+        contains names of all tags, separated with newlines
+        """
+        self.lock.acquire()
+        try:
+            self.refresh()
+            if self.text is None:
+                self.text = u'\n'.join(self.names)
+            return self.version, self.text
+        finally:
+            self.lock.release()
+
+
+TAG_LOOKUP = TagLookup()
+
+def get_tag_names(prefix, limit = 10, case_sensitive = False):
+    return TAG_LOOKUP.get_tag_names(prefix, limit, case_sensitive)
+
+def count_tags(prefix, case_sensitive = False):
+    return TAG_LOOKUP.count_tags(prefix, case_sensitive)
+
+def get_tag_list():
+    return TAG_LOOKUP.get_tag_list()
+
+def invalidate(**kwargs):
+    """makes the index stale in all processes,
+    can be used as a signal handler"""
+    bump_cache_version(VERSION_KEY)
@@ -9,6 +9,7 @@ from django.utils.translation import ugettext as _
 from django.utils.html import strip_tags
 from askbot import const
 from askbot.utils import functions
+from askbot.utils.cache import bump_cache_version
 
 class ResponseAndMentionActivityManager(models.Manager):
     def get_query_set(self):
@@ -150,6 +151,15 @@ class ActivityAuditStatus(models.Model):
     def is_new(self):
         return (self.status == self.STATUS_NEW)
 
+#counts of the flagged posts shown to the moderators are cached,
+#see askbot.api.get_info_on_moderation_items()
+MODERATION_ITEMS_VERSION_KEY = 'askbot-moderation-items-version'
+
+def invalidate_moderation_items(**kwargs):
+    """makes the cached counts of flagged posts stale,
+    to be called when flags or their audit statuses change"""
+    bump_cache_version(MODERATION_ITEMS_VERSION_KEY)
+
 
 class Activity(models.Model):
     """
@@ -0,0 +1,195 @@
+"""Write-behind buffer for the question view counters
+and the :class:`~askbot.models.QuestionView` records
+
+Counting views on the question page immediately means
+an UPDATE of the question row on every hit, and on the popular
+questions such updates wait for each other on the row lock.
+
+Instead, views and visit timestamps are accumulated in the memory
+of the process and saved in bulk - with queries
+``UPDATE question SET view_count = view_count + n`` - at most once
+in ``ASKBOT_VIEW_COUNT_FLUSH_INTERVAL`` seconds (django setting,
+60 by default, 0 saves the views after every request).
+The badges awarded for the question views are considered
+when the counters are saved.
+
+The data are saved in a separate transaction when a request
+is finished, so that the response is not delayed and errors
+do not affect the request. If saving fails, the error is logged
+and the data are kept for the next attempt.
+Visits of the users or of the questions deleted in the meantime
+are dropped.
+
+Up to the flush interval worth of views may be lost,
+if the process is killed.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from django.conf import settings as django_settings
+from django.core.signals import request_finished
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from askbot.models.question import Question, QuestionView
+from askbot.models.badges import award_badges_signal
+
+def get_flush_interval():
+    return getattr(django_settings, 'ASKBOT_VIEW_COUNT_FLUSH_INTERVAL', 60)
+
+
+class ViewCounter(object):
+    """buffer of the question view counts
+    and of the timestamps of question visits by the users
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.view_counts = dict()#question id -> number of new views
+        self.visits = dict()#(user id, question id) -> time of the last visit
+        self.last_flush_time = time.time()
+
+    def record_view(self, question):
+        """adds one view to the question"""
+        self.lock.acquire()
+        try:
+            count = self.view_counts.get(question.id, 0)
+            self.view_counts[question.id] = count + 1
+        finally:
+            self.lock.release()
+
+    def record_visit(self, user, question, timestamp):
+        """remembers time of the user visit to the question"""
+        key = (user.id, question.id)
+        self.lock.acquire()
+        try:
+            self.merge_visit(key, timestamp)
+        finally:
+            self.lock.release()
+
+    def merge_visit(self, key, timestamp):
+        """must be called with the lock acquired"""
+        if timestamp > self.visits.get(key, datetime.datetime.min):
+            self.visits[key] = timestamp
+
+    def maybe_flush(self, **kwargs):
+        """flushes the data if the flush interval has passed,
+        used as ``request_finished`` signal handler"""
+        if time.time() - self.last_flush_time >= get_flush_interval():
+            self.flush()
+
+    def flush(self):
+        """saves accumulated data to the database,
+        on failure the data are put back into the buffer
+        """
+        self.lock.acquire()
+        try:
+            view_counts = self.view_counts
+            visits = self.visits
+            self.view_counts = dict()
+            self.visits = dict()
+            self.last_flush_time = time.time()
+        finally:
+            self.lock.release()
+
+        if not (view_counts or visits):
+            return
+        try:
+            self.save(view_counts, dict(visits))
+        except Exception:
+            logging.exception('could not save question view counts')
+            self.lock.acquire()
+            try:
+                for question_id, count in view_counts.items():
+                    new_count = self.view_counts.get(question_id, 0)
+                    self.view_counts[question_id] = new_count + count
+                for key, timestamp in visits.items():
+                    self.merge_visit(key, timestamp)
+            finally:
+                self.lock.release()
+
+    @transaction.commit_on_success
+    def save(self, view_counts, visits):
+        if view_counts:
+            self.save_view_counts(view_counts)
+        if visits:
+            self.save_visits(visits)
+
+    def save_view_counts(self, view_counts):
+        #questions with equal increments are updated by one query
+        questions_by_increment = dict()
+        for question_id, count in view_counts.items():
+            questions_by_increment.setdefault(count, list()).append(question_id)
+        for count, question_ids in questions_by_increment.items():
+            Question.objects.filter(
+                            id__in = question_ids
+                        ).update(
+                            view_count = F('view_count') + count
+                        )
+
+        timestamp = datetime.datetime.now()
+        questions = Question.objects.filter(
+                                id__in = view_counts.keys()
+                            ).select_related('author')
+        for question in questions:
+            award_badges_signal.send(None,
+                            event = 'view_question',
+                            actor = None,
+                            context_object = question,
+                            timestamp = timestamp
+                        )
+
+    def save_visits(self, visits):
+        user_ids = set([user_id for (user_id, question_id) in visits])
+        question_ids = set([question_id for (user_id, question_id) in visits])
+        #users and questions may have been deleted since the visits
+        user_ids = set(
+            User.objects.filter(id__in = user_ids).values_list('id', flat = True)
+        )
+        question_ids = set(
+            Question.objects.filter(
+                                id__in = question_ids
+                            ).values_list('id', flat = True)
+        )
+        question_views = QuestionView.objects.filter(
+                                            who__id__in = user_ids,
+                                            question__id__in = question_ids
+                                        )
+        for question_view in question_views:
+            key = (question_view.who_id, question_view.question_id)
+            timestamp = visits.pop(key, None)
+            if timestamp is not None and timestamp > question_view.when:
+                QuestionView.objects.filter(
+                                    id = question_view.id
+                                ).update(when = timestamp)
+
+        for (user_id, question_id), timestamp in visits.items():
+            if user_id not in user_ids or question_id not in question_ids:
+                continue
+            QuestionView.objects.create(
+                                who_id = user_id,
+                                question_id = question_id,
+                                when = timestamp
+                            )
+
+
+VIEW_COUNTER = ViewCounter()
+
+def record_view(question):
+    VIEW_COUNTER.record_view(question)
+
+def record_visit(user, question, timestamp):
+    VIEW_COUNTER.record_visit(user, question, timestamp)
+
+def flush():
+    VIEW_COUNTER.flush()
+
+def flush_at_exit():
+    try:
+        flush()
+    except Exception, e:
+        logging.critical('could not save question view counts: %s' % e)
+
+atexit.register(flush_at_exit)
+request_finished.connect(VIEW_COUNTER.maybe_flush)
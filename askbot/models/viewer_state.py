@@ -0,0 +1,147 @@
+"""Data about what the visitor of the question page
+has done with the question, its answers and comments:
+votes, offensive flags, the favorite mark and comment upvotes,
+and the functions available to the visitor for each post.
+
+All of it is loaded at once with a fixed number of queries,
+independently of the number of answers and comments.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from askbot import const
+from askbot.models.meta import Comment, Vote
+from askbot.models.user import Activity
+from askbot.models.question import FavoriteQuestion
+from askbot.models.permission_matrix import PermissionMatrix
+
+
+def get_posts_filter(question = None, answers = None):
+    """returns filter selecting items related to
+    the question and the answers by the generic foreign key
+    """
+    question_type = ContentType.objects.get_for_model(question)
+    posts_filter = models.Q(content_type = question_type, object_id = question.id)
+    if answers:
+        answer_type = ContentType.objects.get_for_model(answers[0])
+        posts_filter |= models.Q(
+                            content_type = answer_type,
+                            object_id__in = [answer.id for answer in answers]
+                        )
+    return posts_filter
+
+
+class ViewerState(object):
+    """state of the question and answers as seen by the ``user``,
+    ``answers`` must be a list of answers to display.
+
+    Comments loaded here are annotated with ``upvoted_by_user``
+    like those returned by :meth:`~askbot.models.content.Content.get_comments`
+    """
+    def __init__(self, user = None, question = None, answers = None):
+        self.user = user
+        self.question = question
+        self.answers = answers or list()
+        self.votes = dict()
+        self.flagged_posts = set()
+        self.is_favorite = False
+        self.comments = dict()
+
+        posts = [question] + list(self.answers)
+        self.post_map = dict(
+            [(self.get_post_key(post), post) for post in posts]
+        )
+        posts_filter = get_posts_filter(question, self.answers)
+
+        self.load_comments(posts_filter)
+        if user.is_authenticated():
+            self.load_votes(posts_filter)
+            self.load_flags(posts_filter)
+            self.load_comment_votes()
+            self.is_favorite = FavoriteQuestion.objects.filter(
+                                                question = question,
+                                                user = user
+                                            ).count() > 0
+            for post in posts:
+                post.set_flagged_by(user, self.has_flagged(post))
+
+        all_posts = list(posts)
+        for comments in self.comments.values():
+            all_posts.extend(comments)
+        self.permissions = PermissionMatrix(user, all_posts)
+
+    def get_post_key(self, post):
+        content_type = ContentType.objects.get_for_model(post)
+        return (content_type.id, post.id)
+
+    def load_comments(self, posts_filter):
+        comments = Comment.objects.filter(
+                                posts_filter
+                            ).select_related(
+                                'user'
+                            ).order_by('id')
+        for post_key in self.post_map:
+            self.comments[post_key] = list()
+        for comment in comments:
+            post_key = (comment.content_type_id, comment.object_id)
+            #set cached parent post to avoid queries in permission checks
+            comment.content_object = self.post_map[post_key]
+            comment.upvoted_by_user = 0
+            self.comments[post_key].append(comment)
+
+    def load_votes(self, posts_filter):
+        votes = Vote.objects.filter(posts_filter).filter(user = self.user)
+        for vote in votes:
+            self.votes[(vote.content_type_id, vote.object_id)] = vote
+
+    def load_flags(self, posts_filter):
+        flags = Activity.objects.filter(
+                            posts_filter
+                        ).filter(
+                            user = self.user,
+                            activity_type = const.TYPE_ACTIVITY_MARK_OFFENSIVE
+                        ).values_list('content_type', 'object_id')
+        self.flagged_posts = set(flags)
+
+    def load_comment_votes(self):
+        comment_map = dict()
+        for comments in self.comments.values():
+            for comment in comments:
+                comment_map[comment.id] = comment
+        if len(comment_map) == 0:
+            return
+        comment_type = ContentType.objects.get_for_model(Comment)
+        upvoted_ids = Vote.objects.filter(
+                                user = self.user,
+                                content_type = comment_type,
+                                object_id__in = comment_map.keys()
+                            ).values_list('object_id', flat = True)
+        for comment_id in upvoted_ids:
+            comment_map[comment_id].upvoted_by_user = 1
+
+    def get_vote(self, post):
+        """returns :class:`~askbot.models.Vote` of the user
+        on the post or ``None``"""
+        return self.votes.get(self.get_post_key(post), None)
+
+    def get_answer_votes(self):
+        """returns dictionary with answer id's as keys
+        and values 1 for upvotes and -1 for downvotes"""
+        answer_votes = dict()
+        for answer in self.answers:
+            vote = self.get_vote(answer)
+            if vote is not None:
+                answer_votes[answer.id] = vote.vote
+        return answer_votes
+
+    def has_flagged(self, post):
+        return self.get_post_key(post) in self.flagged_posts
+
+    def can(self, capability, post):
+        """True if the function, e.g. ``'edit_post'``,
+        is available to the user for the post,
+        see :mod:`~askbot.models.permission_matrix`"""
+        return self.permissions.can(capability, post)
+
+    def get_comments(self, post):
+        """returns list of comments to the post, ordered by id"""
+        return self.comments.get(self.get_post_key(post), list())
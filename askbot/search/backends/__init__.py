@@ -0,0 +1,76 @@
+"""Pluggable full text search backends
+
+The backend is selected by the django setting ``ASKBOT_SEARCH_BACKEND``,
+which is either one of the names of the built-in backends:
+
+* ``'sphinx'`` - the django-sphinx app
+* ``'mysql'`` - full text index of the MyISAM tables
+* ``'postgresql'`` - text search vector of the PostgreSQL
+* ``'local'`` - inverted index stored in the files on the server,
+  works with any database, see :mod:`askbot.search.backends.local`
+* ``'title'`` - matching of the question titles with ``LIKE``
+
+or a python path to a subclass of
+:class:`~askbot.search.backends.base.BaseSearchBackend`.
+
+When the setting is not given, the backend is chosen automatically
+by the ``USE_SPHINX_SEARCH`` setting and the database engine.
+"""
+import askbot
+from django.conf import settings as django_settings
+from django.core.exceptions import ImproperlyConfigured
+from askbot.utils import mysql
+from askbot.utils.loading import load_module
+
+BUILTIN_BACKENDS = {
+    'sphinx': 'askbot.search.backends.database.SphinxSearchBackend',
+    'mysql': 'askbot.search.backends.database.MysqlSearchBackend',
+    'postgresql': 'askbot.search.backends.database.PostgresqlSearchBackend',
+    'local': 'askbot.search.backends.local.LocalIndexSearchBackend',
+    'title': 'askbot.search.backends.database.TitleMatchSearchBackend',
+}
+
+#in-memory cached backend instance
+BACKEND = None
+
+def get_backend_name():
+    """returns name or python path of the search backend"""
+    backend_name = getattr(django_settings, 'ASKBOT_SEARCH_BACKEND', None)
+    if backend_name:
+        return backend_name
+    if getattr(django_settings, 'USE_SPHINX_SEARCH', False):
+        return 'sphinx'
+    database_engine = askbot.get_database_engine_name()
+    if 'mysql' in database_engine and mysql.supports_full_text_search():
+        return 'mysql'
+    elif 'postgresql_psycopg2' in database_engine:
+        return 'postgresql'
+    else:
+        return 'title'
+
+def load_backend(backend_name):
+    """returns new instance of the search backend"""
+    backend_path = BUILTIN_BACKENDS.get(backend_name, backend_name)
+    try:
+        backend_class = load_module(backend_path)
+    except (ImportError, AttributeError), e:
+        raise ImproperlyConfigured(
+            'could not load search backend %s: %s' % (backend_name, e)
+        )
+    return backend_class()
+
+def get_backend():
+    """returns the search backend instance,
+    which is shared within the process"""
+    global BACKEND
+    if BACKEND is None:
+        BACKEND = load_backend(get_backend_name())
+    return BACKEND
+
+def update_index(question = None, post = None, instance = None, **kwargs):
+    """signal handler that passes the updated question
+    to the search backend, works with the ``post_updated``,
+    ``tags_updated`` and ``delete_question_or_answer`` signals
+    """
+    post = question or post or instance
+    get_backend().update_question(post.get_origin_post())
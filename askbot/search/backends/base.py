@@ -0,0 +1,33 @@
+"""Base class for the full text search backends"""
+
+class BaseSearchBackend(object):
+    """interface of the full text search backend
+
+    backends that support ranking of the results must
+    annotate the returned questions with the ``relevance``
+    value, so that questions can be sorted by
+    ``questions.extra(order_by = ['-relevance'])``
+    """
+    #True if the backend annotates questions with relevance
+    supports_relevance = False
+
+    def get_questions(self, questions, search_query):
+        """returns query set of questions filtered
+        from ``questions`` by the full text ``search_query``
+        """
+        raise NotImplementedError()
+
+    def update_question(self, question):
+        """called when question, its answers or tags
+        are changed, backends that maintain their own
+        index must bring it up to date here
+        """
+        pass
+
+    def rebuild(self, questions):
+        """re-creates the search index from scratch
+        using the ``questions`` query set
+        """
+        raise NotImplementedError(
+            '%s does not maintain a search index' % self.__class__.__name__
+        )
@@ -0,0 +1,57 @@
+"""Search backends that use the search engine of the database
+or an external search server (Sphinx)
+"""
+from django.db import models
+from askbot.search.backends.base import BaseSearchBackend
+
+
+class SphinxSearchBackend(BaseSearchBackend):
+    """search via the django-sphinx app, requires setting
+    ``USE_SPHINX_SEARCH = True`` and the ``ASKBOT_SPHINX_SEARCH_INDEX``
+    """
+    def get_questions(self, questions, search_query):
+        #import here to avoid circular import
+        from askbot.models import Question
+        matching_questions = Question.sphinx_search.query(search_query)
+        question_ids = [q.id for q in matching_questions]
+        return questions.filter(deleted = False, id__in = question_ids)
+
+
+class MysqlSearchBackend(BaseSearchBackend):
+    """search with the MySQL full text index,
+    available for the MyISAM tables only"""
+    def get_questions(self, questions, search_query):
+        return questions.filter(
+                    models.Q(title__search = search_query) \
+                   | models.Q(text__search = search_query) \
+                   | models.Q(tagnames__search = search_query) \
+                   | models.Q(answers__text__search = search_query)
+                )
+
+
+class PostgresqlSearchBackend(BaseSearchBackend):
+    """search with the PostgreSQL text search vector,
+    which is set up by the ``init_postgresql_full_text_search``
+    management command"""
+    supports_relevance = True
+
+    def get_questions(self, questions, search_query):
+        rank_clause = "ts_rank(question.text_search_vector, to_tsquery(%s))";
+        search_query = '&'.join(search_query.split())
+        extra_params = (search_query,)
+        extra_kwargs = {
+            'select': {'relevance': rank_clause},
+            'where': ['text_search_vector @@ to_tsquery(%s)'],
+            'params': extra_params,
+            'select_params': extra_params,
+        }
+        return questions.extra(**extra_kwargs)
+
+
+class TitleMatchSearchBackend(BaseSearchBackend):
+    """fallback to dumb title match search"""
+    def get_questions(self, questions, search_query):
+        return questions.extra(
+                    where=['title like %s'], 
+                    params=['%' + search_query + '%']
+                )
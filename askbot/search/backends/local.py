@@ -0,0 +1,347 @@
+"""Full text search with an inverted index stored on the local disk
+
+The index covers titles, tags and texts of the questions and texts
+of their answers, the results are ranked with the Okapi BM25 formula.
+This is a pure python implementation, it works with any database
+engine and does not need a separate search server.
+
+The index is kept in the directory given by the django setting
+``ASKBOT_SEARCH_INDEX_DIR`` (by default - directory ``search_index``
+next to the ``ASKBOT_FILE_UPLOAD_DIR``) in two files: the snapshot
+of the whole index and an append-only journal of the updated questions.
+
+Updates of the questions, answers and tags are written to the journal,
+and every process reads the new journal records before searching,
+so the index stays up to date in the multiprocess deployments.
+
+The snapshot is created and the journal is compacted with the management
+command ``rebuild_search_index``. If there is no snapshot,
+the index is built at the first search.
+"""
+import cPickle as pickle
+import heapq
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+from django.conf import settings as django_settings
+from django.utils.html import strip_tags
+from askbot.search.backends.base import BaseSearchBackend
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None#no file locking on windows
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+#tokens are counted this many times depending on the field
+TITLE_WEIGHT = 3
+TAG_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+#parameters of the BM25 formula
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def get_index_dir():
+    default_dir = os.path.join(
+                        os.path.dirname(django_settings.ASKBOT_FILE_UPLOAD_DIR),
+                        'search_index'
+                    )
+    return getattr(django_settings, 'ASKBOT_SEARCH_INDEX_DIR', default_dir)
+
+def get_max_results():
+    """maximum number of questions returned by one search"""
+    return getattr(django_settings, 'ASKBOT_SEARCH_MAX_RESULTS', 1000)
+
+def tokenize(text):
+    """returns list of lowercased words of the text"""
+    return [token.lower() for token in TOKEN_RE.findall(text)]
+
+def get_post_text(post):
+    if post.html:
+        return strip_tags(post.html)
+    return post.text
+
+def get_question_terms(question):
+    """returns dictionary of weighted term frequencies
+    for the question, its tags and not deleted answers
+    """
+    term_counts = dict()
+
+    def add_terms(text, weight):
+        for term in tokenize(text):
+            term_counts[term] = term_counts.get(term, 0) + weight
+
+    add_terms(question.title, TITLE_WEIGHT)
+    add_terms(question.tagnames, TAG_WEIGHT)
+    add_terms(get_post_text(question), TEXT_WEIGHT)
+    for answer in question.answers.filter(deleted = False):
+        add_terms(get_post_text(answer), TEXT_WEIGHT)
+    return term_counts
+
+
+class InvertedIndex(object):
+    """in-memory inverted index of documents,
+    where each document is a dictionary of term frequencies
+    """
+    def __init__(self):
+        self.postings = dict()#term -> {document id: term frequency}
+        self.document_terms = dict()#document id -> tuple of terms
+        self.document_lengths = dict()
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.document_lengths)
+
+    def set_document(self, document_id, term_counts):
+        """adds document to the index or replaces
+        the previously indexed version"""
+        self.remove_document(document_id)
+        if not term_counts:
+            return
+        for term, count in term_counts.iteritems():
+            self.postings.setdefault(term, dict())[document_id] = count
+        length = sum(term_counts.itervalues())
+        self.document_terms[document_id] = tuple(term_counts)
+        self.document_lengths[document_id] = length
+        self.total_length += length
+
+    def remove_document(self, document_id):
+        terms = self.document_terms.pop(document_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings[term]
+            del posting[document_id]
+            if not posting:
+                del self.postings[term]
+        self.total_length -= self.document_lengths.pop(document_id)
+
+    def search(self, terms, limit = None):
+        """returns list of tuples (document id, score)
+        for documents that contain all the terms,
+        the best matches first"""
+        terms = set(terms)
+        if not terms:
+            return []
+        postings = list()
+        for term in terms:
+            posting = self.postings.get(term, None)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        #intersect starting from the rarest term
+        postings.sort(key = len)
+        matches = set(postings[0])
+        for posting in postings[1:]:
+            matches.intersection_update(posting)
+            if not matches:
+                return []
+
+        document_count = len(self.document_lengths)
+        average_length = float(self.total_length) / document_count
+        scores = dict.fromkeys(matches, 0.0)
+        for posting in postings:
+            frequency = len(posting)
+            idf = math.log(
+                    1 + (document_count - frequency + 0.5) / (frequency + 0.5)
+                )
+            for document_id in matches:
+                count = posting[document_id]
+                length_ratio = self.document_lengths[document_id] / average_length
+                scores[document_id] += idf * count * (BM25_K1 + 1) / \
+                    (count + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+        ranking_key = lambda item: (item[1], item[0])
+        if limit is None:
+            return sorted(scores.iteritems(), key = ranking_key, reverse = True)
+        return heapq.nlargest(limit, scores.iteritems(), key = ranking_key)
+
+
+class LocalIndexSearchBackend(BaseSearchBackend):
+    """search backend using the :class:`InvertedIndex`
+    saved in the files, see the module docstring
+    """
+    supports_relevance = True
+
+    def __init__(self, index_dir = None):
+        self.index_dir = index_dir or get_index_dir()
+        self.snapshot_path = os.path.join(self.index_dir, 'index.pickle')
+        self.journal_path = os.path.join(self.index_dir, 'journal.pickle')
+        self.lock_path = os.path.join(self.index_dir, 'index.lock')
+        self.index = None
+        self.snapshot_stamp = None
+        self.journal_offset = 0
+        #index is shared by the threads of the process
+        self.thread_lock = threading.Lock()
+
+    def ensure_index_dir(self):
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir)
+
+    def lock(self, shared = False):
+        """returns open lock file, when the platform supports it,
+        the file is locked for exclusive or shared access"""
+        self.ensure_index_dir()
+        lock_file = open(self.lock_path, 'a')
+        if fcntl is not None:
+            if shared:
+                fcntl.flock(lock_file, fcntl.LOCK_SH)
+            else:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def unlock(self, lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    def get_snapshot_stamp(self):
+        """returns value that changes every time the snapshot
+        is replaced or ``None`` if there is no snapshot"""
+        try:
+            stat = os.stat(self.snapshot_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+    def get_journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except OSError:
+            return 0
+
+    def read_journal(self, offset):
+        """returns list of journal records following the offset
+        and the offset of the end of the last record"""
+        records = list()
+        try:
+            journal = open(self.journal_path, 'rb')
+        except IOError:
+            return records, offset
+        try:
+            journal.seek(offset)
+            while True:
+                try:
+                    records.append(pickle.load(journal))
+                except EOFError:
+                    break
+                offset = journal.tell()
+        finally:
+            journal.close()
+        return records, offset
+
+    def apply_records(self, index, records):
+        for question_id, term_counts in records:
+            index.set_document(question_id, term_counts)
+
+    def append_record(self, question_id, term_counts):
+        lock_file = self.lock()
+        try:
+            journal = open(self.journal_path, 'ab')
+            try:
+                pickle.dump(
+                    (question_id, term_counts),
+                    journal,
+                    pickle.HIGHEST_PROTOCOL
+                )
+            finally:
+                journal.close()
+        finally:
+            self.unlock(lock_file)
+
+    def refresh(self):
+        """loads changes made to the index by this and other processes"""
+        if self.get_snapshot_stamp() is None:
+            logging.info('building the search index in %s' % self.index_dir)
+            self.rebuild()
+
+        lock_file = self.lock(shared = True)
+        try:
+            stamp = self.get_snapshot_stamp()
+            if stamp != self.snapshot_stamp \
+                or self.get_journal_size() < self.journal_offset:
+                snapshot = open(self.snapshot_path, 'rb')
+                try:
+                    self.index = pickle.load(snapshot)
+                finally:
+                    snapshot.close()
+                self.snapshot_stamp = stamp
+                self.journal_offset = 0
+            records, self.journal_offset = self.read_journal(self.journal_offset)
+            self.apply_records(self.index, records)
+        finally:
+            self.unlock(lock_file)
+
+    def rebuild(self, questions = None):
+        """reads all questions into the new index,
+        saves the snapshot and truncates the journal
+
+        updates journaled while the index is being built
+        are added to the new snapshot
+        """
+        if questions is None:
+            #import here to avoid circular import
+            from askbot.models import Question
+            questions = Question.objects.all()
+
+        self.ensure_index_dir()
+        journal_offset = self.get_journal_size()
+        index = InvertedIndex()
+        for question in questions.iterator():
+            index.set_document(question.id, get_question_terms(question))
+
+        lock_file = self.lock()
+        try:
+            records = self.read_journal(journal_offset)[0]
+            self.apply_records(index, records)
+
+            snapshot_fd, temp_path = tempfile.mkstemp(dir = self.index_dir)
+            snapshot = os.fdopen(snapshot_fd, 'wb')
+            try:
+                pickle.dump(index, snapshot, pickle.HIGHEST_PROTOCOL)
+            finally:
+                snapshot.close()
+            if os.name == 'nt' and os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)#rename does not overwrite
+            os.rename(temp_path, self.snapshot_path)
+            open(self.journal_path, 'wb').close()
+        finally:
+            self.unlock(lock_file)
+        return len(index)
+
+    def search(self, search_query):
+        """returns list of tuples (question id, score)"""
+        self.thread_lock.acquire()
+        try:
+            self.refresh()
+            return self.index.search(
+                                tokenize(search_query),
+                                limit = get_max_results()
+                            )
+        finally:
+            self.thread_lock.release()
+
+    def get_questions(self, questions, search_query):
+        hits = self.search(search_query)
+        if not hits:
+            #relevance is selected, because the results may be ordered by it
+            return questions.extra(select = {'relevance': '0'}, where = ['1=0'])
+        #values are numbers, so they are safe to put into the sql
+        relevance_cases = ' '.join(
+                            ['WHEN %d THEN %f' % hit for hit in hits]
+                        )
+        relevance_clause = 'CASE question.id %s ELSE 0 END' % relevance_cases
+        id_list = ','.join(['%d' % hit[0] for hit in hits])
+        return questions.extra(
+                    select = {'relevance': relevance_clause},
+                    where = ['question.id IN (%s)' % id_list]
+                )
+
+    def update_question(self, question):
+        self.append_record(question.id, get_question_terms(question))
@@ -0,0 +1,162 @@
+"""Pagination of the question list
+
+Paging by page number makes the database scan and skip all
+questions preceding the page (OFFSET) and count all questions
+matching the search (COUNT DISTINCT over the joins) on every request.
+
+Here the question list also supports the keyset (seek) pagination:
+the next page is selected by the value of the sort key and the id
+of the last question on the previous page, which are passed around
+as the ``cursor``. Relevance sort does not have a cursor and is
+always paginated by the page number.
+
+The total number of questions is only counted when the page is full,
+and the count is kept in the cache for
+``ASKBOT_QUESTION_COUNT_CACHE_TIMEOUT`` seconds (django setting,
+300 by default), so the counter may be slightly behind for
+logged in users with personal tag filters.
+"""
+import datetime
+import hashlib
+from django.conf import settings as django_settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page, EmptyPage
+from askbot.models.question import QUESTION_ORDER_BY_MAP
+from askbot.search import result_cache
+from askbot.utils.cache import get_cache_version
+
+CURSOR_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+
+class PrecountedPaginator(Paginator):
+    """paginator that is given the total number of objects,
+    so that it does not have to count them again
+    """
+    def __init__(self, object_list, per_page, count):
+        super(PrecountedPaginator, self).__init__(object_list, per_page)
+        self._count = count
+
+
+class OnePagePaginator(PrecountedPaginator):
+    """paginator whose ``object_list`` contains objects
+    of just one page, as selected by the cursor or read from cache
+    """
+    def page(self, number):
+        number = self.validate_number(number)
+        return Page(self.object_list, number, self)
+
+
+def supports_cursor(sort_method):
+    """True if questions sorted by the ``sort_method``
+    can be paginated with a cursor"""
+    return QUESTION_ORDER_BY_MAP.get(sort_method, None) is not None
+
+def get_sort_field(sort_method):
+    return QUESTION_ORDER_BY_MAP[sort_method].lstrip('-')
+
+def encode_cursor(question, sort_method):
+    """returns url-safe cursor pointing to the position
+    right after the ``question`` in the question list
+    """
+    value = getattr(question, get_sort_field(sort_method))
+    if isinstance(value, datetime.datetime):
+        value = value.strftime(CURSOR_TIMESTAMP_FORMAT)
+    return '%s_%d' % (value, question.id)
+
+def decode_cursor(cursor, sort_method):
+    """returns tuple (sort key value, question id)
+    raises ValueError if cursor is malformed
+    """
+    value, question_id = cursor.rsplit('_', 1)
+    question_id = int(question_id)
+    field = get_sort_field(sort_method)
+    if field in ('added_at', 'last_activity_at'):
+        value = datetime.datetime.strptime(value, CURSOR_TIMESTAMP_FORMAT)
+    else:
+        value = int(value)
+    return value, question_id
+
+def get_next_cursor(page, sort_method):
+    """returns cursor to the page following the given
+    paginator page or ``None`` if there is no such page"""
+    if page.has_next() and supports_cursor(sort_method):
+        question_list = list(page.object_list)
+        if question_list:
+            return encode_cursor(question_list[-1], sort_method)
+    return None
+
+def get_count_timeout():
+    return getattr(django_settings, 'ASKBOT_QUESTION_COUNT_CACHE_TIMEOUT', 300)
+
+def get_question_count(questions, search_state = None, user = None):
+    """returns number of questions in the query set,
+    the value is cached for all requests with the same
+    search filters, irrespective of sort order and page
+    """
+    timeout = get_count_timeout()
+    if timeout <= 0:
+        return questions.count()
+
+    tags = sorted(search_state.tags or [])
+    if user is not None and user.is_authenticated():
+        user_id = user.id#tag filters may be personal
+    else:
+        user_id = None
+    filter_bits = (
+        search_state.scope,
+        tags,
+        search_state.query,
+        search_state.author,
+        user_id
+    )
+    digest = hashlib.md5(repr(filter_bits)).hexdigest()
+    version = get_cache_version(result_cache.VERSION_KEY)
+    cache_key = 'askbot-question-count-%d-%s' % (version, digest)
+
+    count = cache.get(cache_key)
+    if count is None:
+        count = questions.count()
+        cache.set(cache_key, count, timeout)
+    return count
+
+def get_page(questions, search_state = None, user = None):
+    """returns paginator page of the questions for the search state
+
+    if the search state has a valid cursor, the page is selected
+    by the cursor, otherwise by the page number.
+    raises ``EmptyPage`` when there are no questions on the page
+    """
+    page_size = search_state.page_size
+    page_number = search_state.page
+    offset = (page_number - 1) * page_size
+
+    question_list = None
+    cursor = getattr(search_state, 'cursor', None)
+    if cursor and supports_cursor(search_state.sort):
+        try:
+            sort_value, question_id = decode_cursor(cursor, search_state.sort)
+        except ValueError:
+            pass#malformed cursor - use page number
+        else:
+            page_questions = questions.get_after_question(
+                                                search_state.sort,
+                                                sort_value,
+                                                question_id
+                                            )
+            question_list = list(page_questions[:page_size])
+
+    if question_list is None:
+        question_list = list(questions[offset:offset + page_size])
+
+    if len(question_list) == 0 and page_number > 1:
+        raise EmptyPage('no questions on page %d' % page_number)
+
+    if len(question_list) < page_size:
+        #the last page - count is known without asking the database
+        count = offset + len(question_list)
+    else:
+        count = get_question_count(questions, search_state, user)
+        #cached count may be behind
+        count = max(count, offset + len(question_list))
+
+    paginator = OnePagePaginator(question_list, page_size, count)
+    return paginator.page(page_number)
@@ -0,0 +1,106 @@
+"""Cache of the question list pages shown to the anonymous visitors
+
+Almost all anonymous traffic lands on a handful of combinations
+of scope, sort method, tags and page number, so the expensive part
+of the ``questions`` view - the search query, the question count,
+related tags and the contributors - is stored in the cache,
+keyed by the normalized search state.
+
+Only the id's of questions and contributors are cached, the objects
+themselves are re-read by the primary key, so that the displayed
+counters (votes, views, etc.) stay fresh.
+
+All keys include a version number, which is bumped every time
+questions, answers or tags are updated, so that stale entries
+are never read again. Entries also expire after
+``ASKBOT_QUESTION_LIST_CACHE_TIMEOUT`` seconds (django setting,
+600 by default, set to 0 to disable the cache).
+"""
+import hashlib
+from django.conf import settings as django_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from askbot.utils.cache import get_cache_version, bump_cache_version
+
+VERSION_KEY = 'askbot-question-list-version'
+
+def get_timeout():
+    return getattr(django_settings, 'ASKBOT_QUESTION_LIST_CACHE_TIMEOUT', 600)
+
+def is_enabled():
+    return get_timeout() > 0
+
+def get_cache_key(search_state):
+    """returns cache key for the question list page
+    corresponding to the search state
+
+    the key must be calculated before the search is run
+    and then used to both read and store the data,
+    otherwise results of a search that raced with an update
+    could be stored under the new version
+    """
+    tags = sorted(search_state.tags or [])
+    state_bits = (
+        search_state.scope,
+        search_state.sort,
+        tags,
+        search_state.query,
+        search_state.author,
+        search_state.page,
+        search_state.page_size,
+        getattr(search_state, 'cursor', None),
+    )
+    digest = hashlib.md5(repr(state_bits)).hexdigest()
+    version = get_cache_version(VERSION_KEY)
+    return 'askbot-question-list-%d-%s' % (version, digest)
+
+def load(cache_key):
+    """returns cached data for the question list page or ``None``
+    the data is a dictionary with keys:
+
+    * ``question_ids`` - id's of questions on the page, in order
+    * ``question_count`` - total number of questions found
+    * ``related_tags`` - list of :class:`~askbot.models.Tag` objects
+    * ``contributor_ids`` - id's of users to show as contributors
+    * ``meta_data`` - meta data returned by the search
+    """
+    return cache.get(cache_key)
+
+def save(cache_key, page = None, related_tags = None,
+        contributors = None, meta_data = None):
+    """stores data for one page of the question list"""
+    data = {
+        'question_ids': [question.id for question in page.object_list],
+        'question_count': page.paginator.count,
+        'related_tags': list(related_tags),
+        'contributor_ids': [user.id for user in contributors],
+        'meta_data': meta_data,
+    }
+    cache.set(cache_key, data, get_timeout())
+
+def get_questions(data):
+    """returns list of questions of the page
+    restored from the cached data"""
+    #import here to avoid circular import
+    from askbot.models import Question
+    question_ids = data['question_ids']
+    questions = Question.objects.filter(
+                            id__in = question_ids
+                        ).select_related('last_activity_by')
+    question_map = dict([(question.id, question) for question in questions])
+    return [
+        question_map[question_id] for question_id in question_ids \
+        if question_id in question_map
+    ]
+
+def get_contributors(data):
+    """returns list of contributors restored from the cached data"""
+    contributors = User.objects.filter(
+                            id__in = data['contributor_ids']
+                        ).order_by('?')
+    return list(contributors)
+
+def invalidate(**kwargs):
+    """signal handler that makes all cached
+    question list pages stale"""
+    bump_cache_version(VERSION_KEY)
@@ -14,7 +14,7 @@ ACTIVE_COMMANDS = (
     'sort', 'search', 'query',
     'reset_query', 'reset_author', 'reset_tags', 'remove_tag',
     'tags', 'scope', 'page_size', 'start_over',
-    'page'
+    'page', 'cursor'
 )
 
 def some_in(what, where):
@@ -92,6 +92,13 @@ def parse_query(query):
     }
 
 class SearchState(object):
+    #values that are kept between the requests
+    STORED_FIELDS = (
+        'scope', 'query', 'stripped_query', 'query_tags', 'query_users',
+        'query_title', 'search', 'tags', 'author', 'sort', 'page_size',
+        'page', 'cursor', 'logged_in'
+    )
+
     def __init__(self):
         self.scope = const.DEFAULT_POST_SCOPE
         self.query = None
@@ -105,6 +112,7 @@ class SearchState(object):
         self.sort = const.DEFAULT_POST_SORT_METHOD
         self.page_size = int(askbot_settings.DEFAULT_QUESTIONS_PAGE_SIZE)
         self.page = 1
+        self.cursor = None
         self.logged_in = False
         logging.debug('new search state initialized')
 
@@ -120,6 +128,7 @@ class SearchState(object):
         out += 'sort=%s\n' % self.sort
         out += 'page_size=%d\n' % self.page_size
         out += 'page=%d\n' % self.page
+        out += 'cursor=%s\n' % getattr(self, 'cursor', None)
         out += 'logged_in=%s\n' % str(self.logged_in)
         return out
 
@@ -138,6 +147,25 @@ class SearchState(object):
             return False
         return True
 
+    def to_dict(self):
+        """returns the stored values as a dictionary
+        that can be serialized as json
+        """
+        data = dict()
+        for field in self.STORED_FIELDS:
+            data[field] = getattr(self, field, None)
+        if data['tags'] is not None:
+            data['tags'] = sorted(data['tags'])
+        return data
+
+    def update_from_dict(self, data):
+        """the reverse of :meth:`to_dict`"""
+        for field in self.STORED_FIELDS:
+            if field in data:
+                setattr(self, field, data[field])
+        if self.tags is not None:
+            self.tags = set(self.tags)
+
     def set_logged_out(self):
         if self.scope == 'favorite':
             self.scope = None
@@ -174,6 +202,8 @@ class SearchState(object):
 
         if 'page' in input_dict:
             self.page = input_dict['page']
+            #cursor points to the last question on the previous page
+            self.cursor = input_dict.get('cursor', None)
             #special case - on page flip no other input is accepted
             return
 
@@ -278,6 +308,7 @@ class SearchState(object):
 
     def reset_page(self):
         self.page = 1
+        self.cursor = None
 
     def reset_query(self):
         """reset the search query string and 
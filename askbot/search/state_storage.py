@@ -0,0 +1,191 @@
+"""Storage of the search state, of the view log and of the times
+of the counted question views between requests
+
+Django setting ``ASKBOT_SEARCH_STATE_STORAGE`` selects where they are kept:
+
+* ``'session'`` (default) - in the session, as before
+* ``'cookie'`` - in a cookie signed with the ``SECRET_KEY``,
+  then browsing the question list does not need the session at all
+
+In both cases the values are written only when they are changed
+by the request, so repeated views of the same pages do not
+rewrite the session or resend the cookie.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import time
+from django.conf import settings as django_settings
+from django.utils import simplejson
+from askbot.search.state_manager import SearchState, ViewLog
+
+COOKIE_NAME = 'askbot_search_state'
+#times of the views of only so many questions are kept in the cookie
+MAX_COOKIE_QUESTION_VIEWS = 30
+
+def uses_cookie():
+    storage = getattr(django_settings, 'ASKBOT_SEARCH_STATE_STORAGE', 'session')
+    return storage == 'cookie'
+
+def get_signature(value):
+    return hmac.new(django_settings.SECRET_KEY, value, hashlib.sha1).hexdigest()
+
+def is_valid_signature(value, signature):
+    """compares signatures in constant time"""
+    expected_signature = get_signature(value)
+    if len(signature) != len(expected_signature):
+        return False
+    difference = 0
+    for char1, char2 in zip(signature, expected_signature):
+        difference |= ord(char1) ^ ord(char2)
+    return difference == 0
+
+def encode_cookie(data):
+    """returns signed cookie value with the data encoded as json"""
+    payload = base64.urlsafe_b64encode(simplejson.dumps(data))
+    return payload + '.' + get_signature(payload)
+
+def decode_cookie(value):
+    """returns data stored in the cookie, or an empty
+    dictionary if the cookie is malformed or its signature is wrong
+    """
+    try:
+        payload, signature = str(value).rsplit('.', 1)
+    except (ValueError, UnicodeError):
+        return dict()
+    if not is_valid_signature(payload, signature):
+        return dict()
+    try:
+        data = simplejson.loads(base64.urlsafe_b64decode(payload))
+    except (TypeError, ValueError):
+        return dict()
+    if not isinstance(data, dict):
+        return dict()
+    return data
+
+def get_cookie_data(request):
+    """returns data of the cookie, decoded once per request"""
+    if not hasattr(request, '_search_state_cookie'):
+        cookie_value = request.COOKIES.get(COOKIE_NAME, '')
+        request._search_state_cookie = decode_cookie(cookie_value)
+        request._search_state_cookie_changed = False
+    return request._search_state_cookie
+
+def load_value(request, key):
+    if uses_cookie():
+        return get_cookie_data(request).get(key, None)
+    else:
+        return request.session.get(key, None)
+
+def store_value(request, key, value, stored_value):
+    """saves value to the session or to the cookie data,
+    ``stored_value`` is the json-compatible form of the value
+    """
+    if uses_cookie():
+        get_cookie_data(request)[key] = stored_value
+        request._search_state_cookie_changed = True
+    else:
+        request.session[key] = value
+
+def load_search_state(request):
+    """returns search state saved by the previous requests
+    or a new one"""
+    search_state = SearchState()
+    stored_state = load_value(request, 'search_state')
+    if isinstance(stored_state, SearchState):
+        search_state = stored_state
+    elif isinstance(stored_state, dict):
+        search_state.update_from_dict(stored_state)
+    #snapshot for the comparison in the save_search_state
+    if stored_state is None:
+        request._loaded_search_state = None
+    else:
+        request._loaded_search_state = search_state.to_dict()
+    return search_state
+
+def save_search_state(request, search_state):
+    """saves the search state, if it has changed since
+    it was loaded with :func:`load_search_state`
+    """
+    data = search_state.to_dict()
+    if data == getattr(request, '_loaded_search_state', None):
+        return
+    store_value(request, 'search_state', search_state, data)
+    request._loaded_search_state = data
+
+def load_view_log(request):
+    view_log = ViewLog()
+    stored_log = load_value(request, 'view_log')
+    if isinstance(stored_log, ViewLog):
+        view_log = stored_log
+    elif isinstance(stored_log, list):
+        view_log.views = stored_log[:view_log.depth]
+    if stored_log is None:
+        request._loaded_view_log = None
+    else:
+        request._loaded_view_log = list(view_log.views)
+    return view_log
+
+def save_view_log(request, view_log):
+    """saves the view log, if it has changed since
+    it was loaded with :func:`load_view_log`
+    """
+    views = list(view_log.views)
+    if views == getattr(request, '_loaded_view_log', None):
+        return
+    store_value(request, 'view_log', view_log, views)
+    request._loaded_view_log = views
+
+def load_question_view_time(request, question_id):
+    """returns time of the last counted view of the question
+    by the visitor or ``None``"""
+    if uses_cookie():
+        view_times = get_cookie_data(request).get('question_view_times', None)
+        if not isinstance(view_times, dict):
+            return None
+        timestamp = view_times.get(str(question_id), None)
+        if timestamp is None:
+            return None
+        return datetime.datetime.fromtimestamp(timestamp)
+    else:
+        view_times = request.session.get('question_view_times', {})
+        return view_times.get(question_id, None)
+
+def save_question_view_time(request, question_id, view_time):
+    """saves time of the counted view of the question, in the cookie
+    the views of at most ``MAX_COOKIE_QUESTION_VIEWS`` latest
+    viewed questions are kept
+    """
+    if uses_cookie():
+        view_times = get_cookie_data(request).get('question_view_times', None)
+        if isinstance(view_times, dict):
+            view_times = dict(view_times)
+        else:
+            view_times = dict()
+        view_times[str(question_id)] = time.mktime(view_time.timetuple()) \
+                                    + view_time.microsecond / 1000000.0
+        if len(view_times) > MAX_COOKIE_QUESTION_VIEWS:
+            latest_views = sorted(
+                                view_times.items(),
+                                key = lambda item: item[1],
+                                reverse = True
+                            )
+            view_times = dict(latest_views[:MAX_COOKIE_QUESTION_VIEWS])
+        store_value(request, 'question_view_times', None, view_times)
+    else:
+        view_times = request.session.get('question_view_times', {})
+        view_times[question_id] = view_time
+        request.session['question_view_times'] = view_times
+
+def save_cookie(request, response):
+    """sets the cookie on the response, if its data were changed"""
+    if getattr(request, '_search_state_cookie_changed', False):
+        response.set_cookie(
+                    COOKIE_NAME,
+                    encode_cookie(request._search_state_cookie),
+                    max_age = django_settings.SESSION_COOKIE_AGE,
+                    path = django_settings.SESSION_COOKIE_PATH,
+                    domain = django_settings.SESSION_COOKIE_DOMAIN,
+                    secure = django_settings.SESSION_COOKIE_SECURE or None
+                )
@@ -1,11 +1,29 @@
+"""template loading for askbot skins
+
+every skin has a Jinja2 environment, configured with django settings:
+
+* ``ASKBOT_TEMPLATE_BYTECODE_CACHE`` - where compiled templates
+  are kept between restarts of the processes: ``'filesystem'``,
+  ``'cache'`` - in the django cache, or ``None`` (default) - nowhere
+* ``ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR`` - directory
+  of the filesystem cache, temporary directory by default
+* ``ASKBOT_TEMPLATE_AUTO_RELOAD`` - if False, modification times
+  of the template files are not checked and changed templates
+  are used after restart, True by default
+
+``python manage.py precompile_templates`` fills the bytecode cache
+"""
 import os.path
+import sys
 from django.template.loaders import filesystem
 from django.template import RequestContext
 from django.http import HttpResponse
 from django.utils import translation
 from django.conf import settings as django_settings
+from django.core.cache import cache
 from coffin.common import CoffinEnvironment
 from jinja2 import loaders as jinja_loaders
+from jinja2.bccache import BytecodeCache, FileSystemBytecodeCache
 from jinja2.exceptions import TemplateNotFound
 from jinja2.utils import open_if_exists
 from askbot.conf import settings as askbot_settings
@@ -22,6 +40,10 @@ template.add_to_builtins('askbot.templatetags.extra_filters_jinja')
 #here it is ignored because it is assumed that we won't use unicode paths
 ASKBOT_SKIN_COLLECTION_DIR = os.path.dirname(__file__)
 
+#django templates, loaded by the default error handlers
+#with the :func:`load_template_source` below
+DJANGO_TEMPLATES = ('404.html', '500.html')
+
 def load_template_source(name, dirs=None):
     """Django template loader
     """
@@ -48,7 +70,6 @@ class SkinLoader(jinja_loaders.BaseLoader):
         skin = askbot_settings.ASKBOT_DEFAULT_SKIN
         skin_path = utils.get_path_to_skin(skin)
         filename = os.path.join(skin_path, 'templates', *pieces)
-        print 'want file %s' % filename
         f = open_if_exists(filename)
         if f is None:
             raise TemplateNotFound(template)
@@ -65,6 +86,52 @@ class SkinLoader(jinja_loaders.BaseLoader):
                 return False
         return contents, filename, uptodate
 
+class DjangoCacheBytecodeCache(BytecodeCache):
+    """keeps compiled templates in the django cache,
+    bytecode is specific to the python version
+    """
+    timeout = 30*24*3600 - 1
+
+    def make_cache_key(self, bucket):
+        """returns key of the django cache entry,
+        :meth:`get_cache_key` of the base class computes the bucket key"""
+        return 'askbot-jinja-%d%d-%s' % (
+                                sys.version_info[0],
+                                sys.version_info[1],
+                                bucket.key
+                            )
+
+    def load_bytecode(self, bucket):
+        code = cache.get(self.make_cache_key(bucket))
+        if code is not None:
+            bucket.bytecode_from_string(code)
+
+    def dump_bytecode(self, bucket):
+        cache.set(
+            self.make_cache_key(bucket),
+            bucket.bytecode_to_string(),
+            self.timeout
+        )
+
+def get_bytecode_cache():
+    """returns bytecode cache selected by the django settings or None"""
+    cache_type = getattr(django_settings, 'ASKBOT_TEMPLATE_BYTECODE_CACHE', None)
+    if cache_type == 'filesystem':
+        directory = getattr(
+                        django_settings,
+                        'ASKBOT_TEMPLATE_BYTECODE_CACHE_DIR',
+                        None
+                    )
+        return FileSystemBytecodeCache(directory)
+    elif cache_type == 'cache':
+        return DjangoCacheBytecodeCache()
+    elif cache_type is None:
+        return None
+    else:
+        raise ValueError(
+            'unknown ASKBOT_TEMPLATE_BYTECODE_CACHE %s' % cache_type
+        )
+
 class SkinEnvironment(CoffinEnvironment):
     """Jinja template environment
     that loads templates from askbot skins
@@ -88,6 +155,14 @@ class SkinEnvironment(CoffinEnvironment):
         loaders.append(jinja_loaders.FileSystemLoader(template_dirs))
         return loaders
 
+    def list_skin_templates(self):
+        """returns names of the jinja templates of the skin,
+        the django templates are not included"""
+        return [
+            name for name in self.list_templates()
+            if name not in DJANGO_TEMPLATES
+        ]
+
     def set_language(self, language_code):
         """hooks up translation objects from django to jinja2
         environment.
@@ -108,10 +183,14 @@ class SkinEnvironment(CoffinEnvironment):
 
 def load_skins():
     skins = dict()
+    bytecode_cache = get_bytecode_cache()
+    auto_reload = getattr(django_settings, 'ASKBOT_TEMPLATE_AUTO_RELOAD', True)
     for skin_name in utils.get_available_skins():
         skins[skin_name] = SkinEnvironment(
                                 skin = skin_name,
-                                extensions=['jinja2.ext.i18n',]
+                                extensions=['jinja2.ext.i18n',],
+                                bytecode_cache = bytecode_cache,
+                                auto_reload = auto_reload
                             )
         skins[skin_name].set_language(django_settings.LANGUAGE_CODE)
         #from askbot.templatetags import extra_filters_jinja as filters
@@ -4,9 +4,19 @@ the lookup resolution process for templates and media works as follows:
 * look up item in selected skin
 * if not found look in 'default'
 * raise an exception 
+
+urls of the skin media are resolved with :class:`MediaManifest` -
+a table of all media files of the selected and the default skins,
+built when the skin or the media resource revision changes, so the
+lookups do not touch the file system.
+With the django setting ``ASKBOT_MEDIA_FINGERPRINTS = True`` media urls
+carry a hash of the file content instead of the resource revision,
+so the files may be cached by the browsers for a long time.
 """
+import hashlib
 import os
 import logging
+import threading
 from django.conf import settings as django_settings
 from django.utils.datastructures import SortedDict
 
@@ -81,6 +91,84 @@ def resolve_skin_for_media(media=None, preferred_skin = None):
             return skin_name
     raise MediaNotFound(media)
 
+def make_media_url(skin_name, resource):
+    url = skin_name + '/media/' + resource
+    url = '///' + django_settings.ASKBOT_URL + 'm/' + url
+    return os.path.normpath(url).replace(
+                                    '\\', '/'
+                                ).replace(
+                                    '///', '/'
+                                )
+
+def get_file_fingerprint(file_path):
+    """returns short hash of the file content"""
+    media_file = open(file_path, 'rb')
+    try:
+        return hashlib.md5(media_file.read()).hexdigest()[:12]
+    finally:
+        media_file.close()
+
+
+class MediaManifest(object):
+    """table of the final urls of the skin media resources:
+    resource path relative to the media directory -> url
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.key = None
+        self.urls = dict()
+
+    def get_url(self, resource, skin_name, resource_revision):
+        """returns url of the resource or None,
+        the table is rebuilt if the skin or the revision have changed
+        """
+        fingerprints = getattr(django_settings, 'ASKBOT_MEDIA_FINGERPRINTS', False)
+        key = (skin_name, resource_revision, fingerprints)
+        if key != self.key:
+            self.rebuild(key)
+        url = self.urls.get(resource, None)
+        if url is None and django_settings.DEBUG:
+            #files may be added while the development server is running
+            self.rebuild(key)
+            url = self.urls.get(resource, None)
+        return url
+
+    def rebuild(self, key):
+        self.lock.acquire()
+        try:
+            self.urls = self.build(*key)
+            self.key = key
+        finally:
+            self.lock.release()
+
+    def build(self, skin_name, resource_revision, fingerprints):
+        """scans media directories of the skin and of the default skin,
+        files of the selected skin take precedence"""
+        urls = dict()
+        skins = get_available_skins(selected = skin_name)
+        for skin_name, skin_dir in skins.items():
+            media_dir = os.path.join(skin_dir, 'media')
+            for dir_path, dir_names, file_names in os.walk(media_dir):
+                for file_name in file_names:
+                    file_path = os.path.join(dir_path, file_name)
+                    resource = file_path[len(media_dir) + 1:]
+                    resource = resource.replace(os.sep, '/')
+                    if resource in urls:
+                        continue
+                    url = make_media_url(skin_name, resource)
+                    if fingerprints:
+                        url += '?v=%s' % get_file_fingerprint(file_path)
+                    elif resource_revision:
+                        url += '?v=%d' % resource_revision
+                    urls[resource] = url
+        return urls
+
+
+MEDIA_MANIFEST = MediaManifest()
+
+#urls of the files found in the upload directory
+UPLOADED_MEDIA_URLS = dict()
+
 def get_media_url(url, ignore_missing = False):
     """returns url prefixed with the skin name
     of the first skin that contains the file 
@@ -91,14 +179,14 @@ def get_media_url(url, ignore_missing = False):
 
     todo: move this to the skin environment class
     """
-    #import datetime
-    #before = datetime.datetime.now()
     url = unicode(url)
     while url[0] == '/': url = url[1:]
     #todo: handles case of multiple skin directories
 
     #if file is in upfiles directory, then give that
     url_copy = url
+    if url_copy in UPLOADED_MEDIA_URLS:
+        return UPLOADED_MEDIA_URLS[url_copy]
     if url_copy.startswith(django_settings.ASKBOT_UPLOADED_FILES_URL):
         file_path = url_copy.replace(
                                 django_settings.ASKBOT_UPLOADED_FILES_URL,
@@ -117,6 +205,7 @@ def get_media_url(url, ignore_missing = False):
                                 ).replace(
                                     '///', '/'
                                 )
+            UPLOADED_MEDIA_URLS[url] = url_copy
             return url_copy
         elif ignore_missing == False:
             logging.critical('missing media resource %s' % url)
@@ -136,26 +225,9 @@ def get_media_url(url, ignore_missing = False):
         use_skin = 'default'
         resource_revision = None
 
-    #determine from which skin take the media file
-    try:
-        use_skin = resolve_skin_for_media(media=url, preferred_skin = use_skin)
-    except MediaNotFound, e:
+    media_url = MEDIA_MANIFEST.get_url(url, use_skin, resource_revision)
+    if media_url is None:
         log_message = 'missing media resource %s in skin %s' \
                         % (url, use_skin)
         logging.critical(log_message)
-        return None
-
-    url = use_skin + '/media/' + url
-    url = '///' + django_settings.ASKBOT_URL + 'm/' + url
-    url = os.path.normpath(url).replace(
-                                    '\\', '/'
-                                ).replace(
-                                    '///', '/'
-                                )
-    
-    if resource_revision:
-        url +=  '?v=%d' % resource_revision
-
-    #after = datetime.datetime.now()
-    #print after - before
-    return url
+    return media_url
@@ -103,6 +103,7 @@ def cnprog_paginator(context):
             "previous": context["previous"],
             "has_previous": context["has_previous"],
             "next": context["next"],
+            "next_cursor": context.get("next_cursor", None),
             "has_next": context["has_next"],
             "page": context["page"],
             "pages": context["pages"],
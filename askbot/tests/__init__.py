@@ -10,3 +10,6 @@ from askbot.tests.search_state_tests import *
 from askbot.tests.form_tests import *
 from askbot.tests.follow_tests import *
 from askbot.tests.templatefilter_tests import *
+from askbot.tests.cache_tests import *
+from askbot.tests.search_backend_tests import *
+from askbot.tests.html_utils_tests import *
@@ -4,6 +4,7 @@ from askbot.tests.utils import AskbotTestCase
 from askbot.conf import settings
 from askbot import models
 from askbot.models.badges import award_badges_signal
+from askbot.models import view_counter
 
 class BadgeTests(AskbotTestCase):
 
@@ -175,10 +176,12 @@ class BadgeTests(AskbotTestCase):
 
         self.client.login(method='force', user_id = self.u2.id)
         self.client.get(url)
+        view_counter.flush()
         self.assert_have_badge('popular-question', recipient = self.u1)
 
         self.client.login(method='force', user_id = self.u3.id)
         self.client.get(url)
+        view_counter.flush()
         self.assert_have_badge('popular-question', recipient = self.u1, expected_count = 1)
 
         question2 = self.post_question(user = self.u1)
@@ -186,6 +189,7 @@ class BadgeTests(AskbotTestCase):
         question2.save()
         self.client.login(method='force', user_id = self.u2.id)
         self.client.get(question2.get_absolute_url())
+        view_counter.flush()
         self.assert_have_badge('popular-question', recipient = self.u1, expected_count = 2)
 
     def test_student_badge(self):
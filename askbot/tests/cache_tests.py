@@ -0,0 +1,290 @@
+"""Tests of the cached data - question list pages,
+cache version counters, etc.
+"""
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from askbot.tests.utils import AskbotTestCase
+from askbot.search.state_manager import SearchState
+from askbot.search import result_cache
+from askbot import models
+from askbot import api
+from askbot.utils import markup
+from askbot.models import tag_filter
+from askbot.models import tag_lookup
+from askbot.conf import settings as askbot_settings
+from askbot.conf.settings_wrapper import SETTINGS_SNAPSHOT, VERSION_KEY
+from askbot.utils.cache import bump_cache_version
+
+class QuestionListCacheTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.question = self.post_question()
+        self.search_state = SearchState()
+
+    def cache_first_page(self):
+        cache_key = result_cache.get_cache_key(self.search_state)
+        (qs, meta_data, related_tags) = \
+            models.Question.objects.run_advanced_search(
+                                        request_user = AnonymousUser(),
+                                        search_state = self.search_state
+                                    )
+        page = Paginator(qs, self.search_state.page_size).page(1)
+        result_cache.save(
+                    cache_key,
+                    page = page,
+                    related_tags = related_tags,
+                    contributors = [self.user],
+                    meta_data = meta_data
+                )
+        return cache_key
+
+    def test_cached_page_is_restored(self):
+        cache_key = self.cache_first_page()
+        data = result_cache.load(cache_key)
+        self.assertEquals(data['question_ids'], [self.question.id])
+        self.assertEquals(data['contributor_ids'], [self.user.id])
+        self.assertEquals(data['question_count'], 1)
+        self.assertEquals(result_cache.get_questions(data), [self.question])
+
+    def test_new_question_invalidates_cache(self):
+        cache_key = self.cache_first_page()
+        self.post_question(title = 'another question')
+        new_key = result_cache.get_cache_key(self.search_state)
+        self.assertNotEqual(cache_key, new_key)
+        self.assertEquals(result_cache.load(new_key), None)
+
+    def test_key_depends_on_search_state(self):
+        cache_key = result_cache.get_cache_key(self.search_state)
+        self.search_state.sort = 'votes-desc'
+        self.assertNotEqual(
+                    cache_key,
+                    result_cache.get_cache_key(self.search_state)
+                )
+
+
+class QuestionPageCacheTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'other_user')
+        self.question = self.post_question()
+
+    def assert_page_cache_invalidated(self, func, *args, **kwargs):
+        old_version = self.question.get_page_cache_version()
+        func(*args, **kwargs)
+        self.assertNotEquals(
+            self.question.get_page_cache_version(),
+            old_version
+        )
+
+    def test_answer_invalidates_page_cache(self):
+        self.assert_page_cache_invalidated(
+            self.post_answer,
+            question = self.question
+        )
+
+    def test_comment_invalidates_page_cache(self):
+        answer = self.post_answer(question = self.question)
+        self.assert_page_cache_invalidated(
+            self.post_comment,
+            parent_post = answer
+        )
+
+    def test_vote_invalidates_page_cache(self):
+        answer = self.post_answer(question = self.question)
+        self.assert_page_cache_invalidated(self.other_user.upvote, answer)
+
+    def test_new_answer_is_shown_to_anonymous_visitors(self):
+        self.post_answer(question = self.question, body_text = 'first answer')
+        url = self.question.get_absolute_url()
+        self.assertContains(self.client.get(url), 'first answer')
+        self.post_answer(
+                user = self.other_user,
+                question = self.question,
+                body_text = 'second answer'
+            )
+        self.assertContains(self.client.get(url), 'second answer')
+
+
+class MarkupRenderCacheTests(TestCase):
+
+    def setUp(self):
+        markup.RENDER_CACHE.clear()
+
+    def test_parser_is_reused(self):
+        self.assertTrue(markup.get_parser() is markup.get_parser())
+
+    def test_cached_html_equals_rendered_html(self):
+        text = 'some *markdown* text http://example.com'
+        expected = markup.render(text, markup.get_parser_settings())
+        self.assertEquals(markup.markdown_to_html(text), expected)
+        self.assertEquals(markup.markdown_to_html(text), expected)
+
+    def test_rendered_html_is_remembered(self):
+        text = 'some **markdown** text'
+        key = markup.get_render_cache_key(text, markup.get_parser_settings())
+        html = markup.markdown_to_html(text)
+        self.assertEquals(markup.RENDER_CACHE.get(key), html)
+
+    def test_least_recently_used_entries_are_dropped(self):
+        render_cache = markup.RenderCache()
+        max_size = markup.get_cache_size()
+        for number in range(max_size):
+            render_cache.set(number, 'html')
+        render_cache.get(0)
+        render_cache.set(max_size, 'html')
+        self.assertEquals(render_cache.get(0), 'html')
+        self.assertEquals(render_cache.get(1), None)
+        self.assertEquals(render_cache.get(max_size), 'html')
+
+
+class SettingsSnapshotTests(TestCase):
+
+    def tearDown(self):
+        askbot_settings.update('EMAIL_SUBJECT_PREFIX', '')
+
+    def test_updated_setting_is_read_back(self):
+        askbot_settings.EMAIL_SUBJECT_PREFIX
+        askbot_settings.update('EMAIL_SUBJECT_PREFIX', 'new prefix')
+        self.assertEquals(askbot_settings.EMAIL_SUBJECT_PREFIX, 'new prefix')
+        self.assertEquals(
+            askbot_settings.as_dict()['EMAIL_SUBJECT_PREFIX'],
+            'new prefix'
+        )
+
+    def test_values_are_read_from_snapshot(self):
+        askbot_settings.EMAIL_SUBJECT_PREFIX
+        self.assertFalse(SETTINGS_SNAPSHOT.is_stale)
+        self.assertEquals(
+            SETTINGS_SNAPSHOT.values['EMAIL_SUBJECT_PREFIX'],
+            askbot_settings.EMAIL_SUBJECT_PREFIX
+        )
+
+    def test_version_is_checked_outside_of_requests(self):
+        askbot_settings.EMAIL_SUBJECT_PREFIX
+        #the setting is changed in another process
+        SETTINGS_SNAPSHOT.values['EMAIL_SUBJECT_PREFIX'] = 'old prefix'
+        bump_cache_version(VERSION_KEY)
+        self.assertEquals(askbot_settings.EMAIL_SUBJECT_PREFIX, 'old prefix')
+        SETTINGS_SNAPSHOT.check_time = 0
+        self.assertEquals(askbot_settings.EMAIL_SUBJECT_PREFIX, '')
+
+    def test_settings_are_read_when_snapshot_fails(self):
+        def load_values(settings):
+            raise ValueError('broken setting')
+        SETTINGS_SNAPSHOT.load_values = load_values
+        try:
+            SETTINGS_SNAPSHOT.invalidate()
+            self.assertEquals(askbot_settings.EMAIL_SUBJECT_PREFIX, '')
+            self.assertEquals(SETTINGS_SNAPSHOT.values, None)
+        finally:
+            del SETTINGS_SNAPSHOT.load_values
+            SETTINGS_SNAPSHOT.invalidate()
+
+
+class ModerationItemsCacheTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'moderator', status = 'm')
+        self.create_user(username = 'flagger')
+        self.question = self.post_question()
+
+    def assert_moderation_items(self, new_count, seen_count):
+        info = api.get_info_on_moderation_items(self.moderator)
+        self.assertEquals(info['new_count'], new_count)
+        self.assertEquals(info['seen_count'], seen_count)
+
+    def test_flag_updates_cached_counts(self):
+        self.assert_moderation_items(0, 0)
+        self.flagger.flag_post(self.question, force = True)
+        self.assert_moderation_items(1, 0)
+
+    def test_question_visit_updates_cached_counts(self):
+        self.flagger.flag_post(self.question, force = True)
+        self.assert_moderation_items(1, 0)
+        self.moderator.visit_question(self.question)
+        self.assert_moderation_items(0, 1)
+
+    def test_regular_user_has_no_moderation_items(self):
+        self.assertEquals(api.get_info_on_moderation_items(self.user), None)
+
+
+class TagFilterCacheTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.question = self.post_question(tags = 'one two')
+
+    def get_tag_ids(self, *tag_names):
+        tags = models.Tag.objects.filter(name__in = tag_names)
+        return sorted(tags.values_list('id', flat = True))
+
+    def test_marked_tags_are_refreshed(self):
+        self.user.mark_tags(tagnames = ['one'], reason = 'good', action = 'add')
+        selections = tag_filter.get_tag_filter(self.user)
+        self.assertEquals(selections['good']['tag_ids'], self.get_tag_ids('one'))
+        self.assertEquals(selections['good']['tag_names'], ['one'])
+
+        self.user.mark_tags(tagnames = ['two'], reason = 'bad', action = 'add')
+        selections = tag_filter.get_tag_filter(self.user)
+        self.assertEquals(selections['bad']['tag_ids'], self.get_tag_ids('two'))
+
+        self.user.mark_tags(tagnames = ['one'], action = 'remove')
+        selections = tag_filter.get_tag_filter(self.user)
+        self.assertEquals(selections['good']['tag_ids'], [])
+
+    def test_new_tags_matching_wildcards_are_added(self):
+        self.user.mark_tags(wildcards = ['tw*'], reason = 'good', action = 'add')
+        selections = tag_filter.get_tag_filter(self.user)
+        self.assertEquals(
+            selections['good']['wildcard_tag_ids'],
+            self.get_tag_ids('two')
+        )
+        self.post_question(tags = 'twelve')
+        selections = tag_filter.get_tag_filter(self.user)
+        self.assertEquals(
+            selections['good']['wildcard_tag_ids'],
+            self.get_tag_ids('two', 'twelve')
+        )
+
+
+class TagLookupTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.post_question(tags = 'python pyramid')
+        self.post_question(tags = 'python Pylons')
+        self.post_question(tags = 'python perl')
+        self.lookup = tag_lookup.TagLookup()
+
+    def test_get_tag_names(self):
+        self.assertEquals(
+            self.lookup.get_tag_names('py', limit = 2),
+            ['python', 'Pylons']
+        )
+        self.assertEquals(
+            self.lookup.get_tag_names('Py', case_sensitive = True),
+            ['Pylons']
+        )
+        self.assertEquals(self.lookup.get_tag_names('java'), [])
+        self.assertEquals(self.lookup.count_tags('p'), 4)
+
+    def test_index_is_rebuilt_after_invalidation(self):
+        self.assertEquals(self.lookup.count_tags('ruby'), 0)
+        self.post_question(tags = 'ruby')
+        self.lookup.build_time = 0
+        self.assertEquals(self.lookup.count_tags('ruby'), 1)
+
+    def test_tag_list_is_revalidated_with_etag(self):
+        url = reverse('get_tag_list')
+        response = self.client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue('python' in response.content.split('\n'))
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH = etag)
+        self.assertEquals(response.status_code, 304)
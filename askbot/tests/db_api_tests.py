@@ -4,8 +4,16 @@ functions that happen on behalf of users
 e.g. ``some_user.do_something(...)``
 """
 from django.core import exceptions
+from django.contrib.auth.models import AnonymousUser
 from askbot.tests.utils import AskbotTestCase
 from askbot import models
+from askbot.models.viewer_state import ViewerState
+from askbot.models.view_counter import ViewCounter
+from askbot.models.last_seen_tracker import LastSeenTracker
+from askbot.models.subscriber_index import WildcardTrie, SUBSCRIBER_INDEX
+from askbot.models import subscriber_index
+from askbot.models import tag_index
+from askbot.models import bulk_retag
 from askbot import const
 from askbot.conf import settings as askbot_settings
 import datetime
@@ -144,6 +152,41 @@ class DBApiTests(AskbotTestCase):
         count = models.Tag.objects.filter(name='one-tag').count()
         self.assertEquals(count, 0)
 
+    def test_tag_with_drifted_use_count_is_not_deleted(self):
+        self.user.retag_question(self.question, tags = 'one-tag')
+        other_question = self.post_question(user = self.other_user, tags = 'one-tag')
+        models.Tag.objects.filter(name = 'one-tag').update(used_count = 1)
+        self.user.retag_question(self.question, tags = 'two-tag')
+        self.assertEquals(models.Tag.objects.filter(name = 'one-tag').count(), 1)
+        self.assertEquals(
+            [tag.name for tag in other_question.tags.all()],
+            ['one-tag']
+        )
+
+    def test_tag_use_counts_follow_retag_delete_restore(self):
+        self.user.retag_question(self.question, tags = 'one two')
+        other_question = self.post_question(user = self.other_user, tags = 'two')
+        self.assertEquals(models.Tag.objects.get(name = 'two').used_count, 2)
+
+        self.user.retag_question(self.question, tags = 'one three')
+        self.assertEquals(models.Tag.objects.get(name = 'two').used_count, 1)
+        self.assertEquals(models.Tag.objects.get(name = 'three').used_count, 1)
+
+        self.user.delete_question(self.question)
+        tag = models.Tag.objects.get(name = 'one')
+        self.assertEquals(tag.used_count, 0)
+        self.assertEquals(tag.deleted, True)
+        #retag of the deleted question does not change the counts
+        self.user.retag_question(self.question, tags = 'one two')
+        self.assertEquals(models.Tag.objects.get(name = 'two').used_count, 1)
+
+        self.user.restore_post(self.question)
+        tag = models.Tag.objects.get(name = 'one')
+        self.assertEquals(tag.used_count, 1)
+        self.assertEquals(tag.deleted, False)
+        self.assertEquals(models.Tag.objects.get(name = 'two').used_count, 2)
+        self.assertEquals(models.Tag.objects.recount_use_counts(), 0)
+
     def test_search_with_apostrophe_works(self):
         self.post_question(
             user = self.user,
@@ -254,6 +297,8 @@ class GlobalTagSubscriberGetterTests(AskbotTestCase):
                                     user = self.u1,
                                     tags = "good day"
                                 )
+        #the index may keep users of the earlier tests
+        subscriber_index.invalidate()
 
     def set_email_tag_filter_strategy(self, strategy):
         self.u1.email_tag_filter_strategy = strategy
@@ -347,6 +392,91 @@ class GlobalTagSubscriberGetterTests(AskbotTestCase):
             reason = 'bad'
         )
 
+    def test_unsubscribed_user_is_not_in_index(self):
+        """tag selections of users without instant
+        whole forum subscription are not indexed"""
+        self.set_email_tag_filter_strategy(const.INCLUDE_INTERESTING)
+        self.u1.mark_tags(tagnames = ('day',), reason = 'good', action = 'add')
+        feed = self.u1.notification_subscriptions.get(feed_type = 'q_all')
+        feed.frequency = 'd'
+        feed.save()
+        self.assert_subscribers_are(
+            expected_subscribers = set(),
+            reason = 'good'
+        )
+
+    def test_removed_tag_selection_is_not_in_index(self):
+        self.set_email_tag_filter_strategy(const.INCLUDE_INTERESTING)
+        self.u1.mark_tags(tagnames = ('day',), reason = 'good', action = 'add')
+        self.assert_subscribers_are(
+            expected_subscribers = set([self.u1,]),
+            reason = 'good'
+        )
+        self.u1.mark_tags(tagnames = ('day',), action = 'remove')
+        self.assert_subscribers_are(
+            expected_subscribers = set(),
+            reason = 'good'
+        )
+
+class WildcardTrieTests(AskbotTestCase):
+    def test_wildcards_match_tag_prefixes(self):
+        trie = WildcardTrie()
+        trie.add('da*', 1)
+        trie.add('day*', 2)
+        trie.add('night*', 3)
+        self.assertEquals(trie.find_users('day'), set([1, 2]))
+        self.assertEquals(trie.find_users('date'), set([1]))
+        self.assertEquals(trie.find_users('d'), set())
+
+    def test_removed_wildcard_does_not_match(self):
+        trie = WildcardTrie()
+        trie.add('da*', 1)
+        trie.add('da*', 2)
+        trie.remove('da*', 1)
+        trie.remove('night*', 1)
+        self.assertEquals(trie.find_users('day'), set([2]))
+
+class SubscriberIndexTests(AskbotTestCase):
+
+    def setUp(self):
+        self.user = self.create_user(
+                        username = 'user',
+                        notification_schedule = {'q_all': 'i'}
+                    )
+        self.tag = models.Tag(name = 'day', created_by = self.user)
+        self.tag.save()
+        subscriber_index.invalidate()
+        self.build_count = 0
+        self.original_build = SUBSCRIBER_INDEX.build
+        def build():
+            self.build_count += 1
+            self.original_build()
+        SUBSCRIBER_INDEX.build = build
+        subscriber_index.get_tag_followers(['day'])
+
+    def tearDown(self):
+        del SUBSCRIBER_INDEX.build
+
+    def test_tag_marks_are_applied_without_rebuild(self):
+        self.user.mark_tags(tagnames = ('day',), reason = 'good', action = 'add')
+        self.assertEquals(
+            subscriber_index.get_tag_followers(['day']),
+            set([self.user.id])
+        )
+        self.user.mark_tags(tagnames = ('day',), action = 'remove')
+        self.assertEquals(subscriber_index.get_tag_followers(['day']), set())
+        self.assertEquals(self.build_count, 1)
+
+    def test_deleted_tag_is_removed(self):
+        self.user.mark_tags(tagnames = ('day',), reason = 'bad', action = 'add')
+        self.assertEquals(
+            subscriber_index.get_tag_ignorers(['day']),
+            set([self.user.id])
+        )
+        self.tag.delete()
+        self.assertEquals(subscriber_index.get_tag_ignorers(['day']), set())
+        self.assertEquals(self.build_count, 1)
+
 class CommentTests(AskbotTestCase):
     """unfortunately, not very useful tests,
     as assertions of type "user can" are not inside
@@ -377,3 +507,268 @@ class CommentTests(AskbotTestCase):
         self.other_user.upvote(comment, cancel = True)
         comment = models.Comment.objects.get(id = self.comment.id)
         self.assertEquals(comment.score, 0)
+
+class ViewerStateTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'viewer')
+        self.question = self.post_question()
+        self.answers = list()
+        for i in range(3):
+            self.answers.append(self.post_answer(question = self.question))
+        self.comment = self.post_comment(parent_post = self.answers[0])
+
+    def test_viewer_state_of_anonymous_user(self):
+        state = ViewerState(
+                    user = AnonymousUser(),
+                    question = self.question,
+                    answers = self.answers
+                )
+        self.assertEquals(state.get_vote(self.question), None)
+        self.assertEquals(state.get_answer_votes(), {})
+        self.assertEquals(state.get_comments(self.answers[0]), [self.comment])
+        self.assertEquals(state.get_comments(self.answers[1]), [])
+
+    def test_viewer_state_of_logged_in_user(self):
+        self.viewer.upvote(self.answers[0])
+        self.viewer.downvote(self.answers[2])
+        self.viewer.upvote(self.comment)
+        self.viewer.flag_post(self.answers[1], force = True)
+        self.viewer.toggle_favorite_question(self.question)
+
+        state = ViewerState(
+                    user = self.viewer,
+                    question = self.question,
+                    answers = self.answers
+                )
+        self.assertEquals(
+            state.get_answer_votes(),
+            {self.answers[0].id: 1, self.answers[2].id: -1}
+        )
+        self.assertTrue(state.is_favorite)
+        self.assertTrue(state.has_flagged(self.answers[1]))
+        self.assertFalse(state.has_flagged(self.answers[0]))
+        self.assertTrue(self.answers[1].is_flagged_by(self.viewer))
+        comments = state.get_comments(self.answers[0])
+        self.assertTrue(comments[0].upvoted_by_user)
+
+class ViewCounterTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.question = self.post_question()
+        self.counter = ViewCounter()
+
+    def test_views_are_saved_on_flush(self):
+        for i in range(3):
+            self.counter.record_view(self.question)
+        self.assertEquals(self.reload_object(self.question).view_count, 0)
+        self.counter.flush()
+        self.assertEquals(self.reload_object(self.question).view_count, 3)
+
+    def test_latest_visit_is_saved_on_flush(self):
+        first_visit = datetime.datetime.now()
+        last_visit = first_visit + datetime.timedelta(1)
+        self.counter.record_visit(self.user, self.question, last_visit)
+        self.counter.record_visit(self.user, self.question, first_visit)
+        self.counter.flush()
+        question_view = models.QuestionView.objects.get(
+                                                who = self.user,
+                                                question = self.question
+                                            )
+        self.assertEquals(question_view.when, last_visit)
+
+    def test_visit_of_deleted_user_is_dropped(self):
+        other_user = self.create_user(username = 'other_user')
+        self.counter.record_visit(other_user, self.question, datetime.datetime.now())
+        self.counter.record_visit(self.user, self.question, datetime.datetime.now())
+        other_user.delete()
+        self.counter.flush()
+        self.assertEquals(
+            list(models.QuestionView.objects.values_list('who', flat = True)),
+            [self.user.id]
+        )
+
+    def test_counts_are_kept_when_saving_fails(self):
+        def save(view_counts, visits):
+            raise ValueError('database error')
+        self.counter.save = save
+        self.counter.record_view(self.question)
+        self.counter.flush()
+        del self.counter.save
+        self.counter.record_view(self.question)
+        self.counter.flush()
+        self.assertEquals(self.reload_object(self.question).view_count, 2)
+
+class LastSeenTrackerTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.tracker = LastSeenTracker()
+        self.now = datetime.datetime.now().replace(hour = 12)
+
+    def set_last_seen(self, timestamp, consecutive_days = 0):
+        self.user.last_seen = timestamp
+        self.user.consecutive_days_visit_count = consecutive_days
+        self.user.save()
+
+    def test_recent_visit_is_not_saved(self):
+        last_seen = self.now - datetime.timedelta(0, 10)
+        self.set_last_seen(last_seen)
+        self.tracker.record_visit(self.user, self.now)
+        self.tracker.flush()
+        self.assertEquals(self.reload_object(self.user).last_seen, last_seen)
+
+    def test_visits_are_saved_in_bulk(self):
+        self.set_last_seen(self.now - datetime.timedelta(0, 3600))
+        self.tracker.record_visit(self.user, self.now)
+        self.tracker.flush()
+        user = self.reload_object(self.user)
+        self.assertEquals(
+            user.last_seen,
+            self.now.replace(second = 0, microsecond = 0)
+        )
+
+    def test_first_visit_of_day_counts_consecutive_days(self):
+        self.set_last_seen(self.now - datetime.timedelta(1), 3)
+        self.tracker.record_visit(self.user, self.now)
+        user = self.reload_object(self.user)
+        self.assertEquals(user.consecutive_days_visit_count, 4)
+        self.assertEquals(user.last_seen, self.now)
+        #second visit on the same day is not counted
+        self.tracker.record_visit(user, self.now + datetime.timedelta(0, 600))
+        user = self.reload_object(self.user)
+        self.assertEquals(user.consecutive_days_visit_count, 4)
+
+
+class LastUpdateInfoTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'other_user')
+        self.question = self.post_question()
+        self.answer = self.post_answer(
+                                user = self.other_user,
+                                question = self.question
+                            )
+
+    def assert_last_update_is(self, who):
+        question = self.reload_object(self.question)
+        self.assertEquals(question.get_last_update_info()[1], who)
+        self.assertEquals(
+            question.get_last_update_info(),
+            question.compute_thread_update_info()
+        )
+
+    def test_answer_updates_question(self):
+        self.assert_last_update_is(self.other_user)
+
+    def test_comment_on_answer_updates_question(self):
+        self.user.post_comment(
+            parent_post = self.reload_object(self.answer),
+            body_text = 'comment on the answer'
+        )
+        answer = self.reload_object(self.answer)
+        self.assertEquals(answer.post_get_last_update_info()[1], self.user)
+        self.assert_last_update_is(self.user)
+
+
+class TagIndexTests(AskbotTestCase):
+    def setUp(self):
+        tag_index.invalidate()
+        self.create_user()
+        self.question = self.post_question(tags = 'one two three')
+        self.similar = self.post_question(tags = 'one two')
+        self.other = self.post_question(tags = 'three four')
+        self.post_question(tags = 'five')
+
+    def get_tag_counts(self, tag_names = (), **kwargs):
+        tag_counts = tag_index.get_related_tags(tag_names, **kwargs)
+        tags = models.Tag.objects.filter(id__in = tag_counts.keys())
+        return dict([(tag.name, tag_counts[tag.id]) for tag in tags])
+
+    def test_similar_questions(self):
+        similar_questions = tag_index.get_similar_questions(self.question.id)
+        self.assertEquals(
+            similar_questions,
+            [(self.similar.id, 2), (self.other.id, 1)]
+        )
+
+    def test_related_tags(self):
+        self.assertEquals(
+            self.get_tag_counts(['one']),
+            {'one': 2, 'two': 2, 'three': 1}
+        )
+        self.assertEquals(
+            self.get_tag_counts(['three'], none_of = [self.question.tags.get(name = 'one').id]),
+            {'three': 1, 'four': 1}
+        )
+        self.assertEquals(self.get_tag_counts()['one'], 2)
+
+    def test_retag_and_delete_update_index(self):
+        self.user.retag_question(question = self.similar, tags = 'two four')
+        self.assertEquals(
+            self.get_tag_counts(['four']),
+            {'two': 1, 'three': 1, 'four': 2}
+        )
+        self.user.delete_question(self.other)
+        self.assertEquals(
+            self.get_tag_counts(['four']),
+            {'two': 1, 'four': 1}
+        )
+        self.user.restore_post(self.other)
+        self.assertEquals(self.get_tag_counts(['four'])['four'], 2)
+
+    def test_changes_are_applied_without_rebuild(self):
+        self.get_tag_counts(['four'])
+        build_time = tag_index.TAG_INDEX.build_time
+        self.user.retag_question(question = self.similar, tags = 'two four')
+        self.assertEquals(
+            self.get_tag_counts(['four']),
+            {'two': 1, 'three': 1, 'four': 2}
+        )
+        self.assertEquals(tag_index.TAG_INDEX.build_time, build_time)
+
+
+class BulkRetagTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        self.question1 = self.post_question(tags = 'one two')
+        self.question2 = self.post_question(tags = 'one')
+        self.question3 = self.post_question(tags = 'three')
+
+    def get_tag_update_activity_count(self):
+        return models.Activity.objects.filter(
+                            activity_type = const.TYPE_ACTIVITY_UPDATE_TAGS
+                        ).count()
+
+    def test_retag_questions(self):
+        #posting of the questions records tag updates too
+        activity_count = self.get_tag_update_activity_count()
+        bulk_retag.retag_questions(
+                    question_ids = [self.question1.id, self.question2.id],
+                    from_tags = [models.Tag.objects.get(name = 'one')],
+                    to_tags = [models.Tag.objects.get(name = 'three')],
+                    user = self.user,
+                    record_activity = True,
+                    chunk_size = 1
+                )
+        question1 = self.reload_object(self.question1)
+        self.assertEquals(question1.tagnames, 'two three')
+        self.assertEquals(
+            set(question1.tags.values_list('name', flat = True)),
+            set(['two', 'three'])
+        )
+        self.assertEquals(self.reload_object(self.question2).tagnames, 'three')
+
+        revision = question1.get_latest_revision()
+        self.assertEquals(revision.revision, 2)
+        self.assertEquals(revision.tagnames, 'two three')
+        self.assertEquals(revision.author, self.user)
+
+        self.assertEquals(models.Tag.objects.filter(name = 'one').count(), 0)
+        self.assertEquals(models.Tag.objects.get(name = 'three').used_count, 3)
+        self.assertEquals(
+            self.get_tag_update_activity_count(),
+            activity_count + 1
+        )
@@ -1,11 +1,13 @@
 import datetime
 import functools
 import copy
+import smtplib
 import time
 from django.conf import settings as django_settings
 from django.core import management
 from django.core import serializers
 import django.core.mail
+from django.core.mail.backends.base import BaseEmailBackend
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
@@ -106,6 +108,61 @@ class SubjectLineTests(TestCase):
         subj = mail.prefix_the_subject_line('hahah')
         self.assertEquals(subj, 'hahah')
 
+class FlakyEmailBackend(BaseEmailBackend):
+    """email backend failing to send first
+    ``failure_count`` messages with the ``error``"""
+    failure_count = 0
+    error = None
+    sent_messages = list()
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failure_count > 0:
+            FlakyEmailBackend.failure_count -= 1
+            raise FlakyEmailBackend.error
+        FlakyEmailBackend.sent_messages.extend(messages)
+        return len(messages)
+
+class MailSenderTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.sent_messages = list()
+        self.sender = mail.MailSender(
+            backend = 'askbot.tests.email_alert_tests.FlakyEmailBackend',
+            retry_delay = 0
+        )
+
+    def make_messages(self, count):
+        return [
+            mail.make_message(
+                subject_line = 'message %d' % number,
+                body_text = 'text',
+                recipient_list = ['user%d@example.com' % number]
+            ) for number in range(count)
+        ]
+
+    def test_transient_failure_is_retried(self):
+        FlakyEmailBackend.failure_count = 2
+        FlakyEmailBackend.error = smtplib.SMTPServerDisconnected('bye')
+        self.assertEquals(self.sender.send(self.make_messages(1)), 1)
+        self.assertEquals(len(FlakyEmailBackend.sent_messages), 1)
+
+    def test_permanent_failure_is_not_retried(self):
+        FlakyEmailBackend.failure_count = 1
+        FlakyEmailBackend.error = smtplib.SMTPDataError(550, 'rejected')
+        self.assertEquals(self.sender.send(self.make_messages(2)), 1)
+        self.assertEquals(self.sender.failed_count, 1)
+
+    def test_connection_pool_sends_all_messages(self):
+        FlakyEmailBackend.failure_count = 0
+        self.sender.pool_size = 3
+        self.assertEquals(self.sender.send(self.make_messages(10)), 10)
+        subjects = [message.subject for message in FlakyEmailBackend.sent_messages]
+        self.assertEquals(len(set(subjects)), 10)
+
+    def test_render_messages_keeps_order(self):
+        render = lambda number: number % 3 and number or None
+        results = mail.render_messages(render, range(10), worker_count = 3)
+        self.assertEquals(results, [1, 2, 4, 5, 7, 8])
+
 class EmailAlertTests(TestCase):
     """Base class for testing delayed Email notifications 
     that are triggered by the send_email_alerts
@@ -810,6 +867,66 @@ class TagFollowedInstantWholeForumEmailAlertTests(utils.AskbotTestCase):
             self.user1.email in outbox[0].recipients()
         )
 
+class ChunkedDigestTests(utils.AskbotTestCase):
+    """digests must not depend on how users
+    are split into chunks by the send_email_alerts command
+    """
+    def setUp(self):
+        long_ago = datetime.datetime.now() - datetime.timedelta(10)
+        schedule = copy.deepcopy(models.EmailFeedSetting.NO_EMAIL_SCHEDULE)
+        schedule['q_ask'] = 'd'
+        self.create_user(
+            username = 'asker1',
+            notification_schedule = schedule,
+            date_joined = long_ago
+        )
+        self.create_user(
+            username = 'asker2',
+            notification_schedule = schedule,
+            date_joined = long_ago
+        )
+        self.create_user(username = 'answerer')
+        timestamp = datetime.datetime.now() - datetime.timedelta(2)
+        self.question1 = self.post_question(
+                                    user = self.asker1,
+                                    title = 'first question',
+                                    timestamp = timestamp
+                                )
+        self.question2 = self.post_question(
+                                    user = self.asker2,
+                                    title = 'second question',
+                                    timestamp = timestamp
+                                )
+        for question in (self.question1, self.question2):
+            self.post_answer(
+                user = self.answerer,
+                question = question,
+                timestamp = timestamp
+            )
+
+    def assert_digests_sent(self, chunk_size):
+        management.call_command('send_email_alerts', chunk_size = chunk_size)
+        outbox = django.core.mail.outbox
+        self.assertEqual(len(outbox), 2)
+        recipients = [message.recipients() for message in outbox]
+        self.assertEqual(
+            sorted(recipients),
+            [[self.asker1.email], [self.asker2.email]]
+        )
+        self.assertTrue(self.question1.title in outbox[0].body)
+        self.assertTrue(self.question2.title in outbox[1].body)
+
+    def test_one_user_per_chunk(self):
+        self.assert_digests_sent(1)
+
+    def test_all_users_in_one_chunk(self):
+        self.assert_digests_sent(100)
+
+    def test_digest_is_sent_once(self):
+        self.assert_digests_sent(100)
+        management.call_command('send_email_alerts')
+        self.assertEqual(len(django.core.mail.outbox), 2)
+
 class UnansweredReminderTests(utils.AskbotTestCase):
     def setUp(self):
         self.u1 = self.create_user(username = 'user1')
@@ -0,0 +1,54 @@
+from unittest import TestCase
+from askbot.utils import html
+
+class StreamingSanitizerTests(TestCase):
+
+    def assert_same_output(self, fragment):
+        self.assertEqual(
+            html.sanitize_html_streaming(fragment),
+            html.sanitize_html_with_dom(fragment)
+        )
+
+    def test_well_formed_fragment_is_streamed(self):
+        fragment = '<p>some <em>text</em> <a href="http://example.com" ' + \
+                    'title="x">link</a><br></p>\n<ul><li>one</li><li>two' + \
+                    '<ul><li>three</li></ul></li></ul><pre><code>a &lt; b' + \
+                    '</code></pre><img src="/a.png" alt="">'
+        self.assertNotEqual(html.get_streamed_tokens(fragment), None)
+        self.assert_same_output(fragment)
+
+    def test_disallowed_markup_is_escaped(self):
+        fragment = '<p onclick="x()">a<script>alert(1)</script>' + \
+                    '<!-- comment --><a href="javascript:x()">b</a></p>'
+        self.assertNotEqual(html.get_streamed_tokens(fragment), None)
+        self.assert_same_output(fragment)
+
+    def test_unclosed_elements(self):
+        fragment = '<div><p>text <strong>strong'
+        self.assertNotEqual(html.get_streamed_tokens(fragment), None)
+        self.assert_same_output(fragment)
+
+    def test_fragments_changed_by_tree_builder_fall_back(self):
+        fragments = (
+            '<p>one<p>two',
+            '<p><div>block</div></p>',
+            '<em><strong>misnested</em></strong>',
+            '<ul><li>one<li>two</ul>',
+            '<a href="/a">one<a href="/b">two</a>',
+            '<table><tr><td>cell</td></tr></table>',
+            '<pre>\nnewline</pre>',
+            'text</div>',
+        )
+        for fragment in fragments:
+            self.assertEqual(html.get_streamed_tokens(fragment), None)
+            self.assert_same_output(fragment)
+
+    def test_unsupported_html5lib_falls_back(self):
+        fragment = '<p>some <em>text</em></p>'
+        old_value = html.STREAMING_IS_SUPPORTED
+        html.STREAMING_IS_SUPPORTED = False
+        try:
+            self.assertEqual(html.get_streamed_tokens(fragment), None)
+            self.assert_same_output(fragment)
+        finally:
+            html.STREAMING_IS_SUPPORTED = old_value
@@ -2,6 +2,8 @@ from django.core import management
 from django.contrib import auth
 from askbot.tests.utils import AskbotTestCase
 from askbot import models
+from askbot.conf import settings as askbot_settings
+from askbot.skins.loaders import get_skin
 
 class ManagementCommandTests(AskbotTestCase):
     def test_add_askbot_user(self):
@@ -27,3 +29,63 @@ class ManagementCommandTests(AskbotTestCase):
         #try to log in
         user = auth.authenticate(username = username, password = password)
         self.assertTrue(user is not None)
+
+    def test_render_revisions(self):
+        user = self.create_user()
+        question = self.post_question(user = user)
+        answer = self.post_answer(user = user, question = question)
+        user.edit_answer(answer = answer, body_text = 'edited answer text')
+        revisions = models.AnswerRevision.objects.filter(answer = answer)
+        expected = dict(
+            [(rev.revision, (rev.html, rev.diff)) for rev in revisions]
+        )
+        self.assertEquals(expected[1][1], None)
+        self.assertNotEquals(expected[2][1], None)
+
+        revisions.update(html = None, diff = None)
+        models.QuestionRevision.objects.update(html = None, diff = None)
+        management.call_command('render_revisions', verbosity = 0)
+
+        rendered = dict(
+            [(rev.revision, (rev.html, rev.diff)) for rev in revisions]
+        )
+        self.assertEquals(rendered, expected)
+        question_revision = models.QuestionRevision.objects.get(question = question)
+        self.assertEquals(question_revision.html, question_revision.as_html())
+
+    def test_fix_last_update_info(self):
+        user = self.create_user()
+        other_user = self.create_user(username = 'other_user')
+        other_user.reputation = askbot_settings.MIN_REP_TO_LEAVE_COMMENTS
+        other_user.save()
+        question = self.post_question(user = user)
+        answer = self.post_answer(user = user, question = question)
+        self.post_comment(user = other_user, parent_post = answer)
+        models.Question.objects.update(last_update_at = None, last_update_by = None)
+        models.Answer.objects.update(last_update_at = None, last_update_by = None)
+
+        management.call_command('fix_last_update_info')
+
+        question = self.reload_object(question)
+        self.assertNotEquals(question.last_update_at, None)
+        self.assertEquals(question.last_update_by, other_user)
+        self.assertEquals(self.reload_object(answer).last_update_by, other_user)
+
+    def test_fix_tag_use_counts(self):
+        user = self.create_user()
+        self.post_question(user = user, tags = 'one two')
+        self.post_question(user = user, tags = 'two')
+        models.Tag.objects.update(used_count = 5)
+
+        management.call_command('fix_tag_use_counts')
+
+        self.assertEquals(models.Tag.objects.get(name = 'one').used_count, 1)
+        self.assertEquals(models.Tag.objects.get(name = 'two').used_count, 2)
+
+    def test_precompile_templates(self):
+        skin = get_skin()
+        template_names = skin.list_skin_templates()
+        self.assertTrue('question.html' in template_names)
+        self.assertFalse('404.html' in template_names)
+        #exits with the status 1 if any template is not compiled
+        management.call_command('precompile_templates', verbosity = 0)
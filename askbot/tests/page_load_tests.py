@@ -321,3 +321,30 @@ class AvatarTests(AskbotTestCase):
                             'avatar_render_primary',
                             kwargs = {'user': 'john doe', 'size': 48}
                         )
+
+class QuestionPageLoadTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.create_user(username = 'other_user')
+        self.question = self.post_question()
+        self.answer = self.post_answer(question = self.question)
+        self.post_comment(parent_post = self.question)
+        self.post_comment(parent_post = self.answer)
+
+    def assert_question_page_loads(self):
+        response = self.client.get(self.question.get_absolute_url())
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, 'test answer text')
+        self.assertContains(response, 'test comment text')
+
+    def test_question_page_loads_for_anonymous_user(self):
+        self.assert_question_page_loads()
+
+    def test_question_page_loads_for_author(self):
+        self.client.login(method = 'force', user_id = self.user.id)
+        self.assert_question_page_loads()
+
+    def test_question_page_loads_for_other_user(self):
+        self.client.login(method = 'force', user_id = self.other_user.id)
+        self.assert_question_page_loads()
@@ -5,6 +5,8 @@ from askbot.tests import utils
 from askbot.conf import settings as askbot_settings
 from askbot import models
 from askbot.templatetags import extra_filters as template_filters
+from askbot.templatetags import extra_filters_jinja as jinja_filters
+from askbot.models import permission_matrix
 
 class PermissionAssertionTestCase(TestCase):
     """base TestCase class for permission
@@ -1551,3 +1553,77 @@ class UploadPermissionAssertionTests(PermissionAssertionTestCase):
             self.user.assert_can_upload_file()
         except exceptions.PermissionDenied:
             self.fail('high rep user must be able to upload')
+
+
+class PermissionMatrixTests(utils.AskbotTestCase):
+    """results of the permission matrix must be the same
+    as of the template filters based on the assertions"""
+
+    def setUp(self):
+        self.create_user(username = 'author')
+        self.create_user(username = 'answerer')
+        self.answerer.reputation = askbot_settings.MIN_REP_TO_LEAVE_COMMENTS
+        self.answerer.save()
+        self.question = self.post_question(user = self.author)
+        self.answer = self.post_answer(
+                                user = self.answerer,
+                                question = self.question
+                            )
+        self.question_comment = self.post_comment(
+                                user = self.answerer,
+                                parent_post = self.question
+                            )
+        self.answer_comment = self.post_comment(
+                                user = self.author,
+                                parent_post = self.answer
+                            )
+        self.question = self.reload_object(self.question)
+        self.answer = self.reload_object(self.answer)
+        self.viewers = [self.author, self.answerer]
+        for status in ('a', 'm', 's', 'b'):
+            self.viewers.append(
+                self.create_user(username = 'user_' + status, status = status)
+            )
+        high_rep_user = self.create_user(username = 'high_rep')
+        high_rep_user.reputation = 100000
+        high_rep_user.save()
+        self.viewers.append(high_rep_user)
+        admin = self.create_user(username = 'admin')
+        admin.set_admin_status()
+        admin.save()
+        self.viewers.append(admin)
+
+    def assert_matrix_matches_filters(self, viewer):
+        posts = [
+            self.question, self.answer,
+            self.question_comment, self.answer_comment
+        ]
+        matrix = permission_matrix.PermissionMatrix(viewer, posts)
+        for post in posts:
+            for capability in self.get_capabilities(post):
+                #filters registered with the decorator are
+                #not functions at the module level
+                filter_function = jinja_filters.register.jinja2_filters[
+                                                        'can_' + capability
+                                                    ]
+                self.assertEquals(
+                    matrix.can(capability, post),
+                    filter_function(viewer, post),
+                    '%s %s by %s' % (capability, post, viewer.username)
+                )
+
+    def get_capabilities(self, post):
+        if isinstance(post, models.Question):
+            return permission_matrix.QUESTION_CAPABILITIES
+        elif isinstance(post, models.Answer):
+            return permission_matrix.ANSWER_CAPABILITIES
+        return permission_matrix.COMMENT_CAPABILITIES
+
+    def test_matrix_matches_filters(self):
+        for viewer in self.viewers:
+            self.assert_matrix_matches_filters(viewer)
+
+    def test_matrix_matches_filters_for_low_rep_owners(self):
+        for viewer in self.viewers:
+            viewer.reputation = 1
+            self.assert_matrix_matches_filters(viewer)
@@ -0,0 +1,49 @@
+"""Tests of the built-in full text search backend
+"""
+import shutil
+import tempfile
+from askbot.tests.utils import AskbotTestCase
+from askbot.search.backends.local import LocalIndexSearchBackend
+from askbot import models
+
+class LocalIndexSearchTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.index_dir = tempfile.mkdtemp()
+        self.backend = LocalIndexSearchBackend(index_dir = self.index_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def search(self, search_query):
+        questions = self.backend.get_questions(
+                                    models.Question.objects.all(),
+                                    search_query
+                                )
+        return list(questions.extra(order_by = ['-relevance']))
+
+    def test_search_finds_text_of_answers_and_tags(self):
+        question = self.post_question(tags = 'kangaroo')
+        self.post_answer(question = question, body_text = 'zebras and lions')
+        self.post_question(title = 'another question')
+        self.backend.rebuild()
+        self.assertEquals(self.search('zebras'), [question])
+        self.assertEquals(self.search('Kangaroo'), [question])
+        self.assertEquals(self.search('zebras tigers'), [])
+
+    def test_index_is_updated_incrementally(self):
+        self.backend.rebuild()
+        question = self.post_question(title = 'unusual question title')
+        self.assertEquals(self.search('unusual'), [])
+        self.backend.update_question(question)
+        self.assertEquals(self.search('unusual'), [question])
+        #other processes read the update from the journal
+        other_backend = LocalIndexSearchBackend(index_dir = self.index_dir)
+        self.assertEquals(len(other_backend.search('unusual')), 1)
+
+    def test_title_match_ranks_higher(self):
+        text_match = self.post_question(body_text = 'about giraffes')
+        title_match = self.post_question(title = 'giraffes')
+        self.backend.rebuild()
+        self.assertEquals(self.search('giraffes'), [title_match, text_match])
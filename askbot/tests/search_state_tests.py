@@ -1,8 +1,18 @@
+import base64
 import re
 import unittest
+import datetime
 from django.test import TestCase
 from django.contrib.auth.models import AnonymousUser
+from django.http import HttpRequest
+from django.conf import settings as django_settings
+from django.contrib.sessions.models import Session
 from askbot.search.state_manager import SearchState, ViewLog, parse_query
+from askbot.search import paginator as search_paginator
+from askbot.search import state_storage
+from askbot.middleware.anon_user import ConnectToSessionMessagesMiddleware
+from askbot.tests.utils import AskbotTestCase
+from askbot import models
 from askbot import const
 
 DEFAULT_SORT = const.DEFAULT_POST_SORT_METHOD
@@ -67,6 +77,117 @@ class SearchStateTests(TestCase):
         self.assertEquals(self.state.sort, 'age-asc')
         self.update({})
         self.assertEquals(self.state.sort, DEFAULT_SORT)
+class SearchStateStorageTests(TestCase):
+    def setUp(self):
+        self.request = HttpRequest()
+        self.request.session = dict()
+
+    def test_search_state_survives_cookie(self):
+        state = SearchState()
+        state.update_from_user_input({'tags': set(['tag1', 'tag2'])})
+        state.update_from_user_input({'page': 3, 'cursor': '5_10'})
+        cookie_value = state_storage.encode_cookie(
+                                {'search_state': state.to_dict()}
+                            )
+        data = state_storage.decode_cookie(cookie_value)
+        loaded_state = SearchState()
+        loaded_state.update_from_dict(data['search_state'])
+        self.assertEquals(loaded_state.tags, set(['tag1', 'tag2']))
+        self.assertEquals(loaded_state.page, 3)
+        self.assertEquals(loaded_state.cursor, '5_10')
+
+    def test_tampered_cookie_is_ignored(self):
+        cookie_value = state_storage.encode_cookie({'view_log': ['questions']})
+        payload, signature = cookie_value.rsplit('.', 1)
+        tampered_payload = base64.urlsafe_b64encode('{"view_log": []}')
+        tampered_value = tampered_payload + '.' + signature
+        self.assertEquals(state_storage.decode_cookie(tampered_value), {})
+        self.assertEquals(state_storage.decode_cookie('junk'), {})
+
+    def test_unchanged_state_is_not_saved(self):
+        self.request.session['search_state'] = SearchState()
+        search_state = state_storage.load_search_state(self.request)
+        del self.request.session['search_state']
+        state_storage.save_search_state(self.request, search_state)
+        self.assertFalse('search_state' in self.request.session)
+
+        search_state.update_from_user_input({'sort': 'age-asc'})
+        state_storage.save_search_state(self.request, search_state)
+        self.assertTrue('search_state' in self.request.session)
+
+    def test_view_log_is_saved_when_changed(self):
+        view_log = state_storage.load_view_log(self.request)
+        view_log.set_current('questions')
+        state_storage.save_view_log(self.request, view_log)
+        self.assertEquals(
+            state_storage.load_view_log(self.request).views,
+            ['questions']
+        )
+
+    def test_greeting_is_not_stored_in_session_in_cookie_mode(self):
+        old_storage = getattr(
+                        django_settings,
+                        'ASKBOT_SEARCH_STATE_STORAGE',
+                        'session'
+                    )
+        django_settings.ASKBOT_SEARCH_STATE_STORAGE = 'cookie'
+        try:
+            self.request.user = AnonymousUser()
+            self.request.META['HTTP_ACCEPT_LANGUAGE'] = 'en'
+            self.request.META['HTTP_USER_AGENT'] = 'Mozilla/5.0 (X11) Gecko/20100101 Firefox/3.6'
+            ConnectToSessionMessagesMiddleware().process_request(self.request)
+            self.assertEquals(self.request.session, {})
+            self.assertEquals(
+                len(self.request.user.get_and_delete_messages()),
+                1
+            )
+            self.assertTrue(
+                state_storage.load_value(self.request, 'greeting_set')
+            )
+        finally:
+            django_settings.ASKBOT_SEARCH_STATE_STORAGE = old_storage
+
+
+class QuestionViewStorageTests(AskbotTestCase):
+
+    def setUp(self):
+        self.create_user()
+        self.question = self.post_question()
+        self.old_storage = getattr(
+                            django_settings,
+                            'ASKBOT_SEARCH_STATE_STORAGE',
+                            'session'
+                        )
+        django_settings.ASKBOT_SEARCH_STATE_STORAGE = 'cookie'
+
+    def tearDown(self):
+        django_settings.ASKBOT_SEARCH_STATE_STORAGE = self.old_storage
+
+    def test_view_time_is_not_stored_in_session_in_cookie_mode(self):
+        response = self.client.get(self.question.get_absolute_url())
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(Session.objects.count(), 0)
+        cookie_value = response.cookies[state_storage.COOKIE_NAME].value
+        view_times = state_storage.decode_cookie(cookie_value)['question_view_times']
+        self.assertEquals(view_times.keys(), [str(self.question.id)])
+
+    def test_view_times_of_latest_questions_are_kept_in_cookie(self):
+        request = HttpRequest()
+        view_time = datetime.datetime(2011, 1, 1)
+        max_views = state_storage.MAX_COOKIE_QUESTION_VIEWS
+        for question_id in range(max_views + 1):
+            view_time += datetime.timedelta(1)
+            state_storage.save_question_view_time(request, question_id, view_time)
+        self.assertEquals(
+            state_storage.load_question_view_time(request, max_views),
+            view_time
+        )
+        self.assertEquals(
+            state_storage.load_question_view_time(request, 0),
+            None
+        )
+
+
 class ParseQueryTests(unittest.TestCase):
     def test_extract_users(self):
         text = '@anna haha @"maria fernanda" @\'diego maradona\' hehe [user:karl  marx] hoho  user:\' george bush  \''
@@ -105,3 +226,54 @@ class ParseQueryTests(unittest.TestCase):
         text = 'some query text'
         parse_results = parse_query(text)
         self.assertEquals(parse_results['stripped_query'], 'some query text')
+
+class KeysetPaginationTests(AskbotTestCase):
+    def setUp(self):
+        self.create_user()
+        timestamp = datetime.datetime.now()
+        #same timestamp, so that question id has to break the ties
+        self.questions = [
+            self.post_question(title = 'question %d' % num, timestamp = timestamp)
+            for num in range(5)
+        ]
+        self.state = SearchState()
+        self.state.sort = 'age-desc'
+        self.state.page_size = 2
+
+    def get_page(self):
+        (qs, meta_data, related_tags) = \
+            models.Question.objects.run_advanced_search(
+                                        request_user = AnonymousUser(),
+                                        search_state = self.state
+                                    )
+        return search_paginator.get_page(qs, search_state = self.state)
+
+    def test_cursor_pages_match_numbered_pages(self):
+        numbered_pages = list()
+        for page_number in (1, 2, 3):
+            self.state.page = page_number
+            numbered_pages.append(list(self.get_page().object_list))
+
+        self.state.page = 1
+        page = self.get_page()
+        cursor_pages = [list(page.object_list)]
+        while page.has_next():
+            cursor = search_paginator.get_next_cursor(page, self.state.sort)
+            self.state.update_from_user_input(
+                                {'page': page.number + 1, 'cursor': cursor}
+                            )
+            page = self.get_page()
+            cursor_pages.append(list(page.object_list))
+
+        self.assertEquals(cursor_pages, numbered_pages)
+        self.assertEquals(page.paginator.count, 5)
+
+    def test_malformed_cursor_falls_back_to_page_number(self):
+        self.state.update_from_user_input({'page': 2, 'cursor': '123_junk'})
+        self.assertEquals(len(self.get_page().object_list), 2)
+
+    def test_cursor_is_reset_with_the_page(self):
+        self.state.update_from_user_input({'page': 2, 'cursor': '1_1'})
+        self.state.update_from_user_input({'sort': 'votes-desc'})
+        self.assertEquals(self.state.page, 1)
+        self.assertEquals(self.state.cursor, None)
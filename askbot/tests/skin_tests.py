@@ -1,11 +1,14 @@
 import os
 import shutil
+import jinja2
 from django.test import TestCase
+from django.core.cache import cache
 from django.core.files.uploadedfile import UploadedFile
 from django.conf import settings as django_settings
 from askbot.conf import settings as askbot_settings
 from askbot.utils.path import mkdir_p
 from askbot.skins import utils as skin_utils
+from askbot.skins import loaders
 import askbot
 
 class SkinTests(TestCase):
@@ -72,3 +75,56 @@ class SkinTests(TestCase):
                 )
         response = self.client.get(logo_url)
         self.assertTrue(response.status_code == 200)
+
+    def test_media_manifest_prefers_selected_skin(self):
+        manifest = skin_utils.MediaManifest()
+        logo_url = manifest.get_url('images/logo.gif', 'test_skin', 3)
+        self.assertTrue('/test_skin/media/images/logo.gif?v=3' in logo_url)
+        style_url = manifest.get_url('style/style.css', 'test_skin', 3)
+        self.assertTrue('/default/media/style/style.css?v=3' in style_url)
+        self.assertEquals(manifest.get_url('images/none.gif', 'test_skin', 3), None)
+
+    def test_media_fingerprints(self):
+        old_setting = getattr(django_settings, 'ASKBOT_MEDIA_FINGERPRINTS', False)
+        django_settings.ASKBOT_MEDIA_FINGERPRINTS = True
+        try:
+            manifest = skin_utils.MediaManifest()
+            url = manifest.get_url('images/logo.gif', 'test_skin', 3)
+        finally:
+            django_settings.ASKBOT_MEDIA_FINGERPRINTS = old_setting
+        logo_path = os.path.join(
+                            askbot.get_install_directory(),
+                            'tests',
+                            'images',
+                            'logo.gif'
+                        )
+        fingerprint = skin_utils.get_file_fingerprint(logo_path)
+        self.assertTrue(url.endswith('?v=' + fingerprint))
+
+
+class BytecodeCacheTests(TestCase):
+
+    def test_template_is_compiled_into_django_cache(self):
+        bytecode_cache = loaders.DjangoCacheBytecodeCache()
+        source = u'hello {{ name }}'
+        template_loader = jinja2.DictLoader({'hello.html': source})
+        environment = jinja2.Environment(
+                                loader = template_loader,
+                                bytecode_cache = bytecode_cache
+                            )
+        template = environment.get_template('hello.html')
+        self.assertEquals(template.render(name = 'world'), u'hello world')
+
+        bucket = bytecode_cache.get_bucket(
+                                environment, 'hello.html', None, source
+                            )
+        self.assertNotEqual(bucket.code, None)
+        self.assertNotEqual(cache.get(bytecode_cache.make_cache_key(bucket)), None)
+
+        #another environment loads the compiled template from the cache
+        environment = jinja2.Environment(
+                                loader = template_loader,
+                                bytecode_cache = bytecode_cache
+                            )
+        template = environment.get_template('hello.html')
+        self.assertEquals(template.render(name = 'again'), u'hello again')
@@ -164,6 +164,11 @@ urlpatterns = patterns('',
         views.commands.get_tags_by_wildcard,
         name = 'get_tags_by_wildcard'
     ),
+    url(
+        r'^get-tags-by-prefix/',
+        views.commands.get_tags_by_prefix,
+        name = 'get_tags_by_prefix'
+    ),
     url(
         r'^get-tag-list/',
         views.commands.get_tag_list,
@@ -1,7 +1,10 @@
-"""Utilities for working with Django Models."""
+"""Utilities for working with Django Models
+and with the shared cache."""
 import itertools
+import time
 
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 
 from askbot.utils.lists import flatten
 
@@ -90,3 +93,75 @@ def populate_content_object_caches(generic_related_objects, model_fields=None):
     for obj in generic_related_objects:
         obj._object_cache = objects[obj.content_type_id][obj.object_id]
         obj._content_type_cache = content_types[obj.content_type_id]
+
+#version counters live long, but if one is evicted
+#it is re-seeded from the clock, see get_cache_version()
+VERSION_KEY_TIMEOUT = 30*24*3600 - 1
+
+def get_cache_version(key):
+    """returns value of the version counter stored
+    in the shared cache under the ``key``
+
+    Version counters are used to invalidate whole groups
+    of cache entries at once: version is made part of the
+    keys of the entries, so when the counter is bumped
+    the old entries are simply never read again.
+
+    A missing counter is seeded with the current time
+    in milliseconds, so that entries stored under
+    an evicted counter cannot be resurrected.
+    """
+    version = cache.get(key)
+    if version is None:
+        version = int(time.time() * 1000)
+        cache.add(key, version, VERSION_KEY_TIMEOUT)
+        #another process might have seeded the counter first
+        version = cache.get(key, version)
+    return version
+
+def bump_cache_version(key):
+    """increments the version counter stored under ``key``
+    and returns the new value
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        #counter is not in the cache - seed a new one
+        return get_cache_version(key)
+
+#processes lagging behind by more changes reload the versioned data
+MAX_CHANGE_LOG_LENGTH = 100
+
+def get_change_key(key, version):
+    return '%s-change-%d' % (key, version)
+
+def record_change(key, change):
+    """bumps the version counter stored under ``key``
+    and saves the ``change`` for the new version, so that
+    the processes keeping a copy of the versioned data
+    can apply the changes instead of reloading the data,
+    see :func:`get_changes`
+    """
+    version = bump_cache_version(key)
+    cache.set(get_change_key(key, version), change, VERSION_KEY_TIMEOUT)
+    return version
+
+def get_changes(key, old_version, new_version):
+    """returns list of the changes recorded with :func:`record_change`
+    after the ``old_version`` up to the ``new_version``, in order,
+    or ``None`` if some of the changes are not available - the counter
+    was bumped without a change, the changes were evicted from the cache
+    or there are more than ``MAX_CHANGE_LOG_LENGTH`` of them
+    """
+    if old_version is None or new_version <= old_version:
+        return None
+    if new_version - old_version > MAX_CHANGE_LOG_LENGTH:
+        return None
+    change_keys = [
+        get_change_key(key, version)
+        for version in range(old_version + 1, new_version + 1)
+    ]
+    changes = cache.get_many(change_keys)
+    if len(changes) != len(change_keys):
+        return None
+    return [changes[change_key] for change_key in change_keys]
@@ -1,7 +1,22 @@
-"""Utilities for working with HTML."""
+"""Utilities for working with HTML.
+
+:func:`sanitize_html` has two modes. By default the fragment is parsed
+into a DOM tree by html5lib, which is walked and serialized again.
+With the django setting ``ASKBOT_STREAMING_HTML_SANITIZER = True``
+sanitized tokens are passed from the tokenizer straight to the serializer.
+Fragments which the html5lib tree builder would change - misnested
+or implicitly closed elements, tables etc. - are detected on the way
+and sanitized with the DOM tree, so the output of the two modes is the same.
+The streaming mode needs html5lib older than 0.95, with the later versions
+all fragments are sanitized with the DOM tree.
+"""
 import html5lib
 from html5lib import sanitizer, serializer, tokenizer, treebuilders, treewalkers
+from html5lib.constants import namespaces, tokenTypes, voidElements
+#base tree walker makes tokens in the format expected by the serializer
+from html5lib.treewalkers._base import TreeWalker
 import re, htmlentitydefs
+from django.conf import settings as django_settings
 
 class HTMLSanitizerMixin(sanitizer.HTMLSanitizerMixin):
     acceptable_elements = ('a', 'abbr', 'acronym', 'address', 'b', 'big',
@@ -20,11 +35,12 @@ class HTMLSanitizerMixin(sanitizer.HTMLSanitizerMixin):
         'span', 'src', 'start', 'summary', 'title', 'type', 'valign', 'vspace',
         'width')
 
-    allowed_elements = acceptable_elements
-    allowed_attributes = acceptable_attributes
-    allowed_css_properties = ()
-    allowed_css_keywords = ()
-    allowed_svg_properties = ()
+    #sets make the membership tests in sanitize_token() fast
+    allowed_elements = frozenset(acceptable_elements)
+    allowed_attributes = frozenset(acceptable_attributes)
+    allowed_css_properties = frozenset()
+    allowed_css_keywords = frozenset()
+    allowed_svg_properties = frozenset()
 
 class HTMLSanitizer(tokenizer.HTMLTokenizer, HTMLSanitizerMixin):
     def __init__(self, stream, encoding=None, parseMeta=True, useChardet=True,
@@ -39,18 +55,146 @@ class HTMLSanitizer(tokenizer.HTMLTokenizer, HTMLSanitizerMixin):
             if token:
                 yield token
 
-def sanitize_html(html):
-    """Sanitizes an HTML fragment."""
+HEADING_ELEMENTS = frozenset(('h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+
+TABLE_ELEMENTS = frozenset((
+    'caption', 'col', 'colgroup', 'table', 'tbody', 'td', 'tfoot',
+    'th', 'thead', 'tr'
+))
+
+#start tags of these elements close an open paragraph
+PARAGRAPH_CLOSING_ELEMENTS = HEADING_ELEMENTS | frozenset((
+    'address', 'blockquote', 'center', 'dd', 'dir', 'div', 'dl', 'dt',
+    'hr', 'li', 'ol', 'p', 'pre', 'ul'
+))
+
+#search for an open list item to close stops at these elements
+LIST_ITEM_SCOPE_ELEMENTS = HEADING_ELEMENTS | frozenset((
+    'blockquote', 'center', 'dd', 'dir', 'dl', 'dt', 'li', 'object',
+    'ol', 'pre', 'ul'
+))
+
+LIST_ITEM_ELEMENTS = {
+    'li': frozenset(('li',)),
+    'dd': frozenset(('dd', 'dt')),
+    'dt': frozenset(('dd', 'dt')),
+}
+
+HTML_NAMESPACE = namespaces['html']
+
+def closes_open_element(name, open_elements):
+    """True if the tree builder would implicitly close
+    or rearrange some of the open elements on the start tag ``name``,
+    errs on the side of True
+    """
+    if name in TABLE_ELEMENTS:
+        return True
+    if name == 'a' and 'a' in open_elements:
+        return True
+    if name in PARAGRAPH_CLOSING_ELEMENTS and 'p' in open_elements:
+        return True
+    if name in HEADING_ELEMENTS and HEADING_ELEMENTS.intersection(open_elements):
+        return True
+    if name in LIST_ITEM_ELEMENTS:
+        closed_elements = LIST_ITEM_ELEMENTS[name]
+        for open_name in reversed(open_elements):
+            if open_name in closed_elements:
+                return True
+            if open_name in LIST_ITEM_SCOPE_ELEMENTS:
+                break
+    return False
+
+def walker_accepts_plain_attributes():
+    """tree walkers of html5lib 0.95 and later expect attributes
+    keyed by (namespace, name) tuples instead of the names"""
+    try:
+        TreeWalker(None).startTag(HTML_NAMESPACE, 'a', {'href': u''})
+    except ValueError:
+        return False
+    return True
+
+STREAMING_IS_SUPPORTED = walker_accepts_plain_attributes()
+
+def get_streamed_tokens(html):
+    """returns list of serializer tokens of the sanitized
+    fragment, the same as the DOM tree walker would produce,
+    or None if the fragment must be sanitized with the DOM tree
+    """
+    if not STREAMING_IS_SUPPORTED:
+        return None
+    walker = TreeWalker(None)
+    tokens = list()
+    open_elements = list()
+    after_newline_eating_tag = False
+    for token in HTMLSanitizer(html):
+        token_type = token['type']
+        if token_type == tokenTypes['ParseError']:
+            continue#tree builder ignores these
+        elif token_type in (tokenTypes['Characters'], tokenTypes['SpaceCharacters']):
+            #tree builder drops newline right after <pre>
+            if after_newline_eating_tag and token['data'].startswith('\n'):
+                return None
+            tokens.extend(walker.text(token['data']))
+        elif token_type == tokenTypes['StartTag']:
+            name = token['name']
+            if closes_open_element(name, open_elements):
+                return None
+            #attributes are put into a dict twice - by the parser
+            #and by the minidom element, keep the same item order
+            attributes = dict(token['data'][::-1])
+            attributes = dict(attributes.items())
+            if name in voidElements:
+                tokens.extend(walker.emptyTag(HTML_NAMESPACE, name, attributes))
+            else:
+                tokens.append(walker.startTag(HTML_NAMESPACE, name, attributes))
+                open_elements.append(name)
+        elif token_type == tokenTypes['EndTag']:
+            if not open_elements or open_elements[-1] != token['name']:
+                return None
+            open_elements.pop()
+            tokens.append(walker.endTag(HTML_NAMESPACE, token['name']))
+        else:
+            return None
+        after_newline_eating_tag = (
+                            token_type == tokenTypes['StartTag'] \
+                            and token['name'] == 'pre'
+                        )
+
+    #elements left open are closed at the end of the fragment
+    for name in reversed(open_elements):
+        tokens.append(walker.endTag(HTML_NAMESPACE, name))
+    return tokens
+
+def get_serializer():
+    return serializer.HTMLSerializer(omit_optional_tags=False,
+                                     quote_attr_values=True)
+
+def sanitize_html_with_dom(html):
+    """Sanitizes an HTML fragment, using the DOM tree."""
     p = html5lib.HTMLParser(tokenizer=HTMLSanitizer,
                             tree=treebuilders.getTreeBuilder("dom"))
     dom_tree = p.parseFragment(html)
     walker = treewalkers.getTreeWalker("dom")
     stream = walker(dom_tree)
-    s = serializer.HTMLSerializer(omit_optional_tags=False,
-                                  quote_attr_values=True)
+    s = get_serializer()
     output_generator = s.serialize(stream)
     return u''.join(output_generator)
 
+def sanitize_html_streaming(html):
+    """Sanitizes an HTML fragment without building the DOM tree,
+    where the tree builder would change the fragment
+    falls back to :func:`sanitize_html_with_dom`"""
+    tokens = get_streamed_tokens(html)
+    if tokens is None:
+        return sanitize_html_with_dom(html)
+    return u''.join(get_serializer().serialize(tokens))
+
+def sanitize_html(html):
+    """Sanitizes an HTML fragment."""
+    if getattr(django_settings, 'ASKBOT_STREAMING_HTML_SANITIZER', False):
+        return sanitize_html_streaming(html)
+    return sanitize_html_with_dom(html)
+
 def unescape(text):
     """source: http://effbot.org/zone/re-sub.htm#unescape-html
     Removes HTML or XML character references and entities from a text string.
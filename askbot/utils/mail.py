@@ -1,9 +1,31 @@
 """functions that send email in askbot
 these automatically catch email-related exceptions
+
+batches of messages are delivered by :class:`MailSender`
+over a pool of persistent connections, configured with
+django settings:
+
+* ``ASKBOT_EMAIL_BACKEND`` - dotted path to the email backend class,
+  by default django's ``EMAIL_BACKEND`` is used
+* ``ASKBOT_EMAIL_CONNECTION_POOL_SIZE`` - number of connections
+  used in parallel, 1 by default
+* ``ASKBOT_EMAIL_RATE_LIMIT`` - maximum number of messages
+  sent per second, 0 (default) - no limit
+* ``ASKBOT_EMAIL_MAX_RETRIES`` - number of attempts to resend a message
+  after a transient failure, 3 by default
+* ``ASKBOT_EMAIL_RETRY_DELAY`` - seconds to wait before the first retry,
+  1 by default, the delay doubles with every next attempt
+* ``ASKBOT_EMAIL_RENDER_WORKERS`` - number of threads
+  rendering messages in :func:`render_messages`, 1 by default
 """
+import Queue
 import smtplib
+import socket
 import logging
+import threading
+import time
 from django.core import mail
+from django.db import connection as db_connection
 from django.conf import settings as django_settings
 from askbot.conf import settings as askbot_settings
 from askbot import exceptions
@@ -31,6 +53,25 @@ def extract_first_email_address(text):
     else:
         return None
 
+def make_message(
+            subject_line = None,
+            body_text = None,
+            recipient_list = None,
+            headers = None
+        ):
+    """returns html email message ready to be sent,
+    with the subject line prefixed"""
+    prefix = askbot_settings.EMAIL_SUBJECT_PREFIX.strip() + ' '
+    msg = mail.EmailMessage(
+                    prefix + subject_line,
+                    body_text,
+                    django_settings.DEFAULT_FROM_EMAIL,
+                    recipient_list,
+                    headers = headers
+                )
+    msg.content_subtype = 'html'
+    return msg
+
 def send_mail(
             subject_line = None,
             body_text = None,
@@ -53,18 +94,14 @@ def send_mail(
 
     if raise_on_failure is True, exceptions.EmailNotSent is raised
     """
-    prefix = askbot_settings.EMAIL_SUBJECT_PREFIX.strip() + ' '
     try:
         assert(subject_line is not None)
-        subject_line = prefix + subject_line
-        msg = mail.EmailMessage(
-                        subject_line, 
-                        body_text, 
-                        django_settings.DEFAULT_FROM_EMAIL,
-                        recipient_list,
+        msg = make_message(
+                        subject_line = subject_line,
+                        body_text = body_text,
+                        recipient_list = recipient_list,
                         headers = headers
                     )
-        msg.content_subtype = 'html'
         msg.send()
         if related_object is not None:
             assert(activity_type is not None)
@@ -99,3 +136,225 @@ def mail_moderators(
         logging.critical(unicode(error))
         if raise_on_failure == True:
             raise exceptions.EmailNotSent(unicode(error))
+
+def is_transient_error(error):
+    """True if sending may succeed when retried after the error"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(error, (
+                    smtplib.SMTPServerDisconnected,
+                    smtplib.SMTPConnectError,
+                    socket.error
+                )):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+class RateLimiter(object):
+    """lets callers of :meth:`wait` proceed no more often
+    than ``rate`` times per second, in all threads together,
+    ``rate`` of 0 means no limit
+    """
+    def __init__(self, rate = 0):
+        if rate:
+            self.interval = 1.0 / rate
+        else:
+            self.interval = 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if self.interval == 0:
+            return
+        self.lock.acquire()
+        try:
+            now = time.time()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        finally:
+            self.lock.release()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class MailSender(object):
+    """sends batches of prepared email messages,
+    parameters not given are read from the django settings,
+    listed in the module docstring
+
+    each worker thread keeps its connection open for all messages
+    it sends, messages that fail with transient errors are retried
+    on a new connection, other failures are logged as critical
+    """
+    def __init__(
+                self,
+                backend = None,
+                pool_size = None,
+                rate_limit = None,
+                max_retries = None,
+                retry_delay = None,
+                **connection_kwargs
+            ):
+        if backend is None:
+            backend = getattr(django_settings, 'ASKBOT_EMAIL_BACKEND', None)
+        if pool_size is None:
+            pool_size = getattr(
+                        django_settings, 'ASKBOT_EMAIL_CONNECTION_POOL_SIZE', 1
+                    )
+        if rate_limit is None:
+            rate_limit = getattr(django_settings, 'ASKBOT_EMAIL_RATE_LIMIT', 0)
+        if max_retries is None:
+            max_retries = getattr(django_settings, 'ASKBOT_EMAIL_MAX_RETRIES', 3)
+        if retry_delay is None:
+            retry_delay = getattr(django_settings, 'ASKBOT_EMAIL_RETRY_DELAY', 1)
+        self.backend = backend
+        self.pool_size = max(pool_size, 1)
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.connection_kwargs = connection_kwargs
+        self.lock = threading.Lock()
+        self.sent_count = 0
+        self.failed_count = 0
+
+    def open_connection(self):
+        connection = mail.get_connection(
+                            self.backend,
+                            fail_silently = False,
+                            **self.connection_kwargs
+                        )
+        connection.open()
+        return connection
+
+    def close_connection(self, connection):
+        try:
+            connection.close()
+        except Exception, error:
+            logging.debug('error closing email connection: %s' % error)
+
+    def send(self, messages):
+        """sends the messages, returns number of messages sent"""
+        message_queue = Queue.Queue()
+        for message in messages:
+            message_queue.put(message)
+        sent_count_before = self.sent_count
+
+        worker_count = min(self.pool_size, message_queue.qsize())
+        if worker_count == 1:
+            self.run_worker(message_queue)
+        elif worker_count > 1:
+            workers = list()
+            for i in range(worker_count):
+                worker = threading.Thread(
+                                target = self.run_worker,
+                                args = (message_queue,)
+                            )
+                worker.start()
+                workers.append(worker)
+            for worker in workers:
+                worker.join()
+
+        return self.sent_count - sent_count_before
+
+    def run_worker(self, message_queue):
+        connection = None
+        try:
+            while True:
+                try:
+                    message = message_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                connection = self.deliver(message, connection)
+        finally:
+            if connection is not None:
+                self.close_connection(connection)
+
+    def deliver(self, message, connection = None):
+        """sends one message, retries it on transient errors,
+        returns connection to be used for the next message"""
+        attempt = 0
+        while True:
+            try:
+                if connection is None:
+                    connection = self.open_connection()
+                self.rate_limiter.wait()
+                connection.send_messages([message])
+                self.add_count('sent_count')
+                return connection
+            except Exception, error:
+                if connection is not None:
+                    self.close_connection(connection)
+                    connection = None
+                if attempt < self.max_retries and is_transient_error(error):
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                    attempt += 1
+                    continue
+                logging.critical(
+                    'could not send email to %s: %s' \
+                    % (', '.join(message.recipients()), unicode(error))
+                )
+                self.add_count('failed_count')
+                return None
+
+    def add_count(self, name):
+        self.lock.acquire()
+        try:
+            setattr(self, name, getattr(self, name) + 1)
+        finally:
+            self.lock.release()
+
+
+def send_messages(messages):
+    """sends prepared messages with the :class:`MailSender`
+    configured by the django settings,
+    returns number of messages sent"""
+    return MailSender().send(messages)
+
+def render_messages(render, items, worker_count = None):
+    """returns list of the values of the function ``render``
+    called for each of the items, except ``None`` values,
+    in the order of the items
+
+    with ``worker_count`` (by default - ``ASKBOT_EMAIL_RENDER_WORKERS``)
+    above 1 the function is called in a pool of threads,
+    so rendering overlaps with the database and network input/output
+    """
+    if worker_count is None:
+        worker_count = getattr(django_settings, 'ASKBOT_EMAIL_RENDER_WORKERS', 1)
+    items = list(items)
+    worker_count = min(worker_count, len(items))
+    if worker_count <= 1:
+        results = [render(item) for item in items]
+        return [result for result in results if result is not None]
+
+    results = [None] * len(items)
+    errors = list()
+    position_queue = Queue.Queue()
+    for position in range(len(items)):
+        position_queue.put(position)
+
+    def run_worker():
+        try:
+            while len(errors) == 0:
+                try:
+                    position = position_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                results[position] = render(items[position])
+        except Exception, error:
+            errors.append(error)
+        #database connections are per thread
+        db_connection.close()
+
+    workers = list()
+    for i in range(worker_count):
+        worker = threading.Thread(target = run_worker)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+    return [result for result in results if result is not None]
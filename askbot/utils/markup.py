@@ -1,6 +1,24 @@
+"""Conversion of the markdown text of the posts to html
+
+:func:`markdown_to_html` converts the text and sanitizes the result.
+Parsers are reused - every thread keeps its own instances, one per
+combination of the settings which change the output.
+
+Rendered html is memoized by the hash of the text and of those settings,
+in the memory of the process - up to ``ASKBOT_MARKUP_CACHE_SIZE`` entries
+(django setting, 1000 by default, least recently used entries are dropped) -
+and in the shared cache for ``ASKBOT_MARKUP_CACHE_TIMEOUT`` seconds
+(one week by default, 0 disables the shared cache tier).
+Text that was rendered once, e.g. an unchanged revision, is not parsed again.
+"""
+import hashlib
 import re
+import threading
+from django.conf import settings as django_settings
+from django.core.cache import cache
 from askbot import const
 from askbot.conf import settings as askbot_settings
+from askbot.utils.html import sanitize_html
 from markdown2 import Markdown
 
 #url taken from http://regexlib.com/REDetails.aspx?regexp_id=501 by Brian Bothwell
@@ -10,13 +28,36 @@ LINK_PATTERNS = [
     (URL_RE, r'\1'),
 ]
 
-def get_parser():
+#change when the output of the parser or of the sanitizer changes,
+#so that the html rendered by the older code is not reused
+RENDERER_VERSION = 1
+
+def get_cache_size():
+    return getattr(django_settings, 'ASKBOT_MARKUP_CACHE_SIZE', 1000)
+
+def get_cache_timeout():
+    return getattr(django_settings, 'ASKBOT_MARKUP_CACHE_TIMEOUT', 7*24*3600)
+
+def get_parser_settings():
+    """returns tuple of values of the settings
+    which change the output of the parser:
+    (code friendly markup, video embedding)
+    """
+    return (
+        bool(
+            askbot_settings.ENABLE_MATHJAX or \
+            askbot_settings.MARKUP_CODE_FRIENDLY
+        ),
+        bool(askbot_settings.ENABLE_VIDEO_EMBEDDING)
+    )
+
+def make_parser(parser_settings):
+    code_friendly, video_embedding = parser_settings
     extras = ['link-patterns', 'video']  
-    if askbot_settings.ENABLE_MATHJAX or \
-        askbot_settings.MARKUP_CODE_FRIENDLY:
+    if code_friendly:
         extras.append('code-friendly')
 
-    if askbot_settings.ENABLE_VIDEO_EMBEDDING:
+    if video_embedding:
         #note: this requires a forked version of markdown2 module
         #pip uninstall markdown2
         #pip install -e git+git://github.com/andryuha/python-markdown2.git
@@ -28,6 +69,114 @@ def get_parser():
                 link_patterns = LINK_PATTERNS
             )
 
+THREAD_PARSERS = threading.local()
+
+def get_parser(parser_settings = None):
+    """returns markdown parser of the current thread
+    for the given or for the current settings,
+    parser is created on the first use
+
+    Parser instances are not thread safe, but may be reused,
+    because ``Markdown.convert()`` resets their state.
+    """
+    if parser_settings is None:
+        parser_settings = get_parser_settings()
+    parsers = getattr(THREAD_PARSERS, 'parsers', None)
+    if parsers is None:
+        parsers = THREAD_PARSERS.parsers = dict()
+    parser = parsers.get(parser_settings, None)
+    if parser is None:
+        parser = make_parser(parser_settings)
+        parsers[parser_settings] = parser
+    return parser
+
+
+class RenderCache(object):
+    """memory of the process for the recently rendered html,
+    least recently used entries are dropped when the size
+    goes over the limit
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = dict()#key -> [html, tick of the last use]
+        self.tick = 0
+
+    def get(self, key):
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                return None
+            self.tick += 1
+            entry[1] = self.tick
+            return entry[0]
+        finally:
+            self.lock.release()
+
+    def set(self, key, html):
+        max_size = get_cache_size()
+        if max_size <= 0:
+            return
+        self.lock.acquire()
+        try:
+            self.tick += 1
+            self.entries[key] = [html, self.tick]
+            if len(self.entries) > max_size:
+                self.evict(max_size)
+        finally:
+            self.lock.release()
+
+    def evict(self, max_size):
+        """drops the least recently used entries,
+        a quarter of the limit at once, so that
+        the sorting is not repeated on every insert
+        """
+        keep_count = max_size - max_size / 4
+        ticks = sorted([entry[1] for entry in self.entries.values()])
+        threshold = ticks[-keep_count] if keep_count > 0 else self.tick + 1
+        for key, entry in self.entries.items():
+            if entry[1] < threshold:
+                del self.entries[key]
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries = dict()
+        finally:
+            self.lock.release()
+
+
+RENDER_CACHE = RenderCache()
+
+def get_render_cache_key(text, parser_settings):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    digest = hashlib.md5('%r:%s' % (parser_settings, text)).hexdigest()
+    return 'askbot-markup-%d-%s' % (RENDERER_VERSION, digest)
+
+def render(text, parser_settings):
+    """converts markdown to html without the caches"""
+    return sanitize_html(get_parser(parser_settings).convert(text))
+
+def markdown_to_html(text):
+    """returns sanitized html for the markdown text,
+    see the module docstring about the caches"""
+    parser_settings = get_parser_settings()
+    key = get_render_cache_key(text, parser_settings)
+    html = RENDER_CACHE.get(key)
+    if html is not None:
+        return html
+
+    timeout = get_cache_timeout()
+    if timeout > 0:
+        html = cache.get(key)
+    if html is None:
+        html = render(text, parser_settings)
+        if timeout > 0:
+            cache.set(key, html, timeout)
+    RENDER_CACHE.set(key, html)
+    return html
+
 
 def format_mention_in_html(mentioned_user):
     url = mentioned_user.get_profile_url()
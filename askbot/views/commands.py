@@ -10,6 +10,7 @@ from django.core import exceptions
 from django.core.urlresolvers import reverse
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponseNotModified
 from django.forms import ValidationError
 from django.shortcuts import get_object_or_404
 from django.views.decorators import csrf
@@ -17,6 +18,7 @@ from django.utils import simplejson
 from django.utils.translation import ugettext as _
 from askbot import models
 from askbot import forms
+from askbot.models import tag_lookup
 from askbot.conf import should_show_sort_by_relevance
 from askbot.conf import settings as askbot_settings
 from askbot.utils import decorators
@@ -356,26 +358,52 @@ def get_tags_by_wildcard(request):
     """returns an json encoded array of tag names
     in the response to a wildcard tag name
     """
-    matching_tags = models.Tag.objects.get_by_wildcards(
-                        [request.GET['wildcard'],]
-                    )
-    count = matching_tags.count()
-    names = matching_tags.values_list('name', flat = True)[:20]
-    re_data = simplejson.dumps({'tag_count': count, 'tag_names': list(names)})
+    #wildcard is the prefix followed by the asterisk
+    prefix = request.GET['wildcard'][:-1]
+    count = tag_lookup.count_tags(prefix, case_sensitive = True)
+    names = tag_lookup.get_tag_names(prefix, limit = 20, case_sensitive = True)
+    re_data = simplejson.dumps({'tag_count': count, 'tag_names': names})
     return HttpResponse(re_data, mimetype = 'application/json')
 
+@decorators.get_only
+def get_tags_by_prefix(request):
+    """returns names of the most used tags starting
+    with the prefix given in the parameter ``q``, one per line,
+    at most ``limit`` of them (parameter, 10 by default)
+
+    the prefix is matched case-insensitively
+    """
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    limit = max(1, min(limit, 50))
+    tag_names = tag_lookup.get_tag_names(request.GET.get('q', ''), limit)
+    output = '\n'.join(tag_names)
+    return HttpResponse(output, mimetype = "text/plain")
+
 @decorators.get_only
 def get_tag_list(request):
     """returns tags to use in the autocomplete
     function
+
+    version of the tag list is sent as the ETag, so that
+    the clients can revalidate their copies; if the current
+    version is given in the parameter ``v``, the response
+    can be cached without the revalidation
     """
-    tag_names = models.Tag.objects.filter(
-                        deleted = False
-                    ).values_list(
-                        'name', flat = True
-                    )
-    output = '\n'.join(tag_names)
-    return HttpResponse(output, mimetype = "text/plain")
+    version, output = tag_lookup.get_tag_list()
+    etag = '"%s"' % version
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(output, mimetype = "text/plain")
+    response['ETag'] = etag
+    if request.GET.get('v') == str(version):
+        response['Cache-Control'] = 'public, max-age=31536000'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
 
 @csrf.csrf_protect
 def subscribe_for_tags(request):
@@ -9,6 +9,7 @@ from django.template import RequestContext
 from django.http import HttpResponseRedirect, HttpResponse
 from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
+from django.conf import settings as django_settings
 from django.views import static
 from django.views.decorators import csrf
 from django.db.models import Max, Count
@@ -128,4 +129,9 @@ def media(request, skin, resource):
     for the better efficiency of serving static files
     """
     dir = skins.utils.get_path_to_skin(skin)
-    return static.serve(request, '/media/' + resource, document_root = dir)
+    response = static.serve(request, '/media/' + resource, document_root = dir)
+    if 'v' in request.GET and \
+        getattr(django_settings, 'ASKBOT_MEDIA_FINGERPRINTS', False):
+        #url changes with the file content
+        response['Cache-Control'] = 'public, max-age=31536000'
+    return response
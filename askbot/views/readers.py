@@ -10,6 +10,7 @@ import datetime
 import logging
 import urllib
 from django.shortcuts import get_object_or_404
+from django.conf import settings as django_settings
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.template import Context
@@ -25,14 +26,16 @@ from django.contrib.humanize.templatetags import humanize
 
 import askbot
 from askbot import exceptions
-from askbot.utils.diff import textDiff as htmldiff
 from askbot.forms import AdvancedSearchForm, AnswerForm, ShowQuestionForm
 from askbot import models
-from askbot.models.badges import award_badges_signal
+from askbot.models.viewer_state import ViewerState
+from askbot.models import view_counter
 from askbot import const
 from askbot.utils import functions
 from askbot.utils.decorators import anonymous_forbidden, ajax_only, get_only
-from askbot.search.state_manager import SearchState
+from askbot.search import state_storage
+from askbot.search import result_cache
+from askbot.search import paginator as search_paginator
 from askbot.templatetags import extra_tags
 from askbot.templatetags import extra_filters
 import askbot.conf
@@ -75,30 +78,59 @@ def questions(request):
         user_input = form.cleaned_data
     else:
         user_input = None
-    search_state = request.session.get('search_state', SearchState())
-    view_log = request.session['view_log']
+    search_state = state_storage.load_search_state(request)
+    view_log = state_storage.load_view_log(request)
     search_state.update(user_input, view_log, request.user)
-    request.session['search_state'] = search_state
-    request.session.modified = True
-
-    #force reset for debugging
-    #search_state.reset()
-    #request.session.modified = True
-
-    #todo: have this call implemented for sphinx, mysql and pgsql
-    (qs, meta_data, related_tags) = models.Question.objects.run_advanced_search(
-                                            request_user = request.user,
-                                            search_state = search_state,
-                                        )
-
-    paginator = Paginator(qs, search_state.page_size)
-
-    if paginator.num_pages < search_state.page:
-        raise Http404
-
-    page = paginator.page(search_state.page)
+    state_storage.save_search_state(request, search_state)
+
+    #anonymous visitors share the same few pages of the question list,
+    #so those are served from the cache of search results
+    cache_key = None
+    cached_data = None
+    if request.user.is_anonymous() and result_cache.is_enabled():
+        cache_key = result_cache.get_cache_key(search_state)
+        cached_data = result_cache.load(cache_key)
+
+    if cached_data:
+        paginator = search_paginator.OnePagePaginator(
+                                result_cache.get_questions(cached_data),
+                                search_state.page_size,
+                                cached_data['question_count']
+                            )
+        page = paginator.page(search_state.page)
+        meta_data = cached_data['meta_data']
+        related_tags = cached_data['related_tags']
+        contributors = result_cache.get_contributors(cached_data)
+    else:
+        #todo: have this call implemented for sphinx, mysql and pgsql
+        (qs, meta_data, related_tags) = models.Question.objects.run_advanced_search(
+                                                request_user = request.user,
+                                                search_state = search_state,
+                                            )
 
-    contributors = models.Question.objects.get_question_and_answer_contributors(page.object_list)
+        try:
+            page = search_paginator.get_page(
+                                    qs,
+                                    search_state = search_state,
+                                    user = request.user
+                                )
+        except EmptyPage:
+            raise Http404
+        paginator = page.paginator
+
+        contributors = list(
+            models.Question.objects.get_question_and_answer_contributors(
+                                                            page.object_list
+                                                        )
+        )
+        if cache_key:
+            result_cache.save(
+                        cache_key,
+                        page = page,
+                        related_tags = related_tags,
+                        contributors = contributors,
+                        meta_data = meta_data
+                    )
 
     paginator_context = {
         'is_paginated' : (paginator.count > search_state.page_size),
@@ -110,6 +142,7 @@ def questions(request):
         'next': page.next_page_number(),
         'base_url' : request.path + '?sort=%s&amp;' % search_state.sort,#todo in T sort=>sort_method
         'page_size' : search_state.page_size,#todo in T pagesize -> page_size
+        'next_cursor': search_paginator.get_next_cursor(page, search_state.sort),
     }
 
     if request.is_ajax():
@@ -147,7 +180,9 @@ def questions(request):
             search_tags = list(search_state.tags)
         query_data = {
             'tags': search_tags,
-            'sort_order': search_state.sort
+            'sort_order': search_state.sort,
+            'page': search_state.page,
+            'next_cursor': paginator_context['next_cursor'],
         }
         ajax_data = {
             #current page is 1 by default now
@@ -431,22 +466,10 @@ def question(request, id):#refactor - long subroutine. display question body, an
 
     logging.debug('answer_sort_method=' + unicode(answer_sort_method))
     #load answers
-    answers = question.get_answers(user = request.user)
-    answers = answers.select_related(depth=1)
-
-    user_answer_votes = {}
-    for answer in answers:
-        vote = answer.get_user_vote(request.user)
-        if vote is not None and not user_answer_votes.has_key(answer.id):
-            vote_value = -1
-            if vote.is_upvote():
-                vote_value = 1
-            user_answer_votes[answer.id] = vote_value
-
     view_dic = {"latest":"-added_at", "oldest":"added_at", "votes":"-score" }
     orderby = view_dic[answer_sort_method]
-    if answers is not None:
-        answers = answers.order_by("-accepted", orderby)
+    answers = question.get_answers(user = request.user)
+    answers = answers.select_related(depth=1).order_by("-accepted", orderby)
 
     filtered_answers = []
     for answer in answers:
@@ -475,10 +498,7 @@ def question(request, id):#refactor - long subroutine. display question body, an
         #todo: merge view counts per user and per session
         #1) view count per session
         update_view_count = False
-        if 'question_view_times' not in request.session:
-            request.session['question_view_times'] = {}
-
-        last_seen = request.session['question_view_times'].get(question.id, None)
+        last_seen = state_storage.load_question_view_time(request, question.id)
         updated_when, updated_who = question.get_last_update_info()
 
         if updated_who != request.user:
@@ -488,26 +508,24 @@ def question(request, id):#refactor - long subroutine. display question body, an
             else:
                 update_view_count = True
 
-        request.session['question_view_times'][question.id] = \
-                                                    datetime.datetime.now()
-
         if update_view_count:
+            #the time is stored only when the view is counted,
+            #so the session is not saved on the repeated views
+            state_storage.save_question_view_time(
+                                            request,
+                                            question.id,
+                                            datetime.datetime.now()
+                                        )
+            #the counter is saved in bulk later, badges
+            #for the question views are considered at that time
+            view_counter.record_view(question)
             question.view_count += 1
-            question.save()
 
         #2) question view count per user and clear response displays
         if request.user.is_authenticated():
             #get response notifications
             request.user.visit_question(question)
 
-        #3) send award badges signal for any badges
-        #that are awarded for question views 
-        award_badges_signal.send(None,
-                        event = 'view_question',
-                        actor = request.user,
-                        context_object = question,
-                    )
-
     paginator_data = {
         'is_paginated' : (objects_list.count > const.ANSWERS_PAGE_SIZE),
         'pages': objects_list.num_pages,
@@ -521,33 +539,52 @@ def question(request, id):#refactor - long subroutine. display question body, an
     }
     paginator_context = extra_tags.cnprog_paginator(paginator_data)
 
-    favorited = question.has_favorite_by_user(request.user)
+    #votes, flags, favorite mark and comments for all displayed posts
+    viewer_state = ViewerState(
+                        user = request.user,
+                        question = question,
+                        answers = page_objects.object_list
+                    )
+
+    #the answer list is the same for all anonymous visitors
+    #and is cached, for the other users it depends on the viewer_state
     if request.user.is_authenticated():
-        question_vote = question.votes.select_related().filter(user=request.user)
+        answers_cache_key = None
     else:
-        question_vote = None #is this correct?
-    if question_vote is not None and question_vote.count() > 0:
-        question_vote = question_vote[0]
-
+        answers_cache_key = '%d-%s-%s-%s-%s-%s' % (
+                                question.id,
+                                question.get_page_cache_version(),
+                                answer_sort_method,
+                                show_page,
+                                getattr(show_post, 'id', ''),
+                                getattr(show_comment, 'id', '')
+                            )
 
     data = {
         'page_class': 'question-page',
         'active_tab': 'questions',
         'question' : question,
-        'question_vote' : question_vote,
-        'question_comment_count':question.comments.count(),
+        'question_vote' : viewer_state.get_vote(question),
+        'question_comment_count': len(viewer_state.get_comments(question)),
         'answer' : AnswerForm(question,request.user),
         'answers' : page_objects.object_list,
-        'user_answer_votes': user_answer_votes,
+        'user_answer_votes': viewer_state.get_answer_votes(),
+        'viewer_state': viewer_state,
         'tags' : question.tags.all(),
         'tab_id' : answer_sort_method,
-        'favorited' : favorited,
+        'favorited' : viewer_state.is_favorite,
         'similar_questions' : question.get_similar_questions(),
         'language_code': translation.get_language(),
         'paginator_context' : paginator_context,
         'show_post': show_post,
         'show_comment': show_comment,
-        'comment_order_number': comment_order_number
+        'comment_order_number': comment_order_number,
+        'answers_cache_key': answers_cache_key,
+        'page_cache_timeout': getattr(
+                                django_settings,
+                                'ASKBOT_QUESTION_PAGE_CACHE_TIMEOUT',
+                                600
+                            ),
     }
     return render_into_skin('question.html', data, request)
 
@@ -557,12 +594,12 @@ def revisions(request, id, object_name=None):
     revisions = list(post.revisions.all())
     revisions.reverse()
     for i, revision in enumerate(revisions):
-        revision.html = revision.as_html()
         if i == 0:
-            revision.diff = revisions[i].html
+            revision.get_diff()
+            revision.diff = revision.html
             revision.summary = _('initial version')
         else:
-            revision.diff = htmldiff(revisions[i-1].html, revision.html)
+            revision.get_diff(previous_revision = revisions[i-1])
     data = {
         'page_class':'revisions-page',
         'active_tab':'questions',
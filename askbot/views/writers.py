@@ -30,6 +30,7 @@ from askbot.skins.loaders import render_into_skin
 from askbot.utils import decorators
 from askbot.utils.functions import diff_date
 from askbot.utils import url_utils
+from askbot.search import state_storage
 from askbot.templatetags import extra_filters_jinja as template_filters
 from askbot.importers.stackexchange import management as stackexchange#todo: may change
 
@@ -249,10 +250,8 @@ def ask(request):#view used to ask a new question
             form.initial['title'] = request.GET['title']
         else:
             #attempt to extract title from previous search query
-            search_state = request.session.get('search_state',None)
-            if search_state:
-                query = search_state.query
-                form.initial['title'] = query
+            search_state = state_storage.load_search_state(request)
+            form.initial['title'] = search_state.query
 
     data = {
         'active_tab': 'ask',